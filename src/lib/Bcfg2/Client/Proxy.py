@@ -4,6 +4,7 @@ import time
 import socket
 import logging
 import Bcfg2.Options
+from Bcfg2.Utils import gzip_compress, gzip_decompress
 from Bcfg2.Compat import httplib, xmlrpclib, urlparse, quote_plus
 
 # The ssl module is provided by either Python 2.6 or a separate ssl
@@ -231,9 +232,14 @@ class SSLHTTPConnection(httplib.HTTPConnection):
 
 
 class XMLRPCTransport(xmlrpclib.Transport):
+    # ask for gzip-compressed responses where xmlrpclib supports
+    # it; compression of requests is handled in send_content()
+    accept_gzip_encoding = True
+    encode_threshold = None
+
     def __init__(self, key=None, cert=None, ca=None,
                  scns=None, use_datetime=0, timeout=90,
-                 protocol='xmlrpc/tlsv1'):
+                 protocol='xmlrpc/tlsv1', compression_threshold=None):
         if hasattr(xmlrpclib.Transport, '__init__'):
             xmlrpclib.Transport.__init__(self, use_datetime)
         self.key = key
@@ -242,6 +248,11 @@ class XMLRPCTransport(xmlrpclib.Transport):
         self.scns = scns
         self.timeout = timeout
         self.protocol = protocol
+        # requests larger than this are compressed, once the server
+        # has said that it accepts gzip encoding.  None disables
+        # compression of requests.
+        self.compression_threshold = compression_threshold
+        self.server_accepts_gzip = False
 
     def make_connection(self, host):
         host, self._extra_headers = self.get_host_info(host)[0:2]
@@ -253,6 +264,19 @@ class XMLRPCTransport(xmlrpclib.Transport):
                                  timeout=self.timeout,
                                  protocol=self.protocol)
 
+    def send_content(self, connection, request_body):
+        """ Send the request body, compressing it if it is large
+        and the server accepts compressed requests. """
+        if (self.compression_threshold is not None and
+                self.server_accepts_gzip and
+                len(request_body) > self.compression_threshold):
+            request_body = gzip_compress(request_body)
+            connection.putheader("Content-Encoding", "gzip")
+        connection.putheader("Content-Type", "text/xml")
+        connection.putheader("Content-Length", str(len(request_body)))
+        connection.endheaders()
+        connection.send(request_body)
+
     def request(self, host, handler, request_body, verbose=0):
         """Send request to server and return response."""
         try:
@@ -261,6 +285,8 @@ class XMLRPCTransport(xmlrpclib.Transport):
             errcode = response.status
             errmsg = response.reason
             headers = response.msg
+            encoding = response.getheader("Accept-Encoding", "")
+            self.server_accepts_gzip = "gzip" in encoding.lower()
         except (socket.error, SSL_ERROR, httplib.BadStatusLine):
             err = sys.exc_info()[1]
             raise ProxyError(xmlrpclib.ProtocolError(host + handler,
@@ -275,7 +301,13 @@ class XMLRPCTransport(xmlrpclib.Transport):
                                                      headers))
 
         self.verbose = verbose
-        return self.parse_response(response)
+        body = response.read()
+        if response.getheader("Content-Encoding", "").lower() == "gzip":
+            body = gzip_decompress(body)
+        parser, unmarshaller = self.getparser()
+        parser.feed(body)
+        parser.close()
+        return unmarshaller.close()
 
     if sys.hexversion < 0x03000000:
         # pylint: disable=E1101
@@ -297,6 +329,7 @@ class ComponentProxy(xmlrpclib.ServerProxy):
         Bcfg2.Options.Common.location, Bcfg2.Options.Common.ssl_ca,
         Bcfg2.Options.Common.password, Bcfg2.Options.Common.client_timeout,
         Bcfg2.Options.Common.protocol,
+        Bcfg2.Options.Common.compression_threshold,
         Bcfg2.Options.PathOption(
             '--ssl-key', cf=('communication', 'key'), dest="key",
             help='Path to SSL key'),
@@ -338,6 +371,7 @@ class ComponentProxy(xmlrpclib.ServerProxy):
             ca=Bcfg2.Options.setup.ca,
             scns=Bcfg2.Options.setup.ssl_cns,
             timeout=Bcfg2.Options.setup.client_timeout,
-            protocol=Bcfg2.Options.setup.protocol)
+            protocol=Bcfg2.Options.setup.protocol,
+            compression_threshold=Bcfg2.Options.setup.compression_threshold)
         xmlrpclib.ServerProxy.__init__(self, url,
                                        allow_none=True, transport=ssl_trans)
@@ -29,6 +29,9 @@ class APT(Bcfg2.Client.Tools.Tool):
     __handles__ = [('Package', 'deb'), ('Path', 'ignore')]
     __req__ = {'Package': ['name', 'version'], 'Path': ['type']}
 
+    # python-apt is not thread-safe
+    concurrent_inventory = False
+
     def __init__(self, config):
         Bcfg2.Client.Tools.Tool.__init__(self, config)
 
@@ -8,6 +8,7 @@ import Bcfg2.Options
 import Bcfg2.Client.Tools
 from datetime import datetime
 from Bcfg2.Compat import walk_packages
+from Bcfg2.Utils import parallel_map
 from Bcfg2.Client.Tools.POSIX.base import POSIXTool
 
 
@@ -25,7 +26,11 @@ class POSIX(Bcfg2.Client.Tools.Tool):
             help='Specify the number of paranoid copies you want'),
         Bcfg2.Options.BooleanOption(
             '-P', '--paranoid', cf=('client', 'paranoid'),
-            help='Make automatic backups of config files')]
+            help='Make automatic backups of config files'),
+        Bcfg2.Options.Option(
+            cf=('POSIX', 'verify_concurrency'), default=1, type=int,
+            dest='posix_verify_concurrency',
+            help='Number of Path entries to verify at once')]
 
     def __init__(self, config):
         Bcfg2.Client.Tools.Tool.__init__(self, config)
@@ -91,6 +96,12 @@ class POSIX(Bcfg2.Client.Tools.Tool):
             return False
         return True
 
+    def verify_entries(self, entries, modlist):
+        return parallel_map(lambda e: self.verify_entry(e, modlist),
+                            entries,
+                            Bcfg2.Options.setup.posix_verify_concurrency,
+                            name="POSIXVerify")
+
     def InstallPath(self, entry):
         """Dispatch install to the proper method according to type"""
         self.logger.debug("POSIX: Installing entry %s:%s:%s" %
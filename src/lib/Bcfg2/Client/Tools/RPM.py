@@ -1141,6 +1141,9 @@ class RPM(Bcfg2.Client.Tools.PkgTool):
     __req__ = {'Package': ['name', 'version']}
     __ireq__ = {'Package': ['url']}
 
+    # the rpm bindings are not thread-safe
+    concurrent_inventory = False
+
     __new_req__ = {'Package': ['name'],
                    'Instance': ['version', 'release', 'arch']}
     __new_ireq__ = {'Package': ['uri'],
@@ -59,6 +59,8 @@ def netmask_itoa(netmask, proto="ipv4"):
 class SELinux(Bcfg2.Client.Tools.Tool):
     """ SELinux entry support """
     name = 'SELinux'
+    # libsemanage handles are not thread-safe
+    concurrent_inventory = False
     __handles__ = [('SEBoolean', None),
                    ('SEFcontext', None),
                    ('SEInterface', None),
@@ -168,6 +168,9 @@ class YUM(Bcfg2.Client.Tools.PkgTool):
 
     conflicts = ['RPM']
 
+    # yum and the rpm bindings are not thread-safe
+    concurrent_inventory = False
+
     def __init__(self, config):
         self.yumbase = self._loadYumBase()
         Bcfg2.Client.Tools.PkgTool.__init__(self, config)
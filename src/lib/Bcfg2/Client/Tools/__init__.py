@@ -74,6 +74,13 @@ class Tool(object):
     #: runtime with a warning.
     conflicts = []
 
+    #: Whether this tool can take inventory at the same time as
+    #: other tools when ``inventory_concurrency`` is set.  Tools
+    #: that use libraries that are not thread-safe (e.g., the RPM
+    #: bindings) should set this to False; all such tools take
+    #: inventory one at a time.
+    concurrent_inventory = True
+
     def __init__(self, config):
         """
         :param config: The XML configuration for this client
@@ -193,28 +200,61 @@ class Tool(object):
         if not structures:
             structures = self.config.getchildren()
         mods = self.buildModlist()
+        entries = [entry
+                   for struct in structures
+                   for entry in struct.getchildren()
+                   if self.canVerify(entry)]
         states = dict()
-        for struct in structures:
-            for entry in struct.getchildren():
-                if self.canVerify(entry):
-                    try:
-                        func = getattr(self, "Verify%s" % entry.tag)
-                    except AttributeError:
-                        self.logger.error("%s: Cannot verify %s entries" %
-                                          (self.name, entry.tag))
-                        continue
-                    try:
-                        states[entry] = func(entry, mods)
-                    except KeyboardInterrupt:
-                        raise
-                    except:  # pylint: disable=W0702
-                        self.logger.error("%s: Unexpected failure verifying %s"
-                                          % (self.name,
-                                             self.primarykey(entry)),
-                                          exc_info=1)
+        for result in self.verify_entries(entries, mods):
+            if result is not None:
+                states[result[0]] = result[1]
         self.extra = self.FindExtra()
         return states
 
+    def verify_entries(self, entries, modlist):
+        """ Verify a list of entries by calling :func:`verify_entry`
+        on each of them in turn.  Tools that can safely verify
+        entries concurrently may override this.
+
+        :param entries: The entries to verify
+        :type entries: list of lxml.etree._Element
+        :param modlist: A list of all Path entries in the
+                        configuration, as returned by
+                        :func:`buildModlist`
+        :type modlist: list of strings
+        :returns: list of the return values of :func:`verify_entry`,
+                  in the same order as ``entries``
+        """
+        return [self.verify_entry(entry, modlist) for entry in entries]
+
+    def verify_entry(self, entry, modlist):
+        """ Verify a single entry by calling the ``Verify<tag>``
+        method for it.
+
+        :param entry: The entry to verify
+        :type entry: lxml.etree._Element
+        :param modlist: A list of all Path entries in the
+                        configuration
+        :type modlist: list of strings
+        :returns: tuple of ``(<entry>, <state>)``, or None if the
+                  entry could not be verified
+        """
+        try:
+            func = getattr(self, "Verify%s" % entry.tag)
+        except AttributeError:
+            self.logger.error("%s: Cannot verify %s entries" %
+                              (self.name, entry.tag))
+            return None
+        try:
+            return (entry, func(entry, modlist))
+        except KeyboardInterrupt:
+            raise
+        except:  # pylint: disable=W0702
+            self.logger.error("%s: Unexpected failure verifying %s" %
+                              (self.name, self.primarykey(entry)),
+                              exc_info=1)
+            return None
+
     def Install(self, entries):
         """ Install entries.  'Install' in this sense means either
         initially install, or update as necessary to match the
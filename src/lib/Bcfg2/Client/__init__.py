@@ -2,6 +2,7 @@
 
 import os
 import sys
+import copy
 import stat
 import time
 import fcntl
@@ -15,10 +16,11 @@ import Bcfg2.Options
 from Bcfg2.Client import XML
 from Bcfg2.Client import Proxy
 from Bcfg2.Client import Tools
-from Bcfg2.Utils import locked, Executor, safe_input
+from Bcfg2.Utils import locked, Executor, safe_input, parallel_map, \
+    probe_hash
 from Bcfg2.version import __version__
 # pylint: disable=W0622
-from Bcfg2.Compat import xmlrpclib, walk_packages, any, all, cmp
+from Bcfg2.Compat import xmlrpclib, walk_packages, any, all, cmp, md5
 # pylint: enable=W0622
 
 
@@ -95,6 +97,19 @@ class Client(object):
             cf=('client', 'probe_timeout'),
             type=Bcfg2.Options.Types.timeout,
             help="Timeout when running client probes"),
+        Bcfg2.Options.Option(
+            cf=('client', 'probe_concurrency'), type=int, default=1,
+            help="Number of client probes to run at once"),
+        Bcfg2.Options.Option(
+            cf=('client', 'inventory_concurrency'), type=int, default=1,
+            help="Number of client tools to take inventory with at once"),
+        Bcfg2.Options.PathOption(
+            cf=('client', 'probe_cache'), default='/var/cache/bcfg2/probes',
+            help="File to record hashes of uploaded probe output in"),
+        Bcfg2.Options.PathOption(
+            cf=('client', 'config_cache'),
+            help="File to keep a copy of the configuration in, so that "
+            "the server need not send it again if it is unchanged"),
         Bcfg2.Options.Option(
             "-b", "--only-bundles", default=[],
             type=Bcfg2.Options.Types.colon_list,
@@ -190,9 +205,14 @@ class Client(object):
             self.logger.error(message)
 
     def run_probe(self, probe):
-        """Execute probe."""
+        """Execute probe.  The probe is killed if it runs longer than
+        the timeout given in its ``timeout`` attribute, or than the
+        ``probe_timeout`` option if it has none.  The time the probe
+        took to run is recorded in :attr:`times` as
+        ``probe-<name>``."""
         name = probe.get('name')
         self.logger.info("Running probe %s" % name)
+        start = time.time()
         ret = XML.Element("probe-data", name=name, source=probe.get('source'))
         try:
             scripthandle, scriptname = tempfile.mkstemp()
@@ -213,7 +233,18 @@ class Client(object):
                          stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH |
                          stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH |
                          stat.S_IWUSR)  # 0755
-                rv = self.cmd.run(scriptname)
+                timeout = probe.get('timeout')
+                if timeout is not None:
+                    timeout = float(timeout)
+                # run the probe in its own session so that any
+                # processes it starts are killed with it on timeout.
+                # probes run in threads, so use the fork-safe
+                # start_new_session where it is available
+                if sys.hexversion >= 0x03020000:
+                    session = dict(start_new_session=True)
+                else:
+                    session = dict(preexec_fn=os.setsid)
+                rv = self.cmd.run(scriptname, timeout=timeout, **session)
                 if rv.stderr:
                     self.logger.warning("Probe %s has error output: %s" %
                                         (name, rv.stderr))
@@ -231,8 +262,98 @@ class Client(object):
             raise
         except:
             self._probe_failure(name, sys.exc_info()[1])
+        finally:
+            self.times['probe-%s' % name] = time.time() - start
         return ret
 
+    def run_probe_list(self, probes):
+        """ Execute a list of probes, running up to
+        ``probe_concurrency`` of them at once.
+
+        :param probes: The probes to run
+        :type probes: list of lxml.etree._Element
+        :returns: list of lxml.etree._Element - The ``probe-data``
+                  results, in the same order as the probes
+        """
+        return parallel_map(self.run_probe, probes,
+                            Bcfg2.Options.setup.probe_concurrency,
+                            name="ProbeWorker")
+
+    def _probe_hash(self, result):
+        """ Get the hash of a probe result, as the server computes it
+        from the uploaded probe data. """
+        return probe_hash(result.text)
+
+    def _load_probe_cache(self):
+        """ Load the hashes of the probe output that was last
+        uploaded to the server.
+
+        :returns: dict of (source, probe name) -> hash
+        """
+        rv = dict()
+        try:
+            cachefile = open(Bcfg2.Options.setup.probe_cache)
+            try:
+                for line in cachefile:
+                    fields = line.split(None, 2)
+                    if len(fields) == 3:
+                        rv[(fields[1], fields[2].rstrip('\n'))] = fields[0]
+            finally:
+                cachefile.close()
+        except IOError:
+            pass
+        return rv
+
+    def _save_probe_cache(self, probedata):
+        """ Record the hashes of the probe output that has been
+        uploaded to the server.  Failure to write the file is not
+        fatal; the next run will simply upload all probe output. """
+        path = Bcfg2.Options.setup.probe_cache
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path),
+                                           prefix=".probes")
+            cachefile = os.fdopen(fd, 'w')
+            try:
+                for result in probedata:
+                    cachefile.write("%s %s %s\n" % (self._probe_hash(result),
+                                                    result.get('source'),
+                                                    result.get('name')))
+            finally:
+                cachefile.close()
+            os.rename(tmpname, path)
+        except (IOError, OSError):
+            self.logger.debug("Failed to write probe cache %s: %s" %
+                              (path, sys.exc_info()[1]))
+
+    def _get_conditional_probedata(self, probes, probedata):
+        """ Get a copy of the probe data to upload in which the
+        output of each probe that is unchanged since the last upload
+        is replaced by an ``unchanged`` marker giving its hash.  This
+        is only done for probes that the server has marked as
+        ``conditional``.
+
+        :returns: lxml.etree._Element, or None if no probe output is
+                  unchanged
+        """
+        cache = self._load_probe_cache()
+        rv = XML.Element("ProbeData")
+        unchanged = 0
+        for probe, result in zip(probes, probedata):
+            key = (result.get('source'), result.get('name'))
+            digest = self._probe_hash(result)
+            if (probe.get('conditional', 'false').lower() == 'true' and
+                    cache.get(key) == digest):
+                XML.SubElement(rv, "probe-data", name=result.get('name'),
+                               source=result.get('source'), unchanged=digest)
+                unchanged += 1
+            else:
+                rv.append(copy.copy(result))
+        if unchanged:
+            self.logger.debug("Output of %s probe(s) is unchanged" %
+                              unchanged)
+            return rv
+        return None
+
     def fatal_error(self, message):
         """Signal a fatal error."""
         self.logger.error("Fatal error: %s" % (message))
@@ -263,22 +384,115 @@ class Client(object):
         self.times['probe_download'] = time.time()
 
         # execute probes
+        probelist = probes.findall(".//probe")
         probedata = XML.Element("ProbeData")
-        for probe in probes.findall(".//probe"):
-            probedata.append(self.run_probe(probe))
+        for result in self.run_probe_list(probelist):
+            probedata.append(result)
 
-        if len(probes.findall(".//probe")) > 0:
+        if len(probelist) > 0:
+            conditional = self._get_conditional_probedata(probelist,
+                                                          probedata)
             try:
                 # upload probe responses
-                self.proxy.RecvProbeData(
-                    XML.tostring(probedata,
-                                 xml_declaration=False).decode('utf-8'))
+                if conditional is not None:
+                    resend = self.proxy.RecvProbeData(
+                        XML.tostring(conditional, xml_declaration=False)
+                        .decode('utf-8'))
+                    if isinstance(resend, list) and resend:
+                        # the server may not have the data we claim is
+                        # unchanged (e.g., after a restart), so send
+                        # it all
+                        self.logger.info(
+                            "Server has no data for unchanged probe(s) %s, "
+                            "uploading all probe data" %
+                            ", ".join(name for _, name in resend))
+                        self.proxy.RecvProbeData(
+                            XML.tostring(probedata, xml_declaration=False)
+                            .decode('utf-8'))
+                else:
+                    self.proxy.RecvProbeData(
+                        XML.tostring(probedata,
+                                     xml_declaration=False).decode('utf-8'))
             except Proxy.ProxyError:
                 err = sys.exc_info()[1]
                 self.fatal_error("Failed to upload probe data: %s" % err)
+            self._save_probe_cache(probedata)
 
         self.times['probe_upload'] = time.time()
 
+    def _load_config_cache(self):
+        """ Read the copy of the configuration kept in the
+        ``config_cache`` file, if there is one.
+
+        :returns: bytes, or None if there is no usable copy
+        """
+        path = Bcfg2.Options.setup.config_cache
+        if not path:
+            return None
+        try:
+            cachefile = open(path, 'rb')
+            try:
+                return cachefile.read()
+            finally:
+                cachefile.close()
+        except IOError:
+            return None
+
+    def _save_config_cache(self, rawconfig):
+        """ Keep a copy of the configuration in the ``config_cache``
+        file.  Failure to write the file is not fatal. """
+        path = Bcfg2.Options.setup.config_cache
+        if not path:
+            return
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path),
+                                           prefix=".config")
+            cachefile = os.fdopen(fd, 'wb')
+            try:
+                cachefile.write(rawconfig)
+            finally:
+                cachefile.close()
+            os.rename(tmpname, path)
+        except (IOError, OSError):
+            self.logger.warning("Failed to write config cache file %s: %s" %
+                                (path, sys.exc_info()[1]))
+
+    def download_config(self):
+        """ Download the configuration from the server.  If a copy of
+        the last configuration is kept in the ``config_cache`` file,
+        its digest is sent along, and the copy is used if the server
+        reports that the configuration has not been modified.
+
+        :returns: bytes - the UTF-8 encoded configuration
+        """
+        cached = self._load_config_cache()
+        config = None
+        try:
+            if cached:
+                try:
+                    config = self.proxy.GetConfig(md5(cached).hexdigest())
+                except Proxy.ProxyError:
+                    # the server may not accept a digest
+                    self.logger.debug("Conditional configuration download "
+                                      "failed, downloading full "
+                                      "configuration: %s" %
+                                      sys.exc_info()[1])
+            if config is None:
+                config = self.proxy.GetConfig()
+        except Proxy.ProxyError:
+            err = sys.exc_info()[1]
+            self.fatal_error("Failed to download configuration from "
+                             "Bcfg2: %s" % err)
+
+        if cached and config.startswith("<NotModified"):
+            self.logger.info("Configuration has not been modified, using "
+                             "cached copy")
+            return cached
+        rawconfig = config.encode('utf-8')
+        if not config.startswith("<error"):
+            self._save_config_cache(rawconfig)
+        return rawconfig
+
     def get_config(self):
         """ load the configuration, either from the cached
         configuration file (-f), or from the server """
@@ -324,13 +538,7 @@ class Client(object):
                     err = sys.exc_info()[1]
                     self.fatal_error("Failed to get decision list: %s" % err)
 
-            try:
-                rawconfig = self.proxy.GetConfig().encode('utf-8')
-            except Proxy.ProxyError:
-                err = sys.exc_info()[1]
-                self.fatal_error("Failed to download configuration from "
-                                 "Bcfg2: %s" % err)
-
+            rawconfig = self.download_config()
             self.times['config_download'] = time.time()
 
         if Bcfg2.Options.setup.cache:
@@ -614,14 +822,53 @@ class Client(object):
         for struct in self.config.getchildren():
             for entry in struct.getchildren():
                 self.states[entry] = False
+
+        if Bcfg2.Options.setup.inventory_concurrency > 1:
+            # tools that can't take inventory at the same time as
+            # others share a single job
+            jobs = [[tool] for tool in self.tools
+                    if tool.concurrent_inventory]
+            serial = [tool for tool in self.tools
+                      if not tool.concurrent_inventory]
+            if serial:
+                jobs.append(serial)
+        else:
+            jobs = [self.tools]
+        tool_states = dict()
+
+        def run_job(tools):
+            """ take inventory with each of the given tools """
+            for tool in tools:
+                tool_states[tool] = self.run_inventory(tool)
+
+        parallel_map(run_job, jobs,
+                     Bcfg2.Options.setup.inventory_concurrency,
+                     name="InventoryWorker")
+        # merge in tool order, so the result is the same however the
+        # tools were run
         for tool in self.tools:
-            try:
-                self.states.update(tool.Inventory())
-            except KeyboardInterrupt:
-                raise
-            except:  # pylint: disable=W0702
-                self.logger.error("%s.Inventory() call failed:" % tool.name,
-                                  exc_info=1)
+            self.states.update(tool_states.get(tool, dict()))
+
+    def run_inventory(self, tool):
+        """ Take inventory with a single tool.  The time the tool
+        took is recorded in :attr:`times` as ``inventory-<tool>``.
+
+        :param tool: The tool to take inventory with
+        :type tool: Bcfg2.Client.Tools.Tool
+        :returns: dict - A dict of the state of entries suitable for
+                  updating :attr:`states`
+        """
+        start = time.time()
+        try:
+            return tool.Inventory()
+        except KeyboardInterrupt:
+            raise
+        except:  # pylint: disable=W0702
+            self.logger.error("%s.Inventory() call failed:" % tool.name,
+                              exc_info=1)
+            return dict()
+        finally:
+            self.times['inventory-%s' % tool.name] = time.time() - start
 
     def Decide(self):  # pylint: disable=R0912
         """Set self.whitelist based on user interaction."""
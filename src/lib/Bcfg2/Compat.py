@@ -37,6 +37,12 @@ try:
 except ImportError:
     from io import StringIO
 
+try:
+    from io import BytesIO
+except ImportError:
+    # py2.4 and 2.5 have no io module
+    from cStringIO import StringIO as BytesIO
+
 try:
     import ConfigParser
 except ImportError:
@@ -118,11 +124,37 @@ try:
 except NameError:
     input = input
 
+# re-raising an exception with its original traceback is a syntax
+# error in one version or the other
+if sys.hexversion >= 0x03000000:
+    def _reraise(exc_info):
+        raise exc_info[1].with_traceback(exc_info[2])
+else:
+    exec("def _reraise(exc_info):\n"  # pylint: disable=W0122
+         "    raise exc_info[0], exc_info[1], exc_info[2]\n")
+
+
+def reraise(exc_info):
+    """ Raise an exception with the traceback it was first raised
+    with, e.g., in another thread.
+
+    :param exc_info: The exception, as returned by
+                     :func:`sys.exc_info`
+    :type exc_info: tuple
+    """
+    _reraise(exc_info)
+
+
 try:
     reduce = reduce
 except NameError:
     from functools import reduce
 
+try:
+    intern = intern
+except NameError:
+    from sys import intern
+
 try:
     from collections import MutableMapping
 except ImportError:
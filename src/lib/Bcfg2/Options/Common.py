@@ -122,6 +122,12 @@ class Common(object):
         cf=('mdata', 'paranoid'), dest="default_paranoid", default='true',
         choices=['true', 'false'], help='Default Path paranoid setting')
 
+    #: Size above which XML-RPC messages are compressed
+    compression_threshold = Option(
+        cf=('communication', 'compression_threshold'),
+        type=Types.size, default=8192,
+        help='Compress XML-RPC messages larger than this many bytes')
+
     #: Client timeout
     client_timeout = Option(
         "-t", "--timeout", type=float, default=90.0, dest="client_timeout",
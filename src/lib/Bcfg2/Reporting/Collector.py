@@ -16,6 +16,8 @@ except ImportError:
 
 import Bcfg2.Logger
 import Bcfg2.Options
+from Bcfg2.Compat import Queue, Full, Empty
+from Bcfg2.Server.Statistics import Statistics
 from Bcfg2.Reporting.Transport.base import TransportError
 from Bcfg2.Reporting.Transport.DirectStore import DirectStore
 from Bcfg2.Reporting.Storage.base import StorageError
@@ -28,35 +30,58 @@ class ReportingError(Exception):
 
 
 class ReportingStoreThread(threading.Thread):
-    """Thread for calling the storage backend"""
-    def __init__(self, interaction, storage, group=None, target=None,
-                 name=None, semaphore=None, args=(), kwargs=None):
-        """Initialize the thread with a reference to the interaction
-        as well as the storage engine to use"""
-        threading.Thread.__init__(self, group, target, name, args,
-                                  kwargs or dict())
-        self.interaction = interaction
-        self.storage = storage
+    """Worker thread that imports interactions from the collector's
+    queue into the storage backend"""
+    def __init__(self, collector, name=None):
+        """Initialize the thread with a reference to the collector,
+        whose queue, storage engine and batch size it uses"""
+        threading.Thread.__init__(self, name=name)
+        self.collector = collector
+        self.queue = collector.queue
+        self.storage = collector.storage
+        self.batch_size = max(Bcfg2.Options.setup.reporting_batch_size, 1)
         self.logger = logging.getLogger('bcfg2-report-collector')
-        self.semaphore = semaphore
 
-    def run(self):
-        """Call the database storage procedure (aka import)"""
+    def get_batch(self):
+        """Get up to ``batch_size`` interactions from the queue,
+        waiting up to a second for the first one.  Returns a list of
+        (<time queued>, <interaction>) tuples."""
         try:
+            batch = [self.queue.get(True, 1)]
+        except Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def run(self):
+        """Call the database storage procedure (aka import) on
+        batches of interactions until the collector is shut down and
+        the queue is empty"""
+        while True:
+            batch = self.get_batch()
+            if not batch:
+                if self.collector.terminate.isSet():
+                    break
+                continue
+            start = time.time()
             try:
-                start = time.time()
-                self.storage.import_interaction(self.interaction)
-                self.logger.info("Imported interaction for %s in %ss" %
-                                 (self.interaction.get('hostname',
-                                                       '<unknown>'),
-                                  time.time() - start))
+                self.storage.import_interactions([i for _, i in batch])
+                self.logger.info(
+                    "Imported %d interaction(s) for %s in %ss" %
+                    (len(batch),
+                     ", ".join(i.get('hostname', '<unknown>')
+                               for _, i in batch),
+                     time.time() - start))
             except:
                 #TODO requeue?
                 self.logger.error("Unhandled exception in import thread %s" %
                                   sys.exc_info()[1])
-        finally:
-            if self.semaphore:
-                self.semaphore.release()
+            self.collector.record_import([queued for queued, _ in batch],
+                                         start, time.time())
 
 
 class ReportingCollector(object):
@@ -67,8 +92,19 @@ class ReportingCollector(object):
                Bcfg2.Options.Option(
                    '--max-children', dest="children",
                    cf=('reporting', 'max_children'), type=int,
-                   default=0,
-                   help='Maximum number of children for the reporting collector')]
+                   default=4,
+                   help='Number of worker threads for the reporting '
+                   'collector'),
+               Bcfg2.Options.Option(
+                   cf=('reporting', 'queue_size'), type=int,
+                   dest="reporting_queue_size", default=100,
+                   help='Maximum number of interactions waiting to be '
+                   'imported'),
+               Bcfg2.Options.Option(
+                   cf=('reporting', 'batch_size'), type=int,
+                   dest="reporting_batch_size", default=10,
+                   help='Maximum number of interactions to import in a '
+                   'single transaction')]
 
     def __init__(self):
         """Setup the collector.  This may be called by the daemon or though
@@ -76,12 +112,22 @@ class ReportingCollector(object):
         self.terminate = None
         self.context = None
         self.children = []
-        self.cleanup_threshold = 25
 
-        self.semaphore = None
-        if Bcfg2.Options.setup.children > 0:
-            self.semaphore = threading.Semaphore(
-                value=Bcfg2.Options.setup.children)
+        #: Interactions fetched from the transport, waiting to be
+        #: imported by the worker threads, as (<time queued>,
+        #: <interaction>) tuples.  When it is full, no more
+        #: interactions are fetched until the workers catch up.
+        self.queue = Queue(max(Bcfg2.Options.setup.reporting_queue_size,
+                               1))
+
+        #: Import time statistics
+        self.stats = Statistics()
+        self.stats_lock = threading.Lock()
+        self.imported = 0
+        self.started = time.time()
+
+        #: How often, in seconds, to log import statistics
+        self.stats_interval = 300
 
         if Bcfg2.Options.setup.debug:
             level = logging.DEBUG
@@ -125,7 +171,6 @@ class ReportingCollector(object):
         self.terminate = threading.Event()
         atexit.register(self.shutdown)
         self.context = daemon.DaemonContext(detach_process=True)
-        iter = 0
 
         if Bcfg2.Options.setup.daemon:
             self.logger.debug("Daemonizing")
@@ -157,24 +202,17 @@ class ReportingCollector(object):
             self.logger.info("Starting daemon")
 
         self.transport.start_monitor(self)
+        self.start_children()
 
+        last_stats = time.time()
         while not self.terminate.isSet():
             try:
+                if time.time() - last_stats >= self.stats_interval:
+                    self.log_statistics()
+                    last_stats = time.time()
                 interaction = self.transport.fetch()
-                if not interaction:
-                    continue
-                if self.semaphore:
-                    self.semaphore.acquire()
-                store_thread = ReportingStoreThread(interaction, self.storage,
-                                                    semaphore=self.semaphore)
-                store_thread.start()
-                self.children.append(store_thread)
-
-                iter += 1
-                if iter >= self.cleanup_threshold:
-                    self.reap_children()
-                    iter = 0
-
+                if interaction:
+                    self.enqueue(interaction)
             except (SystemExit, KeyboardInterrupt):
                 self.logger.info("Shutting down")
                 self.shutdown()
@@ -182,6 +220,75 @@ class ReportingCollector(object):
                 self.logger.error("Unhandled exception in main loop %s" %
                                   sys.exc_info()[1])
 
+    def start_children(self):
+        """Start the pool of worker threads"""
+        for i in range(max(Bcfg2.Options.setup.children, 1)):
+            child = ReportingStoreThread(self, name="ReportingStore%d" % i)
+            child.start()
+            self.children.append(child)
+        self.logger.debug("Started %d worker threads" % len(self.children))
+
+    def enqueue(self, interaction):
+        """Add an interaction to the queue for the worker threads.
+        If the queue is full, this waits until there is room, so that
+        interactions stay in the transport until they can be
+        imported."""
+        while True:
+            try:
+                self.queue.put((time.time(), interaction), True, 1)
+                return
+            except Full:
+                self.logger.debug("Queue is full, waiting for workers")
+
+    def record_import(self, queued, start, end):
+        """Record statistics about a batch of interactions that were
+        queued at the times in ``queued`` and imported between
+        ``start`` and ``end``"""
+        self.stats_lock.acquire()
+        try:
+            self.imported += len(queued)
+            self.stats.add_value("batch_size", len(queued))
+            for qtime in queued:
+                self.stats.add_value("queue_time", start - qtime)
+                self.stats.add_value("import_time",
+                                     (end - start) / len(queued))
+                self.stats.add_value("latency", end - qtime)
+        finally:
+            self.stats_lock.release()
+
+    def get_statistics(self):
+        """Get a dict of import statistics.  ``queue_time``,
+        ``import_time`` (per interaction), ``latency`` (from queueing
+        to import) and ``batch_size`` are (min, max, average, count)
+        tuples, as returned by
+        :func:`Bcfg2.Server.Statistics.Statistics.display`;
+        ``queue_depth`` is the number of interactions waiting to be
+        imported, and ``throughput`` the average number of
+        interactions imported per second."""
+        self.stats_lock.acquire()
+        try:
+            rv = self.stats.display()
+            rv['queue_depth'] = self.queue.qsize()
+            rv['throughput'] = \
+                self.imported / max(time.time() - self.started, 1)
+        finally:
+            self.stats_lock.release()
+        return rv
+
+    def log_statistics(self):
+        """Log a summary of the import statistics"""
+        stats = self.get_statistics()
+        if 'latency' in stats:
+            latency = stats['latency'][2]
+            import_time = stats['import_time'][2]
+        else:
+            latency = import_time = 0
+        self.logger.info("%d interaction(s) queued; imported %.2f per "
+                         "second, %.3fs average import time, %.3fs average "
+                         "latency" % (stats['queue_depth'],
+                                      stats['throughput'],
+                                      import_time, latency))
+
     def shutdown(self):
         """Cleanup and go"""
         if self.terminate:
@@ -192,18 +299,10 @@ class ReportingCollector(object):
                 self.transport.shutdown()
             except OSError:
                 pass
+        # the workers finish importing queued interactions first
+        for child in self.children:
+            child.join()
+            self.logger.debug("Joined child thread %s" % child.getName())
+        self.children = []
         if self.storage:
             self.storage.shutdown()
-
-    def reap_children(self):
-        """Join any non-live threads"""
-        newlist = []
-
-        self.logger.debug("Starting reap_children")
-        for child in self.children:
-            if child.isAlive():
-                newlist.append(child)
-            else:
-                child.join()
-                self.logger.debug("Joined child thread %s" % child.getName())
-        self.children = newlist
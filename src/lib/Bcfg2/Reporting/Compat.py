@@ -14,3 +14,27 @@ try:
 except ImportError:
     # Django > 1.6
     from django.conf.urls import url, patterns
+
+
+def can_bulk_create(model):
+    """ Return True if objects of the given model can be inserted
+    with ``bulk_create()``, which was added in Django 1.4 and does not
+    support multi-table inherited models. """
+    return (hasattr(model.objects, "bulk_create") and
+            not model._meta.parents)  # pylint: disable=W0212
+
+
+def bulk_create(model, objects):
+    """ Insert a list of unsaved ``model`` objects with as few queries
+    as possible.  SQLite allows at most 999 parameters in a query, so
+    the objects are inserted in batches that stay below that.  If the
+    objects can't be bulk created, they are saved one at a time. """
+    if can_bulk_create(model):
+        # pylint: disable=W0212
+        batch_size = max(1, 999 // len(model._meta.fields))
+        # pylint: enable=W0212
+        for i in range(0, len(objects), batch_size):
+            model.objects.bulk_create(objects[i:i + batch_size])
+    else:
+        for obj in objects:
+            obj.save()
@@ -21,7 +21,7 @@ from django import db
 import difflib
 from Bcfg2.Compat import b64decode
 from Bcfg2.Reporting.models import *
-from Bcfg2.Reporting.Compat import transaction
+from Bcfg2.Reporting.Compat import transaction, bulk_create
 
 
 class DjangoORM(StorageBase):
@@ -36,11 +36,13 @@ class DjangoORM(StorageBase):
     def _import_default(self, entry, state, entrytype=None, defaults=None,
                         mapping=None, boolean=None, xforms=None):
         """ Default entry importer.  Maps the entry (in state
-        ``state``) to an appropriate *Entry object; by default, this
-        is determined by the entry tag, e.g., from an Action entry an
-        ActionEntry object is created.  This can be overridden with
-        ``entrytype``, which should be the class to instantiate for
-        this entry.
+        ``state``) to an appropriate *Entry class and a dict of field
+        values, which are returned as a tuple; the entry objects are
+        looked up or created in bulk by :func:`_import_interaction`.
+        By default, the class is determined by the entry tag, e.g.,
+        from an Action entry an ActionEntry object is created.  This
+        can be overridden with ``entrytype``, which should be the
+        class to instantiate for this entry.
 
         ``defaults`` is an optional mapping of <attribute
         name>:<value> that will be used to set the default values for
@@ -91,7 +93,7 @@ class DjangoORM(StorageBase):
             val = entry.get(fieldname, defaults.get(attrname))
             act_dict[fieldname] = xforms.get(attrname, lambda v: v)(val)
         self.logger.debug("Adding %s:%s" % (entry.tag, entry.get("name")))
-        return entrytype.entry_get_or_create(act_dict)
+        return entrytype, act_dict
 
     def _import_Action(self, entry, state):
         return self._import_default(entry, state,
@@ -127,7 +129,25 @@ class DjangoORM(StorageBase):
             # not implemented yet
             act_dict['verification_details'] = \
                 entry.get('verification_details', '')
-        return PackageEntry.entry_get_or_create(act_dict)
+        return PackageEntry, act_dict
+
+    def _get_perms(self, owner, group, mode):
+        """ Get the FilePerms object for the given owner, group and
+        mode, creating it if necessary.  Most Path entries share a
+        few sets of permissions, so these are cached. """
+        key = "PERMS_%s_%s_%s" % (owner, group, mode)
+        fperm = cache.get(key)
+        if not fperm:
+            fperm, created = FilePerms.objects.get_or_create(owner=owner,
+                                                             group=group,
+                                                             mode=mode)
+            if created:
+                # entries are hashed with their permissions, so use
+                # the stored copy, which hashes the same way as it
+                # will when it is looked up later
+                fperm = FilePerms.objects.get(pk=fperm.pk)
+            cache.set(key, fperm)
+        return fperm
 
     def _import_Path(self, entry, state):
         name = entry.get('name')
@@ -142,8 +162,7 @@ class DjangoORM(StorageBase):
             mode=entry.get('mode', default=entry.get('perms',
                                                      default=""))
         )
-        fperm, created = FilePerms.objects.get_or_create(**target_dict)
-        act_dict['target_perms'] = fperm
+        act_dict['target_perms'] = self._get_perms(**target_dict)
 
         current_dict = dict(
             owner=entry.get('current_owner', default=""),
@@ -151,14 +170,13 @@ class DjangoORM(StorageBase):
             mode=entry.get('current_mode',
                 default=entry.get('current_perms', default=""))
         )
-        fperm, created = FilePerms.objects.get_or_create(**current_dict)
-        act_dict['current_perms'] = fperm
+        act_dict['current_perms'] = self._get_perms(**current_dict)
 
         if path_type in ('symlink', 'hardlink'):
             act_dict['target_path'] = entry.get('to', default="")
             act_dict['current_path'] = entry.get('current_to', default="")
             self.logger.debug("Adding link %s" % name)
-            return LinkEntry.entry_get_or_create(act_dict)
+            return LinkEntry, act_dict
         elif path_type == 'device':
             # TODO devices
             self.logger.warn("device path types are not supported yet")
@@ -191,7 +209,7 @@ class DjangoORM(StorageBase):
                 else:
                     act_dict['details'] = cdata
         self.logger.debug("Adding path %s" % name)
-        return PathEntry.entry_get_or_create(act_dict)
+        return PathEntry, act_dict
         # TODO - secontext
         # TODO - acls
 
@@ -257,6 +275,55 @@ class DjangoORM(StorageBase):
                           entry.tag)
         return None
 
+    def _get_or_create_named(self, model, names):
+        """ Get a list of ``model`` objects (i.e., Group or Bundle
+        objects) with the given names, creating any that don't exist.
+        Objects are looked up and created in bulk, and cached. """
+        prefix = model.__name__.upper() + "_"
+        cached = cache.get_many([prefix + name for name in names])
+        rv = dict([(name, cached[prefix + name]) for name in names
+                   if prefix + name in cached])
+        missing = [name for name in set(names) if name not in rv]
+        if missing:
+            rv.update(self._get_named(model, missing))
+            new = [name for name in missing if name not in rv]
+            if new:
+                bulk_create(model, [model(name=name) for name in new])
+                for name in new:
+                    self.logger.debug("Added %s %s" %
+                                      (model.__name__.lower(), name))
+                rv.update(self._get_named(model, new))
+            cache.set_many(dict([(prefix + name, rv[name])
+                                 for name in missing]))
+        return [rv[name] for name in names]
+
+    def _get_named(self, model, names):
+        """ Get a dict of <name>:<object> for the ``model`` objects
+        with the given names that exist. """
+        rv = dict()
+        # batch this for sqlite
+        for i in range(0, len(names), 100):
+            for obj in model.objects.filter(name__in=names[i:i + 100]):
+                rv[obj.name] = obj
+        return rv
+
+    def _add_related(self, inter, fieldname, objects):
+        """ Add ``objects`` to the many-to-many field ``fieldname`` of
+        the new interaction ``inter``.  Unlike ``add()``, this doesn't
+        look for existing relations, and inserts all of the rows of
+        the intermediate table in bulk. """
+        field = Interaction._meta.get_field(fieldname)
+        through = field.rel.through
+        seen = set()
+        rows = []
+        for obj in objects:
+            if obj.pk not in seen:
+                seen.add(obj.pk)
+                rows.append(through(**{
+                    field.m2m_field_name(): inter,
+                    field.m2m_reverse_field_name(): obj}))
+        bulk_create(through, rows)
+
     @transaction.atomic
     def _import_interaction(self, interaction):
         """Real import function"""
@@ -273,15 +340,15 @@ class DjangoORM(StorageBase):
             cache.set(hostname, client)
 
         timestamp = datetime(*strptime(stats.get('time'))[0:6])
-        if len(Interaction.objects.filter(client=client,
-                                          timestamp=timestamp)) > 0:
+        if Interaction.objects.filter(client=client,
+                                      timestamp=timestamp).exists():
             self.logger.warn("Interaction for %s at %s already exists" %
                     (hostname, timestamp))
             return
 
         if 'profile' in metadata:
-            profile, created = \
-                Group.objects.get_or_create(name=metadata['profile'])
+            profile = self._get_or_create_named(Group,
+                                                [metadata['profile']])[0]
         else:
             profile = None
 
@@ -292,47 +359,14 @@ class DjangoORM(StorageBase):
             if name in flags:
                 flags[name] = value
 
-        inter = Interaction(client=client,
-                             timestamp=timestamp,
-                             state=stats.get('state', default="unknown"),
-                             repo_rev_code=stats.get('revision',
-                                                          default="unknown"),
-                             good_count=stats.get('good', default="0"),
-                             total_count=stats.get('total', default="0"),
-                             server=server,
-                             profile=profile,
-                             **flags)
-        inter.save()
-        self.logger.debug("Interaction for %s at %s with INSERTED in to db" %
-                (client.id, timestamp))
-
-        # FIXME - this should be more efficient
-        for group_name in metadata['groups']:
-            group = cache.get("GROUP_" + group_name)
-            if not group:
-                group, created = Group.objects.get_or_create(name=group_name)
-                if created:
-                    self.logger.debug("Added group %s" % group)
-                cache.set("GROUP_" + group_name, group)
-
-            inter.groups.add(group)
-        for bundle_name in metadata.get('bundles', []):
-            bundle = cache.get("BUNDLE_" + bundle_name)
-            if not bundle:
-                bundle, created = \
-                    Bundle.objects.get_or_create(name=bundle_name)
-                if created:
-                    self.logger.debug("Added bundle %s" % bundle)
-                cache.set("BUNDLE_" + bundle_name, bundle)
-            inter.bundles.add(bundle)
-        inter.save()
-
         counter_fields = {TYPE_BAD: 0,
                           TYPE_MODIFIED: 0,
                           TYPE_EXTRA: 0}
         pattern = [('Bad/*', TYPE_BAD),
                    ('Extra/*', TYPE_EXTRA),
                    ('Modified/*', TYPE_MODIFIED)]
+        # map of <interaction field>:<list of (entry class, act_dict)>
+        # for each entry, which are looked up or created in bulk below
         updates = dict([(etype, []) for etype in Interaction.entry_types])
         for (xpath, state) in pattern:
             for entry in stats.findall(xpath):
@@ -344,8 +378,7 @@ class DjangoORM(StorageBase):
                     act_dict = dict(name=entry.get("name"),
                                     entry_type=entry.tag,
                                     message=failure)
-                    newact = FailureEntry.entry_get_or_create(act_dict)
-                    updates['failures'].append(newact)
+                    updates['failures'].append((FailureEntry, act_dict))
                     continue
 
                 updatetype = entry.tag.lower() + "s"
@@ -354,23 +387,47 @@ class DjangoORM(StorageBase):
                 if update is not None:
                     updates[updatetype].append(update)
 
-        inter.bad_count = counter_fields[TYPE_BAD]
-        inter.modified_count = counter_fields[TYPE_MODIFIED]
-        inter.extra_count = counter_fields[TYPE_EXTRA]
+        inter = Interaction(client=client,
+                             timestamp=timestamp,
+                             state=stats.get('state', default="unknown"),
+                             repo_rev_code=stats.get('revision',
+                                                          default="unknown"),
+                             good_count=stats.get('good', default="0"),
+                             total_count=stats.get('total', default="0"),
+                             bad_count=counter_fields[TYPE_BAD],
+                             modified_count=counter_fields[TYPE_MODIFIED],
+                             extra_count=counter_fields[TYPE_EXTRA],
+                             server=server,
+                             profile=profile,
+                             **flags)
         inter.save()
-        for entry_type in updates.keys():
-            # batch this for sqlite
-            i = 0
-            while(i < len(updates[entry_type])):
-                getattr(inter, entry_type).add(*updates[entry_type][i:i + 100])
-                i += 100
+        self.logger.debug("Interaction for %s at %s with INSERTED in to db" %
+                (client.id, timestamp))
+
+        self._add_related(
+            inter, 'groups',
+            self._get_or_create_named(Group, metadata['groups']))
+        self._add_related(
+            inter, 'bundles',
+            self._get_or_create_named(Bundle, metadata.get('bundles', [])))
+
+        for entry_type, specs in updates.items():
+            # a single interaction field can hold entries of several
+            # classes, e.g., PathEntry and LinkEntry objects in paths
+            act_dicts = dict()
+            for entrytype, act_dict in specs:
+                act_dicts.setdefault(entrytype, []).append(act_dict)
+            entries = []
+            for entrytype, dicts in act_dicts.items():
+                entries.extend(entrytype.entries_get_or_create(dicts))
+            self._add_related(inter, entry_type, entries)
 
         # performance metrics
-        for times in stats.findall('OpStamps'):
-            for metric, value in list(times.items()):
-                Performance(interaction=inter,
-                            metric=metric,
-                            value=value).save()
+        bulk_create(Performance,
+                    [Performance(interaction=inter, metric=metric,
+                                 value=value)
+                     for times in stats.findall('OpStamps')
+                     for metric, value in list(times.items())])
 
     def import_interaction(self, interaction):
         """Import the data into the backend"""
@@ -380,6 +437,36 @@ class DjangoORM(StorageBase):
             except:
                 self.logger.error("Failed to import interaction: %s" %
                         traceback.format_exc().splitlines()[-1])
+                # objects created in the failed transaction may
+                # have been cached
+                cache.clear()
+        finally:
+            self.logger.debug("%s: Closing database connection" %
+                              self.__class__.__name__)
+            db.close_connection()
+
+    @transaction.atomic
+    def _import_interactions(self, interactions):
+        """Import a batch of interactions in a single transaction.
+        Each interaction is imported in a nested transaction, so one
+        that fails is rolled back without losing the others."""
+        for interaction in interactions:
+            try:
+                self._import_interaction(interaction)
+            except:
+                self.logger.error("Failed to import interaction: %s" %
+                        traceback.format_exc().splitlines()[-1])
+                cache.clear()
+
+    def import_interactions(self, interactions):
+        """Import a batch of interactions into the backend"""
+        try:
+            try:
+                self._import_interactions(interactions)
+            except:
+                self.logger.error("Failed to import interactions: %s" %
+                        traceback.format_exc().splitlines()[-1])
+                cache.clear()
         finally:
             self.logger.debug("%s: Closing database connection" %
                               self.__class__.__name__)
@@ -26,6 +26,13 @@ class StorageBase(object):
         """Import the data into the backend"""
         raise NotImplementedError
 
+    def import_interactions(self, interactions):
+        """Import a batch of interactions into the backend.  Backends
+        that support transactions should import the whole batch in
+        one.  By default, each interaction is imported in turn."""
+        for interaction in interactions:
+            self.import_interaction(interaction)
+
     def validate(self):
         """Validate backend storage.  Should be called once when loaded"""
         raise NotImplementedError
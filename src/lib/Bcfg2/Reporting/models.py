@@ -13,6 +13,7 @@ from django.core.cache import cache
 from datetime import datetime, timedelta
 from Bcfg2.Compat import cPickle
 from Bcfg2.DBSettings import get_db_label
+from Bcfg2.Reporting.Compat import bulk_create, can_bulk_create
 
 
 TYPE_GOOD = 0
@@ -421,6 +422,53 @@ class BaseEntry(models.Model):
         cache.set(act_key, newact, 60 * 60)
         return newact
 
+    @classmethod
+    def entries_get_or_create(cls, act_dicts):
+        """ Look up or create an entry for each dict in ``act_dicts``,
+        like :func:`entry_get_or_create`, but with a fixed number of
+        queries per hundred entries rather than several per entry.
+        Returns a list of entries in the same order as ``act_dicts``.
+        """
+        cls_name = cls.__name__
+        hashes = [hash_entry(act_dict) for act_dict in act_dicts]
+        keys = dict([(act_hash, "%s_%s" % (cls_name, act_hash))
+                     for act_hash in hashes])
+        cached = cache.get_many(list(keys.values()))
+        entries = dict([(act_hash, cached[key])
+                        for act_hash, key in keys.items() if key in cached])
+        missing = [act_hash for act_hash in keys if act_hash not in entries]
+        entries.update(cls._get_by_hash(missing))
+
+        new = dict()
+        for act_hash, act_dict in zip(hashes, act_dicts):
+            if act_hash not in entries and act_hash not in new:
+                new[act_hash] = cls(hash_key=act_hash, **act_dict)
+        if new:
+            if can_bulk_create(cls):
+                bulk_create(cls, list(new.values()))
+                entries.update(cls._get_by_hash(list(new.keys())))
+            else:
+                for act_hash, newact in new.items():
+                    newact.save(hash_key=act_hash)
+                    entries[act_hash] = newact
+
+        cache.set_many(dict([(keys[act_hash], entries[act_hash])
+                             for act_hash in missing]), 60 * 60)
+        return [entries[act_hash] for act_hash in hashes]
+
+    @classmethod
+    def _get_by_hash(cls, hashes):
+        """ Get a dict of <hash key>:<entry> for the given hash keys.
+        As in :func:`entry_get_or_create`, the first entry found with
+        a hash key is used. """
+        rv = dict()
+        # batch this for sqlite
+        for i in range(0, len(hashes), 100):
+            for entry in cls.objects.filter(hash_key__in=hashes[i:i + 100]):
+                if entry.hash_key not in rv:
+                    rv[entry.hash_key] = entry
+        return rv
+
     def is_failure(self):
         return isinstance(self, FailureEntry)
 
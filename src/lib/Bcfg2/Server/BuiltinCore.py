@@ -137,6 +137,7 @@ class BuiltinCore(NetworkCore):
                                             port,
                                             socket.AF_UNSPEC,
                                             socket.SOCK_STREAM)[0][4]
+        threshold = Bcfg2.Options.setup.compression_threshold
         try:
             self.server = XMLRPCServer(Bcfg2.Options.setup.listen_all,
                                        server_address,
@@ -144,7 +145,8 @@ class BuiltinCore(NetworkCore):
                                        certfile=Bcfg2.Options.setup.cert,
                                        register=False,
                                        ca=Bcfg2.Options.setup.ca,
-                                       protocol=Bcfg2.Options.setup.protocol)
+                                       protocol=Bcfg2.Options.setup.protocol,
+                                       compression_threshold=threshold)
         except:  # pylint: disable=W0702
             err = sys.exc_info()[1]
             self.logger.error("Server startup failed: %s" % err)
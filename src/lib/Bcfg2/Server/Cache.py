@@ -40,6 +40,18 @@ This is mostly functionally identical to:
 
     Bcfg2.Server.Cache.expire("Probes", "probegroups", "foo.example.com")
 
+A bounded :class:`Bcfg2.Server.Cache.LRUCache` can be stored as a
+value in the unified cache in order to hold a large number of small
+items that should be evicted when the cache grows too big, while
+still being expired along with the rest of the data tagged the same
+way:
+
+.. code-block:: python
+
+    closures = Bcfg2.Server.Cache.Cache("Packages", "closures")
+    if key not in closures:
+        closures[key] = Bcfg2.Server.Cache.LRUCache(10000)
+
 It's not completely identical, though; the first example will expire,
 at most, exactly one item from the cache.  The second example will
 expire all items that are tagged with a superset of the given tags.
@@ -64,6 +76,7 @@ cache.  In this case, the latter call is equivalent to:
 
 """
 
+import threading
 from Bcfg2.Compat import MutableMapping
 
 
@@ -113,6 +126,87 @@ class _Cache(MutableMapping):
         return str(dict(self))
 
 
+class LRUCache(MutableMapping):
+    """ A dict-like cache that holds at most ``maxsize`` items,
+    evicting the least recently used item when a new item is added
+    to a full cache.  Both reading and writing an item count as
+    using it. """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+
+        #: Mapping of key -> [previous link, next link, key, value]
+        self._links = dict()
+
+        #: The sentinel of the circular, doubly linked list that
+        #: records the order in which keys were used, from least to
+        #: most recently used
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = threading.Lock()
+
+    def _unlink(self, link):
+        """ Remove a link from the usage list """
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _append(self, link):
+        """ Add a link to the most recently used end of the usage
+        list """
+        last = self._root[0]
+        link[0] = last
+        link[1] = self._root
+        last[1] = link
+        self._root[0] = link
+
+    def __getitem__(self, key):
+        self._lock.acquire()
+        try:
+            link = self._links[key]
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self._lock.release()
+
+    def __setitem__(self, key, value):
+        self._lock.acquire()
+        try:
+            if key in self._links:
+                link = self._links[key]
+                self._unlink(link)
+                link[3] = value
+            else:
+                if len(self._links) >= self.maxsize:
+                    oldest = self._root[1]
+                    self._unlink(oldest)
+                    del self._links[oldest[2]]
+                link = [None, None, key, value]
+                self._links[key] = link
+            self._append(link)
+        finally:
+            self._lock.release()
+
+    def __delitem__(self, key):
+        self._lock.acquire()
+        try:
+            self._unlink(self._links.pop(key))
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __iter__(self):
+        return iter(list(self._links.keys()))
+
+    def __len__(self):
+        return len(self._links)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.maxsize)
+
+
 class _CacheRegistry(dict):
     """ The grand unified cache backend which contains all cache
     items. """
@@ -3,6 +3,7 @@ implementations inherit from. """
 
 import os
 import pwd
+import copy
 import atexit
 import logging
 import select
@@ -19,8 +20,8 @@ import Bcfg2.DBSettings
 import Bcfg2.Server.Statistics
 import Bcfg2.Server.FileMonitor
 from itertools import chain
-from Bcfg2.Server.Cache import Cache
-from Bcfg2.Compat import xmlrpclib, wraps  # pylint: disable=W0622
+from Bcfg2.Server.Cache import Cache, add_expire_hook
+from Bcfg2.Compat import xmlrpclib, wraps, md5  # pylint: disable=W0622
 from Bcfg2.Server.Plugin.exceptions import *  # pylint: disable=W0401,W0614
 from Bcfg2.Server.Plugin.interfaces import *  # pylint: disable=W0401,W0614
 from Bcfg2.Server.Statistics import track_statistics
@@ -92,6 +93,40 @@ def close_db_connection(func):
     return inner
 
 
+def config_digest(config):
+    """ Get the digest of a serialized configuration document that
+    clients send to :func:`Core.GetConfig` to ask whether it has
+    changed.
+
+    :param config: The configuration document
+    :type config: string
+    :returns: string - the hex MD5 digest of the UTF-8 encoded
+              document
+    """
+    try:
+        config = config.encode('utf-8')
+    except (AttributeError, UnicodeDecodeError):
+        pass
+    return md5(config).hexdigest()
+
+
+def _expire_config_digests(tags, exact, _):
+    """ :func:`Bcfg2.Server.Cache.add_expire_hook` hook that forgets
+    the digests of the configurations sent to clients when the
+    Packages plugin reloads its sources, or when the metadata of any
+    client changes, since either can change client configurations
+    without any change to the repository.  Configurations can depend
+    on the metadata of other clients (e.g., ssh_known_hosts from
+    SSHbase, or templates that use ``metadata.query``), so all
+    digests are forgotten.  Exact expirations of a single client's
+    metadata only signal that the metadata object should be rebuilt,
+    so they are ignored. """
+    if ("Packages" in tags or "Metadata" in tags) and not exact:
+        Cache("Core", "configs").expire()
+
+add_expire_hook(_expire_config_digests)
+
+
 class CoreInitError(Exception):
     """ Raised when the server core cannot be initialized. """
     pass
@@ -145,7 +180,16 @@ class Core(object):
         Bcfg2.Options.Option(
             cf=('caching', 'client_metadata'), dest='client_metadata_cache',
             default='off',
-            choices=['off', 'on', 'initial', 'cautious', 'aggressive'])]
+            choices=['off', 'on', 'initial', 'cautious', 'aggressive']),
+        Bcfg2.Options.BooleanOption(
+            cf=('caching', 'bound_entries'), dest='bound_entry_cache',
+            help='Share bound entries among clients with identical groups'),
+        Bcfg2.Options.Option(
+            cf=('caching', 'client_specific_entries'),
+            dest='client_specific_entries', default=[],
+            type=Bcfg2.Options.Types.comma_list,
+            help='Entries that are always bound separately for each '
+            'client, given as <tag>:<name>')]
 
     #: The name of this server core. This can be overridden by core
     #: implementations to provide a more specific name.
@@ -260,6 +304,64 @@ class Core(object):
         #: metadata
         self.metadata_cache = Cache("Metadata")
 
+        #: Index of ``(<entry tag>, <entry name>) => [<generator>,
+        #: ...]`` built from the ``Entries`` dicts of all
+        #: :class:`Bcfg2.Server.Plugin.interfaces.Generator` plugins.
+        #: It is updated incrementally by
+        #: :func:`_update_generator_index` whenever the FAM has
+        #: handled events, and used by :func:`Bind` to find the
+        #: generator for an entry without walking every plugin.
+        self._generator_index = dict()
+
+        #: The set of ``(<entry tag>, <entry name>)`` keys that were
+        #: last indexed for each generator, keyed by plugin name.
+        self._generator_keys = dict()
+
+        #: List of ``(<generator>, <entry tag>)`` tuples for
+        #: ``Entries`` dicts that implement their own lookup semantics
+        #: (e.g., the fuzzy matching used by Pkgmgr), and so cannot
+        #: be indexed by exact name.
+        self._fuzzy_generators = []
+
+        #: Cache of ``<entry tag> => [<generator>, ...]`` listing the
+        #: generators whose ``HandlesEntry`` method can possibly claim
+        #: an entry with the given tag.
+        self._handles_entry_cache = dict()
+
+        #: The value of
+        #: :attr:`Bcfg2.Server.FileMonitor.FileMonitor.events_handled`
+        #: at the time the generator index was last updated.
+        self._generator_index_serial = None
+
+        #: Lock held while updating the generator index
+        self._generator_index_lock = threading.Lock()
+
+        #: A :class:`Bcfg2.Server.Cache.Cache` object for caching
+        #: bound entries that are shared among all clients in a
+        #: metadata equivalence class.  Keys are the equivalence
+        #: classes; values are dicts of bound entries.  See
+        #: :func:`_get_bound_entries`.
+        self.bound_entry_cache = Cache("Core", "bound")
+
+        #: The ``(<revision>, <FAM events handled>)`` tuple for which
+        #: :attr:`bound_entry_cache` was populated.
+        self._bound_entry_generation = None
+
+        #: A :class:`Bcfg2.Server.Cache.Cache` object that records,
+        #: for each client, the digest of the last configuration
+        #: built for it and the state it was built from.  See
+        #: :func:`GetConfig`.
+        self.config_digests = Cache("Core", "configs")
+
+        #: The ``(<FAM events handled>, <plugin change counters>)``
+        #: tuple last computed by :func:`_get_plugin_changes`
+        self._plugin_changes = (None, ())
+
+        #: A dict of FAM monitor handle ID -> the name of the plugin
+        #: whose directory the monitor watches, or None.  See
+        #: :func:`_get_plugin_changes`.
+        self._monitor_owners = dict()
+
         #: Whether or not it's possible to use the Django database
         #: backend for plugins that have that capability
         self._database_available = False
@@ -647,21 +749,27 @@ class Core(object):
                 self.logger.error("Falling back to %s:%s" %
                                   (entry.tag, entry.get('name')))
 
-        generators = self.plugins_by_type(Generator)
-        glist = [gen for gen in generators
-                 if entry.get('name') in gen.Entries.get(entry.tag, {})]
+        self._update_generator_index()
+        glist = self._generator_index.get((entry.tag, entry.get('name')), [])
+        for gen, tag in self._fuzzy_generators:
+            if (tag == entry.tag and gen not in glist and
+                    entry.get('name') in gen.Entries.get(tag, {})):
+                glist = glist + [gen]
         if len(glist) == 1:
-            return glist[0].Entries[entry.tag][entry.get('name')](entry,
-                                                                  metadata)
+            return self._bind_entry(
+                glist[0], glist[0].Entries[entry.tag][entry.get('name')],
+                entry, metadata)
         elif len(glist) > 1:
-            generators = ", ".join([gen.name for gen in glist])
-            self.logger.error("%s %s served by multiple generators: %s" %
-                              (entry.tag, entry.get('name'), generators))
-        g2list = [gen for gen in generators
+            # conflicts are reported when the index is built
+            self.logger.debug("%s %s served by multiple generators: %s" %
+                              (entry.tag, entry.get('name'),
+                               ", ".join([gen.name for gen in glist])))
+        g2list = [gen for gen in self._get_entry_handlers(entry.tag)
                   if gen.HandlesEntry(entry, metadata)]
         try:
             if len(g2list) == 1:
-                return g2list[0].HandleEntry(entry, metadata)
+                return self._bind_entry(g2list[0], g2list[0].HandleEntry,
+                                        entry, metadata)
             entry.set('failure', 'no matching generator')
             raise PluginExecutionError("No matching generator: %s:%s" %
                                        (entry.tag, entry.get('name')))
@@ -671,6 +779,169 @@ class Core(object):
                                                      entry.tag),
                                                     time.time() - start)
 
+    def _bind_entry(self, generator, binder, entry, metadata):
+        """ Bind a single entry by calling ``binder``.  If
+        ``[caching] bound_entries`` is enabled and the generator does
+        not declare the entry to be client-specific (see
+        :func:`Bcfg2.Server.Plugin.interfaces.Generator.is_client_specific`),
+        the entry is bound once per metadata equivalence class and
+        the bound entry is copied for all other clients in the class.
+
+        :param generator: The generator that binds the entry
+        :type generator: Bcfg2.Server.Plugin.interfaces.Generator
+        :param binder: The callable that binds the entry
+        :type binder: callable
+        :param entry: The entry to bind.  Modified in-place.
+        :type entry: lxml.etree._Element
+        :param metadata: Client metadata to bind the entry for
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        """
+        if (not Bcfg2.Options.setup.bound_entry_cache or
+                "%s:%s" % (entry.tag, entry.get('realname',
+                                                entry.get('name'))) in
+                Bcfg2.Options.setup.client_specific_entries or
+                generator.is_client_specific(entry, metadata)):
+            return binder(entry, metadata)
+
+        start = time.time()
+        bound_entries = self._get_bound_entries(metadata)
+        key = (generator.name, entry.tag, tuple(sorted(entry.attrib.items())))
+        bound = bound_entries.get(key)
+        if bound is None:
+            rv = binder(entry, metadata)
+            bound_entries[key] = copy.deepcopy(entry)
+            Bcfg2.Server.Statistics.stats.add_value(
+                "%s:bound_entry_cache_miss" % self.__class__.__name__,
+                time.time() - start)
+            return rv
+
+        entry.attrib.clear()
+        entry.attrib.update(bound.attrib)
+        entry.text = bound.text
+        for child in entry.getchildren():
+            entry.remove(child)
+        for child in bound.getchildren():
+            entry.append(copy.deepcopy(child))
+        Bcfg2.Server.Statistics.stats.add_value(
+            "%s:bound_entry_cache_hit" % self.__class__.__name__,
+            time.time() - start)
+        return entry
+
+    def _get_bound_entries(self, metadata):
+        """ Get the dict of bound entries shared by all clients in the
+        same metadata equivalence class as the given client.  Clients
+        are in the same equivalence class if they have the same
+        profile, groups, bundles, categories, and client version.  All
+        cached entries are discarded when the repository revision
+        changes or the FAM handles any event.
+
+        :param metadata: Client metadata to get bound entries for
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: dict of ``(<generator name>, <entry tag>, <abstract
+                  entry attributes>) => <bound entry>``
+        """
+        generation = (self.revision, self.fam.events_handled)
+        if generation != self._bound_entry_generation:
+            self.bound_entry_cache.expire()
+            self._bound_entry_generation = generation
+        eqclass = (metadata.profile,
+                   frozenset(metadata.groups),
+                   frozenset(metadata.bundles),
+                   frozenset(metadata.categories.items()),
+                   metadata.version)
+        try:
+            return self.bound_entry_cache[eqclass]
+        except KeyError:
+            rv = dict()
+            self.bound_entry_cache[eqclass] = rv
+            return rv
+
+    def _update_generator_index(self):
+        """ Bring :attr:`_generator_index` up to date with the
+        ``Entries`` dicts of all loaded generators.  This is a no-op
+        unless the FAM has handled events since the last update, and
+        only the entries that were added or removed since then are
+        touched.  Entries that are served by more than one generator
+        are reported here, rather than every time they are bound. """
+        serial = self.fam.events_handled
+        if serial == self._generator_index_serial:
+            return
+        self._generator_index_lock.acquire()
+        try:
+            serial = self.fam.events_handled
+            if serial == self._generator_index_serial:
+                return
+            generators = self.plugins_by_type(Generator)
+            index = self._generator_index
+            names = [gen.name for gen in generators]
+            for name in list(self._generator_keys.keys()):
+                if name not in names:
+                    # plugin has been unloaded
+                    for key in self._generator_keys.pop(name):
+                        index[key] = [g for g in index.get(key, [])
+                                      if g.name != name]
+                        if not index[key]:
+                            del index[key]
+
+            fuzzy = []
+            for gen in generators:
+                keys = set()
+                for tag, entries in list(gen.Entries.items()):
+                    if type(entries) is not dict:
+                        fuzzy.append((gen, tag))
+                    keys.update((tag, name) for name in list(entries.keys()))
+                old = self._generator_keys.get(gen.name, set())
+                for key in old - keys:
+                    index[key] = [g for g in index.get(key, [])
+                                  if g is not gen]
+                    if not index[key]:
+                        del index[key]
+                for key in keys - old:
+                    # build a new list rather than appending so that
+                    # concurrent Bind() calls never see a partial list
+                    index[key] = index.get(key, []) + [gen]
+                    if len(index[key]) > 1:
+                        self.logger.error(
+                            "%s %s served by multiple generators: %s" %
+                            (key[0], key[1],
+                             ", ".join([g.name for g in index[key]])))
+                self._generator_keys[gen.name] = keys
+            self._fuzzy_generators = fuzzy
+            self._handles_entry_cache = dict()
+            self._generator_index_serial = serial
+        finally:
+            self._generator_index_lock.release()
+
+    def _get_entry_handlers(self, tag):
+        """ Get the list of generators whose ``HandlesEntry`` method
+        may claim an entry with the given tag, as determined by
+        :attr:`Bcfg2.Server.Plugin.interfaces.Generator.handles_entry_tags`.
+        Generators that do not override ``HandlesEntry`` are never
+        included.  The result is cached until the generator index is
+        next updated.
+
+        :param tag: The entry tag
+        :type tag: string
+        :returns: list of :class:`Bcfg2.Server.Plugin.interfaces.Generator`
+                  objects, sorted as by :func:`plugins_by_type`
+        """
+        try:
+            return self._handles_entry_cache[tag]
+        except KeyError:
+            pass
+        default = getattr(Generator.HandlesEntry, "__func__",
+                          Generator.HandlesEntry)
+        rv = []
+        for gen in self.plugins_by_type(Generator):
+            func = getattr(gen.HandlesEntry, "__func__", gen.HandlesEntry)
+            if func is default:
+                continue
+            if (gen.handles_entry_tags is None or
+                    tag in gen.handles_entry_tags):
+                rv.append(gen)
+        self._handles_entry_cache[tag] = rv
+        return rv
+
     def BuildConfiguration(self, client):
         """ Build the complete configuration for a client.
 
@@ -680,9 +951,6 @@ class Core(object):
         :returns: :class:`lxml.etree._Element` - A complete Bcfg2
                   configuration document """
         self.logger.debug("Building configuration for %s" % client)
-        start = time.time()
-        config = lxml.etree.Element("Configuration", version='2.0',
-                                    revision=str(self.revision))
         try:
             meta = self.build_metadata(client)
         except MetadataConsistencyError:
@@ -691,14 +959,34 @@ class Core(object):
             return lxml.etree.Element("error", type='metadata error')
 
         self.client_run_hook("start_client_run", meta)
+        try:
+            return self._build_configuration(meta)
+        finally:
+            # end the client run even if the build failed, so plugins
+            # don't keep per-run state for it
+            self.client_run_hook("end_client_run", meta)
+
+    def _build_configuration(self, metadata):
+        """ Build the complete configuration for a client once the
+        ``start_client_run`` hooks have been run for it.  This does
+        not run the ``end_client_run`` hooks; see
+        :func:`BuildConfiguration`.
 
+        :param metadata: The client metadata
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: :class:`lxml.etree._Element` - A complete Bcfg2
+                  configuration document, or an ``<error>`` element
+        """
+        start = time.time()
+        config = lxml.etree.Element("Configuration", version='2.0',
+                                    revision=str(self.revision))
         try:
-            structures = self.GetStructures(meta)
+            structures = self.GetStructures(metadata)
         except:
             self.logger.error("Error in GetStructures", exc_info=1)
             return lxml.etree.Element("error", type='structure error')
 
-        self.validate_structures(meta, structures)
+        self.validate_structures(metadata, structures)
 
         # Perform altsrc consistency checking
         esrcs = {}
@@ -713,18 +1001,153 @@ class Core(object):
                     esrcs[key] = entry.get('altsrc', None)
         del esrcs
 
-        self.BindStructures(structures, meta, config)
-
-        self.validate_goals(meta, config)
+        self.BindStructures(structures, metadata, config)
 
-        self.client_run_hook("end_client_run", meta)
+        self.validate_goals(metadata, config)
 
         sort_xml(config, key=lambda e: e.get('name'))
 
         self.logger.info("Generated config for %s in %.03f seconds" %
-                         (client, time.time() - start))
+                         (metadata.hostname, time.time() - start))
         return config
 
+    def _get_plugin_changes(self):
+        """ Get a change counter for each plugin: the number of FAM
+        events handled for monitors on the plugin's directory in the
+        repository, or on paths within it.  The Metadata plugin is
+        left out, since the client metadata is part of the
+        configuration state itself (see :func:`_get_config_state`),
+        and changes to the metadata of other clients forget all
+        configuration digests.  Events for paths outside of plugin
+        directories are ignored.  The counters are only recomputed after the FAM has
+        handled events.
+
+        :returns: tuple of ``(<plugin name>, <events handled>)``
+                  tuples, sorted by plugin name
+        """
+        serial, changes = self._plugin_changes
+        if serial == self.fam.events_handled:
+            return changes
+        serial = self.fam.events_handled
+        counters = dict()
+        for handle, count in list(self.fam.events_by_handle.items()):
+            if handle not in self._monitor_owners:
+                path = self.fam.paths.get(handle, "").rstrip("/") + "/"
+                owner = None
+                for plugin in list(self.plugins.values()):
+                    if (plugin is not self.metadata and
+                            path.startswith(plugin.data.rstrip("/") + "/")):
+                        owner = plugin.name
+                        break
+                self._monitor_owners[handle] = owner
+            owner = self._monitor_owners[handle]
+            if owner is not None:
+                counters[owner] = counters.get(owner, 0) + count
+        changes = tuple(sorted(counters.items()))
+        self._plugin_changes = (serial, changes)
+        return changes
+
+    def _get_config_state(self, metadata):
+        """ Get a digest of everything that the configuration of a
+        client is built from: the repository revision, the change
+        counters of the plugins (see :func:`_get_plugin_changes`),
+        and the client metadata, including the data that Connector
+        plugins (e.g., Probes) have added to it.
+
+        :param metadata: The client metadata
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: string
+        """
+        connectors = []
+        for name in metadata.connectors:
+            data = getattr(metadata, name, None)
+            if hasattr(data, "items"):
+                data = sorted(data.items())
+            connectors.append((name, data))
+        state = (self.revision,
+                 self._get_plugin_changes(),
+                 metadata.hostname,
+                 metadata.profile,
+                 sorted(metadata.groups),
+                 sorted(metadata.bundles),
+                 sorted(metadata.categories.items()),
+                 sorted(metadata.aliases),
+                 sorted(metadata.addresses),
+                 metadata.uuid,
+                 metadata.password,
+                 metadata.version,
+                 connectors)
+        return config_digest(repr(state))
+
+    def _check_config(self, client, metadata, digest):
+        """ Start a client run and determine whether the
+        configuration a client has is still current.  The
+        ``start_client_run`` hooks are run first, since they can
+        refresh the data that client metadata is built from (e.g.,
+        the Ldap and AWSTags plugins do), and the metadata is then
+        built again.  If the configuration is not modified, or the
+        check fails, the client run ends here, and the
+        ``end_client_run`` hooks are run as well; otherwise the caller
+        must run them once the configuration is built.
+
+        :param client: The client hostname
+        :type client: string
+        :param metadata: The client metadata
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :param digest: The digest of the configuration the client
+                       has, or None
+        :type digest: string
+        :returns: tuple of (<client metadata>, <state, as returned by
+                  :func:`_get_config_state`>, <bool - whether the
+                  configuration is not modified>)
+        """
+        self.client_run_hook("start_client_run", metadata)
+        ended = True
+        try:
+            metadata = self.build_metadata(client)
+            state = self._get_config_state(metadata)
+            ended = self._config_not_modified(client, state, digest)
+        finally:
+            if ended:
+                self.client_run_hook("end_client_run", metadata)
+        return (metadata, state, ended)
+
+    def _config_not_modified(self, client, state, digest):
+        """ Determine whether the configuration last built for a
+        client has the given digest and was built from the given
+        state, so that it need not be built again.
+
+        :param client: The client hostname
+        :type client: string
+        :param state: The current state, as returned by
+                      :func:`_get_config_state`
+        :type state: string
+        :param digest: The digest of the configuration the client
+                       has, or None
+        :type digest: string
+        :returns: bool
+        """
+        if digest is None:
+            return False
+        rv = self.config_digests.get(client) == (state, digest)
+        Bcfg2.Server.Statistics.stats.add_value(
+            "%s:config_not_modified" % self.__class__.__name__, int(rv))
+        return rv
+
+    def _record_config(self, client, state, config):
+        """ Record the digest of a configuration sent to a client and
+        the state it was built from.
+
+        :param client: The client hostname
+        :type client: string
+        :param state: The state the configuration was built from, as
+                      returned by :func:`_get_config_state`
+        :type state: string
+        :param config: The serialized configuration document
+        :type config: string
+        """
+        self.config_digests[client] = (state, config_digest(config))
+
     def HandleEvent(self, event):
         """ Handle a change in the Bcfg2 config file.
 
@@ -1146,7 +1569,9 @@ class Core(object):
 
         :param address: Client (address, port) pair
         :type address: tuple
-        :returns: bool - True on success
+        :returns: True on success, or a list of [<source>, <probe
+                  name>] pairs of probes whose full output the client
+                  must upload again
         :raises: :exc:`xmlrpclib.Fault`
         """
         client, metadata = self.resolve_client(address)
@@ -1176,15 +1601,20 @@ class Core(object):
                     continue
                 sources.append(source)
 
+        resend = []
         for source in sources:
             datalist = [data for data in xpdata
                         if data.get('source') == source]
             try:
-                self.plugins[source].ReceiveData(metadata, datalist)
+                rv = self.plugins[source].ReceiveData(metadata, datalist)
             except:
                 err = sys.exc_info()[1]
                 self.critical_error("Failed to process probe data from client "
                                     "%s: %s" % (client, err))
+            if rv:
+                resend.extend([source, name] for name in rv)
+        if resend:
+            return resend
         return True
 
     @exposed
@@ -1209,23 +1639,48 @@ class Core(object):
 
     @exposed
     @close_db_connection
-    def GetConfig(self, address):
-        """ Build config for a client by calling
-        :func:`BuildConfiguration`.
+    def GetConfig(self, address, digest=None):
+        """ Build config for a client, as :func:`BuildConfiguration`
+        does.
+
+        If the client passes the digest (see :func:`config_digest`)
+        of the configuration it got last, and that is the
+        configuration that was last built for it, then the
+        configuration is not built again as long as the repository
+        revision, the files in the repository, and the client
+        metadata (including probe data) are all unchanged since.
+        Instead, a ``<NotModified/>`` document is returned.  The
+        client run hooks are run either way; see
+        :func:`_check_config`.
 
         :param address: Client (address, port) pair
         :type address: tuple
+        :param digest: The digest of the configuration the client has
+        :type digest: string
         :returns: lxml.etree._Element - The full configuration
                   document for the client
         :raises: :exc:`xmlrpclib.Fault`
         """
-        client = self.resolve_client(address)[0]
+        client, metadata = self.resolve_client(address)
         try:
-            config = self.BuildConfiguration(client)
-            return lxml.etree.tostring(config,
-                                       xml_declaration=False).decode('UTF-8')
+            metadata, state, not_modified = \
+                self._check_config(client, metadata, digest)
         except MetadataConsistencyError:
             self.critical_error("Metadata consistency failure for %s" % client)
+        if not_modified:
+            self.logger.debug("Configuration for %s is not modified" %
+                              client)
+            return lxml.etree.tostring(
+                lxml.etree.Element("NotModified"),
+                xml_declaration=False).decode('UTF-8')
+        try:
+            config = self._build_configuration(metadata)
+            rv = lxml.etree.tostring(config,
+                                     xml_declaration=False).decode('UTF-8')
+            self._record_config(client, state, rv)
+            return rv
+        finally:
+            self.client_run_hook("end_client_run", metadata)
 
     @exposed
     @close_db_connection
@@ -1374,6 +1829,7 @@ class NetworkCore(Core):
         Bcfg2.Options.Common.daemon, Bcfg2.Options.Common.syslog,
         Bcfg2.Options.Common.location, Bcfg2.Options.Common.ssl_ca,
         Bcfg2.Options.Common.protocol,
+        Bcfg2.Options.Common.compression_threshold,
         Bcfg2.Options.PathOption(
             '--ssl-key', cf=('communication', 'key'), dest="key",
             help='Path to SSL key',
@@ -95,6 +95,7 @@ class Gamin(FileMonitor):
         else:
             self.mon.watch_file(path, self.queue, handle)
         self.handles[handle] = obj
+        self.paths[handle] = path
         return handle
     AddMonitor.__doc__ = FileMonitor.AddMonitor.__doc__
 
@@ -208,6 +208,7 @@ class Inotify(Pseudo, pyinotify.ProcessEvent):
             return Pseudo.AddMonitor(self, path, obj, handleID=path)
         else:
             self.handles[path] = obj
+            self.paths[path] = path
             return path
     AddMonitor.__doc__ = Pseudo.AddMonitor.__doc__
 
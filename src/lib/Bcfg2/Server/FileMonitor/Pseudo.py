@@ -27,4 +27,5 @@ class Pseudo(FileMonitor):
 
         if obj is not None:
             self.handles[handleID] = obj
+            self.paths[handleID] = path
         return handleID
@@ -156,6 +156,24 @@ class FileMonitor(Debuggable):
         #: Whether or not the FAM has been started.  See :func:`start`.
         self.started = False
 
+        #: The number of events that have been dispatched to their
+        #: handlers.  Other objects can compare this against a stored
+        #: value to cheaply determine whether any monitored data may
+        #: have changed.
+        self.events_handled = 0
+
+        #: A dict that records which paths are monitored.  Keys are
+        #: monitor handle IDs and values are the paths passed to
+        #: :func:`AddMonitor`.
+        self.paths = dict()
+
+        #: A dict of the number of events that have been dispatched
+        #: to their handlers for each monitor.  Keys are monitor
+        #: handle IDs.  Together with :attr:`paths`, this lets other
+        #: objects determine whether the data under a given path may
+        #: have changed.
+        self.events_by_handle = dict()
+
     def __str__(self):
         return "%s: %s" % (__name__, self.__class__.__name__)
 
@@ -244,6 +262,9 @@ class FileMonitor(Debuggable):
             err = sys.exc_info()[1]
             self.logger.error("Error in handling of event %s for %s: %s" %
                               (event.code2str(), event.filename, err))
+        self.events_handled += 1
+        self.events_by_handle[event.requestID] = \
+            self.events_by_handle.get(event.requestID, 0) + 1
 
     def handle_event_set(self, lock=None):
         """ Handle all pending events.
@@ -11,15 +11,18 @@ A method being called via the RPCQueue must be exposed by the child by
 decorating it with :func:`Bcfg2.Server.Core.exposed`.
 """
 
+import os
+import sys
 import time
+import tempfile
 import threading
 import lxml.etree
 import multiprocessing
 import Bcfg2.Options
 import Bcfg2.Server.Cache
 import Bcfg2.Server.Plugin
-from itertools import cycle
-from Bcfg2.Compat import Queue, Empty, wraps
+import Bcfg2.Server.Statistics
+from Bcfg2.Compat import Queue, Empty, wraps, cPickle, xmlrpclib
 from Bcfg2.Server.Core import Core, exposed
 from Bcfg2.Server.BuiltinCore import BuiltinCore
 from multiprocessing.connection import Listener, Client
@@ -132,6 +135,116 @@ class DualEvent(object):
         return self._threading_event.wait(timeout=timeout)
 
 
+class ChildScheduler(object):
+    """ Chooses the child process that should build each client
+    configuration.  The scheduler tracks the number of builds in
+    flight on each child and the time each child took to complete its
+    recent builds, and sends each new build to the child that is
+    expected to finish it soonest.  If ``concurrency`` is set, no
+    child is given more than that many builds at once; requests wait
+    until a child is available. """
+
+    #: The number of recent build times to keep for each child when
+    #: estimating how long its next build will take
+    history = 10
+
+    #: How long to wait between checks of the termination event while
+    #: waiting for a child to become available.
+    poll_wait = 3.0
+
+    def __init__(self, children, concurrency=0, terminate=None):
+        """
+        :param children: The names of the children to schedule
+                         builds on
+        :type children: list of strings
+        :param concurrency: The maximum number of builds in flight on
+                            any one child, or 0 for no limit
+        :type concurrency: int
+        :param terminate: An event that, when set, causes requests
+                          waiting for a child to give up
+        :type terminate: threading.Event
+        """
+        self.concurrency = concurrency
+        self.terminate = terminate or threading.Event()
+
+        #: A dict of child name -> number of builds in flight
+        self.in_flight = dict((c, 0) for c in children)
+
+        #: A dict of child name -> list of the times taken by its most
+        #: recent builds
+        self.build_times = dict((c, []) for c in children)
+
+        #: The number of requests waiting for a child
+        self.waiting = 0
+
+        self._lock = threading.Condition()
+
+    def latency(self, child):
+        """ Get the mean time taken by the recent builds on a child,
+        or 0.0 if it has not built anything yet. """
+        times = self.build_times[child]
+        if times:
+            return sum(times) / len(times)
+        return 0.0
+
+    def _load(self, child):
+        """ Sort key used to choose the least-loaded child.  Children
+        are compared by the estimated time to finish all of their
+        builds, including the new one, then by the number of builds
+        in flight. """
+        return ((self.in_flight[child] + 1) * self.latency(child),
+                self.in_flight[child], child)
+
+    def acquire(self):
+        """ Choose the child to send a new build to, and mark the
+        build as in flight on it.  This blocks until a child is
+        available.  Every call to ``acquire()`` that returns a child
+        must be matched with a call to :func:`release`.
+
+        :returns: string - the name of the child, or None if
+                  :attr:`terminate` was set while waiting
+        """
+        self._lock.acquire()
+        try:
+            Bcfg2.Server.Statistics.stats.add_value(
+                "MultiprocessingCore:queue_depth", self.waiting)
+            self.waiting += 1
+            try:
+                while not self.terminate.is_set():
+                    available = [c for c, n in self.in_flight.items()
+                                 if not self.concurrency or
+                                 n < self.concurrency]
+                    if available:
+                        child = min(available, key=self._load)
+                        self.in_flight[child] += 1
+                        return child
+                    self._lock.wait(self.poll_wait)
+                return None
+            finally:
+                self.waiting -= 1
+        finally:
+            self._lock.release()
+
+    def release(self, child, build_time):
+        """ Mark a build on the given child as finished.
+
+        :param child: The name of the child the build ran on
+        :type child: string
+        :param build_time: The time taken by the build, in seconds
+        :type build_time: float
+        """
+        self._lock.acquire()
+        try:
+            self.in_flight[child] -= 1
+            times = self.build_times[child]
+            times.append(build_time)
+            if len(times) > self.history:
+                del times[0]
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+
 class ChildCore(Core):
     """ A child process for :class:`Bcfg2.MultiprocessingCore.Core`.
     This core builds configurations from a given
@@ -151,6 +264,12 @@ class ChildCore(Core):
     #: every ``poll_wait`` seconds.
     poll_wait = 3.0
 
+    #: How long :func:`GetConfig` waits for the metadata snapshot it
+    #: needs to be loaded before it gives up.  This matches the
+    #: default client timeout, after which the client has given up
+    #: anyway.
+    snapshot_timeout = 90.0
+
     def __init__(self, name, rpc_q, terminate):
         """
         :param name: The name of this child
@@ -186,6 +305,21 @@ class ChildCore(Core):
 
         self._rmi = dict()
 
+        #: The generation of the most recent metadata snapshot loaded
+        #: from the parent, or -1 if none has been loaded.
+        self.metadata_generation = -1
+
+        #: Condition that is notified when a new metadata snapshot is
+        #: loaded
+        self._metadata_loaded = threading.Condition()
+
+    def load_plugins(self):
+        Core.load_plugins(self)
+        if (Bcfg2.Options.setup.metadata_snapshots and
+                hasattr(self.metadata, "use_snapshots")):
+            self.metadata.use_snapshots()
+    load_plugins.__doc__ = Core.load_plugins.__doc__
+
     def _run(self):
         return True
 
@@ -273,8 +407,67 @@ class ChildCore(Core):
         Bcfg2.Server.Cache.expire(*tags, exact=kwargs.pop("exact", False))
 
     @exposed
-    def GetConfig(self, client):
-        """ Render the configuration for a client """
+    def load_metadata_snapshot(self, path, generation):
+        """ Load a metadata snapshot written by the parent process.
+        The snapshot is a pickle, so each child unpickles its own copy
+        of the data; this saves the children from parsing
+        ``clients.xml`` and ``groups.xml``, but not from holding the
+        data in memory.  Snapshots older than the one already loaded
+        are ignored.
+
+        :param path: The path to the pickled snapshot
+        :type path: string
+        :param generation: The generation of the snapshot
+        :type generation: int
+        """
+        self._metadata_loaded.acquire()
+        try:
+            if generation <= self.metadata_generation:
+                return
+            try:
+                snapfile = open(path, 'rb')
+                try:
+                    snapshot = cPickle.load(snapfile)
+                finally:
+                    snapfile.close()
+            except (IOError, OSError, cPickle.UnpicklingError):
+                self.logger.error("%s: Failed to load metadata snapshot %s: "
+                                  "%s" % (self.name, path, sys.exc_info()[1]))
+                return
+            self.metadata.load_snapshot(snapshot)
+            self.metadata_generation = generation
+            self.logger.debug("%s: Loaded metadata snapshot %s" %
+                              (self.name, generation))
+            self._metadata_loaded.notify_all()
+        finally:
+            self._metadata_loaded.release()
+
+    @exposed
+    def GetConfig(self, client, metadata_generation=None):
+        """ Render the configuration for a client.  If
+        ``metadata_generation`` is given, this waits until a metadata
+        snapshot at least that new has been loaded, for at most
+        :attr:`snapshot_timeout` seconds.  If it is not loaded by
+        then (e.g., because loading it failed), None is returned. """
+        if metadata_generation is not None:
+            end = time.time() + self.snapshot_timeout
+            self._metadata_loaded.acquire()
+            try:
+                while (self.metadata_generation < metadata_generation and
+                       not self.terminate.is_set()):
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        break
+                    self._metadata_loaded.wait(min(self.poll_wait,
+                                                   remaining))
+                loaded = self.metadata_generation >= metadata_generation
+            finally:
+                self._metadata_loaded.release()
+            if not loaded:
+                self.logger.error("%s: Metadata snapshot %s is not loaded; "
+                                  "cannot build configuration for %s" %
+                                  (self.name, metadata_generation, client))
+                return None
         self.metadata.update_client_list()
         self.logger.debug("%s: Building configuration for %s" %
                           (self.name, client))
@@ -294,7 +487,16 @@ class MultiprocessingCore(BuiltinCore):
             '--children', dest="core_children",
             cf=('server', 'children'), type=int,
             default=multiprocessing.cpu_count(),
-            help='Spawn this number of children for the multiprocessing core')]
+            help='Spawn this number of children for the multiprocessing core'),
+        Bcfg2.Options.Option(
+            '--child-concurrency', dest="core_child_concurrency",
+            cf=('server', 'child_concurrency'), type=int, default=0,
+            help='Maximum number of configurations each child builds at '
+            'once; 0 for no limit'),
+        Bcfg2.Options.BooleanOption(
+            cf=('server', 'metadata_snapshots'), dest="metadata_snapshots",
+            help='Send snapshots of client and group metadata to children '
+            'rather than having each child parse clients.xml and groups.xml')]
 
     #: How long to wait for a child process to shut down cleanly
     #: before it is terminated.
@@ -326,12 +528,22 @@ class MultiprocessingCore(BuiltinCore):
         #: used to send or publish commands to children.
         self.rpc_q = RPCQueue()
 
-        #: A list of children that will be cycled through
+        #: A list of the names of all children
         self._all_children = []
 
-        #: An iterator that each child will be taken from in sequence,
-        #: to provide a round-robin distribution of render requests
-        self.children = None
+        #: The :class:`Bcfg2.Server.MultiprocessingCore.ChildScheduler`
+        #: that chooses the child to render each configuration
+        self.scheduler = None
+
+        #: The generation of the most recent metadata snapshot sent to
+        #: the children
+        self._snapshot_generation = None
+
+        #: The paths to the most recent metadata snapshot files
+        self._snapshot_files = []
+
+        #: Lock that must be held to take a metadata snapshot
+        self._snapshot_lock = threading.Lock()
 
     def __str__(self):
         if hasattr(Bcfg2.Options.setup, "location"):
@@ -356,7 +568,10 @@ class MultiprocessingCore(BuiltinCore):
             self._all_children.append(name)
         self.logger.debug("Started %s children: %s" % (len(self._all_children),
                                                        self._all_children))
-        self.children = cycle(self._all_children)
+        self.scheduler = ChildScheduler(
+            self._all_children,
+            concurrency=Bcfg2.Options.setup.core_child_concurrency,
+            terminate=self.terminate)
         Bcfg2.Server.Cache.add_expire_hook(self.cache_dispatch)
         return BuiltinCore._run(self)
 
@@ -364,6 +579,11 @@ class MultiprocessingCore(BuiltinCore):
         BuiltinCore.shutdown(self)
         self.logger.info("Closing RPC command queues")
         self.rpc_q.close()
+        for path in self._snapshot_files:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
 
         def term_children():
             """ Terminate all remaining multiprocessing children. """
@@ -436,13 +656,92 @@ class MultiprocessingCore(BuiltinCore):
         """ Publish cache expiration events to child nodes. """
         self.rpc_q.publish("expire_cache", args=tags, kwargs=dict(exact=exact))
 
+    def _publish_metadata_snapshot(self):
+        """ If metadata snapshots are enabled and the client or group
+        data has changed since the last snapshot, write a new snapshot
+        to a temporary file and tell the children to load it.
+
+        :returns: int - the generation of the most recent snapshot,
+                  or None if metadata snapshots are not in use
+        """
+        if (not Bcfg2.Options.setup.metadata_snapshots or
+                not hasattr(self.metadata, "get_snapshot")):
+            return None
+        self._snapshot_lock.acquire()
+        try:
+            generation = self.metadata.generation
+            if (generation != self._snapshot_generation and
+                    False not in self.metadata.states.values()):
+                (fd, path) = tempfile.mkstemp(prefix="bcfg2-metadata-")
+                snapfile = os.fdopen(fd, 'wb')
+                try:
+                    cPickle.dump(self.metadata.get_snapshot(), snapfile, 2)
+                finally:
+                    snapfile.close()
+                self.logger.debug("Publishing metadata snapshot %s" %
+                                  generation)
+                self.rpc_q.publish("load_metadata_snapshot",
+                                   args=[path, generation])
+                self._snapshot_generation = generation
+
+                # keep the previous snapshot around, in case a child
+                # is still loading it
+                self._snapshot_files.append(path)
+                while len(self._snapshot_files) > 2:
+                    try:
+                        os.unlink(self._snapshot_files.pop(0))
+                    except OSError:
+                        pass
+            return self._snapshot_generation
+        finally:
+            self._snapshot_lock.release()
+
     @exposed
-    def GetConfig(self, address):
-        client = self.resolve_client(address)[0]
-        childname = self.children.next()
+    def GetConfig(self, address, digest=None):
+        client, metadata = self.resolve_client(address)
+        try:
+            state, not_modified = \
+                self._check_config(client, metadata, digest)[1:]
+        except Bcfg2.Server.Plugin.MetadataConsistencyError:
+            self.critical_error("Metadata consistency failure for %s" %
+                                client)
+        if not_modified:
+            self.logger.debug("Configuration for %s is not modified" %
+                              client)
+            return lxml.etree.tostring(
+                lxml.etree.Element("NotModified"),
+                xml_declaration=False).decode('UTF-8')
+        # the child runs the client run hooks for the build itself,
+        # so the end_client_run hooks are not run here as well, which
+        # would (e.g.) fire triggers twice
+        generation = self._publish_metadata_snapshot()
+        start = time.time()
+        childname = self.scheduler.acquire()
+        if childname is None:
+            # terminate was set while waiting for a child
+            raise xmlrpclib.Fault(xmlrpclib.APPLICATION_ERROR,
+                                  "Server is shutting down; cannot build "
+                                  "configuration for %s" % client)
+        Bcfg2.Server.Statistics.stats.add_value(
+            "MultiprocessingCore:queue_wait", time.time() - start)
         self.logger.debug("Building configuration for %s on %s" % (client,
                                                                    childname))
-        return self.rpc_q.rpc(childname, "GetConfig", args=[client])
+        start = time.time()
+        try:
+            rv = self.rpc_q.rpc(
+                childname, "GetConfig", args=[client],
+                kwargs=dict(metadata_generation=generation))
+            if rv is None:
+                raise xmlrpclib.Fault(xmlrpclib.APPLICATION_ERROR,
+                                      "Failed to build configuration for %s "
+                                      "on %s" % (client, childname))
+            self._record_config(client, state, rv)
+            return rv
+        finally:
+            build_time = time.time() - start
+            self.scheduler.release(childname, build_time)
+            Bcfg2.Server.Statistics.stats.add_value(
+                "MultiprocessingCore:GetConfig:%s" % childname, build_time)
 
     @exposed
     def get_statistics(self, address):
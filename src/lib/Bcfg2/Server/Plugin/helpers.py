@@ -15,7 +15,8 @@ import Bcfg2.Server.FileMonitor
 from Bcfg2.Logger import Debuggable
 from Bcfg2.Compat import CmpMixin, wraps
 from Bcfg2.Server.Plugin.base import Plugin
-from Bcfg2.Server.Plugin.interfaces import Generator, TemplateDataProvider
+from Bcfg2.Server.Plugin.interfaces import Generator, TemplateDataProvider, \
+    ClientRunHooks
 from Bcfg2.Server.Plugin.exceptions import SpecificityError, \
     PluginExecutionError, PluginInitError
 
@@ -700,8 +701,25 @@ class StructFile(XMLFileBacked):
                                create=create)
         self.template = None
 
+        #: Whether or not the data matched from this file can differ
+        #: between clients with identical groups, i.e., whether it is
+        #: a template or contains ``<Client>`` tags.  This is True
+        #: until the file has been indexed.
+        self.client_specific = True
+
+        #: The ``<Group>``/``<Client>``/etc. predicates in this file,
+        #: as a list of ``(<include test>, <element>, <negate>)``
+        #: tuples, compiled by :func:`_compile`.
+        self._predicates = []
+
+        #: The entries in this file compiled by :func:`_compile`, or
+        #: None if the file is a template and must be matched the slow
+        #: way.
+        self._compiled = None
+
     def Index(self):
         XMLFileBacked.Index(self)
+        self.client_specific = bool(self.xdata.xpath("//Client"))
         if (self.name.endswith('.genshi') or
             ('py' in self.xdata.nsmap and
              self.xdata.nsmap['py'] == 'http://genshi.edgewall.org/')):
@@ -723,6 +741,7 @@ class StructFile(XMLFileBacked):
                 err = sys.exc_info()[1]
                 self.logger.error('Genshi parse error in %s: %s' % (self.name,
                                                                     err))
+            self.client_specific = True
 
         if HAS_CRYPTO and self.encryption:
             for el in self.xdata.xpath("//*[@encrypted]"):
@@ -743,8 +762,122 @@ class StructFile(XMLFileBacked):
                         self.logger.debug(msg)
                     else:
                         raise PluginExecutionError(msg)
+
+        if self.template is None:
+            predicates = []
+            self._compiled = self._compile(self.entries, predicates)
+            self._predicates = predicates
+        else:
+            self._compiled = None
     Index.__doc__ = XMLFileBacked.Index.__doc__
 
+    def _compile(self, items, predicates, conditions=()):
+        """ Compile the predicate tree formed by ``<Group>``,
+        ``<Client>``, and other tags listed in :attr:`_include_tests`
+        into a flat list of ``(<conditions>, <element>, <children>)``
+        tuples, one for each element that would be returned by
+        :func:`Match`.  ``<conditions>`` is a tuple of indices into
+        ``predicates`` that must all be true for the element to be
+        included, and ``<children>`` is the compiled list of the
+        element's own children, or None if the element contains no
+        predicates or comments and can be copied as-is.  Predicate
+        tags that have text get an additional tuple with
+        ``<element>`` set to None and ``<children>`` set to the text,
+        so that :func:`XMLMatch` can merge it into the parent element.
+
+        :param items: The elements to compile
+        :type items: list of lxml.etree._Element
+        :param predicates: The list of compiled predicates, which
+                           will be appended to
+        :type predicates: list
+        :param conditions: The predicates that apply to all of
+                           ``items``
+        :type conditions: tuple
+        :returns: list of tuples
+        """
+        rv = []
+        for item in items:
+            if isinstance(item, lxml.etree._Comment):  # pylint: disable=W0212
+                continue
+            if item.tag in self._include_tests:
+                predicates.append(
+                    (self._include_tests[item.tag], item,
+                     item.get('negate', 'false').lower() == 'true'))
+                itemconds = conditions + (len(predicates) - 1,)
+                if item.text:
+                    rv.append((itemconds, None, item.text))
+                rv.extend(self._compile(item.iterchildren(), predicates,
+                                        conditions=itemconds))
+            else:
+                children = self._compile(item.iterchildren(), predicates)
+                if (len(children) == len(item) and
+                        all(not c[0] and c[2] is None for c in children)):
+                    children = None
+                rv.append((conditions, item, children))
+        return rv
+
+    def _match_compiled(self, nodes, metadata, args, memo, parent=None):
+        """ Produce the matching elements from a list of nodes compiled
+        by :func:`_compile`.  Matching elements are built with a
+        shallow copy of each element, and only subtrees that contain
+        no predicates are copied whole, rather than copying and then
+        pruning entire subtrees.
+
+        :param nodes: The compiled nodes to match
+        :type nodes: list of tuples
+        :param metadata: Client metadata to match against.
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :param args: Additional arguments to the include tests
+        :type args: tuple
+        :param memo: The results of predicates that have already been
+                     evaluated for this match, indexed like
+                     :attr:`_predicates`
+        :type memo: list
+        :param parent: If this is not None, the text of matching
+                       predicate tags is appended to the text of
+                       ``parent``, as :func:`XMLMatch` does.
+        :type parent: lxml.etree._Element
+        :returns: list of lxml.etree._Element objects
+        """
+        rv = []
+        for conditions, item, children in nodes:
+            for idx in conditions:
+                if memo[idx] is None:
+                    test, element, negate = self._predicates[idx]
+                    memo[idx] = negate != test(element, metadata, *args)
+                if not memo[idx]:
+                    break
+            else:
+                if item is None:
+                    if parent is not None:
+                        parent.text = (parent.text or '') + children
+                elif children is None:
+                    rv.append(copy.deepcopy(item))
+                else:
+                    new = self._copy_element(item)
+                    if parent is None:
+                        new.extend(self._match_compiled(children, metadata,
+                                                        args, memo))
+                    else:
+                        new.extend(self._match_compiled(children, metadata,
+                                                        args, memo,
+                                                        parent=new))
+                    rv.append(new)
+        return rv
+
+    def _copy_element(self, item):  # pylint: disable=R0201
+        """ Make a copy of an element without its children.  The copy
+        belongs to a new document, as with :func:`copy.deepcopy`, so
+        that XPath queries against it do not escape into this file. """
+        if callable(item.tag):
+            # comments, processing instructions, etc.
+            return copy.copy(item)
+        rv = lxml.etree.Element(item.tag, attrib=item.attrib,
+                                nsmap=item.nsmap)
+        rv.text = item.text
+        rv.tail = item.tail
+        return rv
+
     def _decrypt(self, element):
         """ Decrypt a single encrypted properties file element """
         if not element.text or not element.text.strip():
@@ -806,9 +939,7 @@ class StructFile(XMLFileBacked):
                         rv.extend(self._match(child, metadata, *args))
                 return rv
             else:
-                rv = copy.deepcopy(item)
-                for child in rv.iterchildren():
-                    rv.remove(child)
+                rv = self._copy_element(item)
                 for child in item.iterchildren():
                     rv.extend(self._match(child, metadata, *args))
                 return [rv]
@@ -822,6 +953,10 @@ class StructFile(XMLFileBacked):
         interface to accept a different number of arguments.  This
         provides a sane prototype for the Match() function while
         keeping the internals consistent. """
+        if self.template is None and self._compiled is not None and \
+                self._default_match("_match"):
+            return self._match_compiled(self._compiled, metadata, args,
+                                        [None] * len(self._predicates))
         rv = []
         if self.template is None:
             entries = self.entries
@@ -831,6 +966,14 @@ class StructFile(XMLFileBacked):
             rv.extend(self._match(child, metadata, *args))
         return rv
 
+    def _default_match(self, name):
+        """ Return True if the named matching method (``_match`` or
+        ``_xml_match``) has not been overridden, so the compiled
+        entries can be used in its place. """
+        return (getattr(getattr(self, name), "__func__", None) is
+                getattr(getattr(StructFile, name), "__func__",
+                        getattr(StructFile, name)))
+
     def Match(self, metadata):
         """ Return matching fragments of the data in this file.  A tag
         is considered to match if all ``<Group>`` and ``<Client>``
@@ -876,6 +1019,13 @@ class StructFile(XMLFileBacked):
         interface to accept a different number of arguments.  This
         provides a sane prototype for the Match() function while
         keeping the internals consistent. """
+        if self.template is None and self._compiled is not None and \
+                self._default_match("_xml_match"):
+            rv = self._copy_element(self.xdata)
+            rv.extend(self._match_compiled(self._compiled, metadata, args,
+                                           [None] * len(self._predicates),
+                                           parent=rv))
+            return rv
         if self.template is None:
             rv = copy.deepcopy(self.xdata)
         else:
@@ -979,10 +1129,14 @@ class PriorityStructFile(StructFile):
     Index.__doc__ = StructFile.Index.__doc__
 
 
-class PrioDir(Plugin, Generator, XMLDirectoryBacked):
+class PrioDir(Plugin, Generator, XMLDirectoryBacked, ClientRunHooks):
     """ PrioDir handles a directory of XML files where each file has a
     set priority.
 
+    The data in each file that applies to a client is matched once
+    per client run and indexed by tag and name, so that binding an
+    entry does not require searching every file.
+
     .. -----
     .. autoattribute:: __child__
     """
@@ -995,7 +1149,14 @@ class PrioDir(Plugin, Generator, XMLDirectoryBacked):
     def __init__(self, core):
         Plugin.__init__(self, core)
         Generator.__init__(self)
+        ClientRunHooks.__init__(self)
         XMLDirectoryBacked.__init__(self, self.data)
+
+        #: A dict of <hostname>: (<metadata>, <dict of <filename>:
+        #: <index>>) for the clients whose runs are in progress.  The
+        #: index of each file is built on first use by
+        #: :func:`_get_match_index` and dropped when the run ends.
+        self._match_indexes = dict()
     __init__.__doc__ = Plugin.__init__.__doc__
 
     def HandleEvent(self, event):
@@ -1008,8 +1169,115 @@ class PrioDir(Plugin, Generator, XMLDirectoryBacked):
                 if child.tag not in self.Entries:
                     self.Entries[child.tag] = dict()
                 self.Entries[child.tag][child.get("name")] = self.BindEntry
+        self.expire_match_indexes()
     HandleEvent.__doc__ = XMLDirectoryBacked.HandleEvent.__doc__
 
+    def expire_match_indexes(self):
+        """ Drop the indexes built for the clients whose runs are in
+        progress, so that changes to the data are picked up.  This
+        must be called whenever the data changes. """
+        for _, indexes in self._match_indexes.values():
+            indexes.clear()
+
+    def start_client_run(self, metadata):
+        self._match_indexes[metadata.hostname] = (metadata, dict())
+    start_client_run.__doc__ = ClientRunHooks.start_client_run.__doc__
+
+    def end_client_run(self, metadata):
+        self._match_indexes.pop(metadata.hostname, None)
+    end_client_run.__doc__ = ClientRunHooks.end_client_run.__doc__
+
+    def _index_name(self, tag, name):  # pylint: disable=W0613
+        """ Get the name under which an entry or candidate is indexed
+        by :func:`_index`.  By default this is just the name, but it
+        can be overridden to normalize names.
+
+        :param tag: The tag of the entry or candidate
+        :type tag: string
+        :param name: The name of the entry or candidate
+        :type name: string
+        :returns: string
+        """
+        return name
+
+    def _index(self, data):
+        """ Index the data in a file that applies to a client.
+
+        :param data: The data that applies to the client, as returned
+                     by :func:`Bcfg2.Server.Plugin.helpers.StructFile.XMLMatch`
+        :type data: lxml.etree._Element
+        :returns: An index that :func:`_get_candidates` can search.
+                  By default this is a dict of <tag>: <dict of <name>:
+                  <list of candidates>>, with the candidates in
+                  document order.
+        """
+        rv = dict()
+        for candidate in data.iterdescendants():
+            if callable(candidate.tag):
+                # comments and processing instructions
+                continue
+            name = self._index_name(candidate.tag, candidate.get("name"))
+            rv.setdefault(candidate.tag, dict()).setdefault(
+                name, []).append(candidate)
+        return rv
+
+    def _get_match_index(self, name, src, metadata):
+        """ Get the index of the data in a file that applies to a
+        client.  During a client run, each file is only matched and
+        indexed once; outside of a client run (or if the metadata is
+        not the metadata the run was started with), the index is
+        built afresh.
+
+        :param name: The filename of the file
+        :type name: string
+        :param src: The file to get the index for
+        :type src: Bcfg2.Server.Plugin.helpers.PriorityStructFile
+        :param metadata: The client metadata
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: An index built by :func:`_index`
+        """
+        run = self._match_indexes.get(metadata.hostname)
+        if run is None or run[0] is not metadata:
+            return self._index(src.XMLMatch(metadata))
+        indexes = run[1]
+        if name not in indexes:
+            indexes[name] = self._index(src.XMLMatch(metadata))
+        return indexes[name]
+
+    def _get_candidates(self, entry, index):
+        """ Get the candidate concrete entries from an index that may
+        match the given abstract entry.  Each candidate is then
+        checked with :func:`_matches`.  By default this returns the
+        candidates with the same tag and name as the entry; plugins
+        that override :func:`_matches` to match entries with other
+        names must override this too.
+
+        :param entry: The entry to find candidates for
+        :type entry: lxml.etree._Element
+        :param index: An index built by :func:`_index`
+        :returns: list of lxml.etree._Element objects
+        """
+        return index.get(entry.tag, dict()).get(
+            self._index_name(entry.tag, entry.get("name")), [])
+
+    def _get_matching(self, entry, metadata):
+        """ Get all concrete entries that match the given abstract
+        entry.
+
+        :param entry: The entry to find matches for
+        :type entry: lxml.etree._Element
+        :param metadata: The metadata to get attributes for
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: list of tuples of (<file>, <concrete entry>)
+        """
+        matching = []
+        for name, src in self.entries.items():
+            index = self._get_match_index(name, src, metadata)
+            for candidate in self._get_candidates(entry, index):
+                if self._matches(entry, metadata, candidate):
+                    matching.append((src, candidate))
+        return matching
+
     def _matches(self, entry, metadata, candidate):  # pylint: disable=W0613
         """ Whether or not a given candidate matches the abstract
         entry given.  By default this does strict matching (i.e., the
@@ -1037,11 +1305,7 @@ class PrioDir(Plugin, Generator, XMLDirectoryBacked):
         :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
         :returns: None
         """
-        matching = []
-        for src in self.entries.values():
-            for candidate in src.XMLMatch(metadata).xpath("//%s" % entry.tag):
-                if self._matches(entry, metadata, candidate):
-                    matching.append((src, candidate))
+        matching = self._get_matching(entry, metadata)
         if len(matching) == 0:
             raise PluginExecutionError("No matching source for entry when "
                                        "retrieving attributes for %s:%s" %
@@ -1066,6 +1330,10 @@ class PrioDir(Plugin, Generator, XMLDirectoryBacked):
 
         self._apply(entry, data)
 
+    def is_client_specific(self, entry, metadata):
+        return any(src.client_specific for src in self.entries.values())
+    is_client_specific.__doc__ = Generator.is_client_specific.__doc__
+
     def _apply(self, entry, data):
         """ Apply all available values from data onto entry. This
         sets the available attributes (for all attribues unset in
@@ -1174,6 +1442,181 @@ class Specificity(CmpMixin):
         return "".join(rv)
 
 
+class SpecificityIndex(dict):
+    """ A dict of filename => ``entry_type`` object (see
+    :class:`Bcfg2.Server.Plugin.helpers.EntrySet`) that also indexes
+    its values by the clients they apply to, so that the entries that
+    match a client can be found without calling
+    :func:`Bcfg2.Server.Plugin.helpers.Specificity.matches` on every
+    entry.  The index is updated as items are added and removed.
+    Entries whose ``specific`` attribute is not a
+    :class:`Bcfg2.Server.Plugin.helpers.Specificity` object are not
+    indexed, and are matched the slow way.
+
+    The index is rebuilt copy-on-write, so it can be read safely
+    while the FAM thread modifies the dict. """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self)
+
+        #: Dict of hostname => list of host-specific entries
+        self.hosts = dict()
+
+        #: Dict of group name => list of group-specific entries,
+        #: sorted from highest to lowest priority
+        self.groups = dict()
+
+        #: List of entries that apply to all clients
+        self.all = []
+
+        #: List of entries that cannot be indexed
+        self.other = []
+
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self._unindex(self[key])
+        dict.__setitem__(self, key, value)
+        self._index(value)
+
+    def __delitem__(self, key):
+        self._unindex(self[key])
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):  # pylint: disable=W0221
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):  # pylint: disable=W0221
+        if key in self:
+            self._unindex(self[key])
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._unindex(value)
+        return key, value
+
+    def clear(self):
+        dict.clear(self)
+        self.hosts = dict()
+        self.groups = dict()
+        self.all = []
+        self.other = []
+
+    def _index(self, entry):
+        """ Add an entry to the index """
+        spec = getattr(entry, "specific", None)
+        if not isinstance(spec, Specificity):
+            self.other = self.other + [entry]
+        elif spec.all:
+            self.all = self.all + [entry]
+        elif spec.hostname:
+            hosts = dict(self.hosts)
+            hosts[spec.hostname] = hosts.get(spec.hostname, []) + [entry]
+            self.hosts = hosts
+        elif spec.group:
+            groups = dict(self.groups)
+            groups[spec.group] = sorted(groups.get(spec.group, []) + [entry],
+                                        key=lambda e: e.specific.prio,
+                                        reverse=True)
+            self.groups = groups
+        else:
+            self.other = self.other + [entry]
+
+    def _unindex(self, entry):
+        """ Remove an entry from the index """
+        self.all = [e for e in self.all if e is not entry]
+        self.other = [e for e in self.other if e is not entry]
+        spec = getattr(entry, "specific", None)
+        if isinstance(spec, Specificity):
+            if spec.hostname in self.hosts:
+                hosts = dict(self.hosts)
+                hosts[spec.hostname] = [e for e in hosts[spec.hostname]
+                                        if e is not entry]
+                if not hosts[spec.hostname]:
+                    del hosts[spec.hostname]
+                self.hosts = hosts
+            if spec.group in self.groups:
+                groups = dict(self.groups)
+                groups[spec.group] = [e for e in groups[spec.group]
+                                      if e is not entry]
+                if not groups[spec.group]:
+                    del groups[spec.group]
+                self.groups = groups
+
+    def _client_groups(self, metadata):
+        """ Get a list of the group-specific entry lists that apply to
+        the given client, walking either the client's groups or the
+        indexed groups, whichever is shorter. """
+        groups = self.groups
+        if not groups:
+            return []
+        if len(groups) < len(metadata.groups):
+            return [entries for group, entries in groups.items()
+                    if group in metadata.groups]
+        return [groups[group] for group in metadata.groups
+                if group in groups]
+
+    def get_matching(self, metadata, entry_type=None):
+        """ Get a list of all entries that apply to the given client.
+        See :func:`Bcfg2.Server.Plugin.helpers.EntrySet.get_matching`.
+
+        :param metadata: The client metadata to get matching entries for
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :param entry_type: Only return entries that are instances of
+                           the given type
+        :type entry_type: type
+        :returns: list
+        """
+        rv = list(self.all)
+        rv.extend(self.hosts.get(metadata.hostname, []))
+        for entries in self._client_groups(metadata):
+            rv.extend(entries)
+        if entry_type is not None:
+            rv = [e for e in rv if isinstance(e, entry_type)]
+            rv.extend(e for e in self.other
+                      if isinstance(e, entry_type) and
+                      e.specific.matches(metadata))
+        else:
+            rv.extend(e for e in self.other if e.specific.matches(metadata))
+        return rv
+
+    def best_matching(self, metadata):
+        """ Get the single most specific entry that applies to the
+        given client, or None if no entries apply.  See
+        :func:`Bcfg2.Server.Plugin.helpers.EntrySet.best_matching`.
+
+        :param metadata: The client metadata to get the best matching
+                         entry for
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: ``entry_type`` object or None
+        """
+        if self.other:
+            matching = self.get_matching(metadata)
+            if not matching:
+                return None
+            matching.sort(key=operator.attrgetter("specific"))
+            return matching[0]
+        if metadata.hostname in self.hosts:
+            return self.hosts[metadata.hostname][0]
+        best = None
+        for entries in self._client_groups(metadata):
+            if best is None or entries[0].specific.prio > best.specific.prio:
+                best = entries[0]
+        if best is not None:
+            return best
+        if self.all:
+            return self.all[0]
+        return None
+
+
 class SpecificData(Debuggable):
     """ A file that is specific to certain clients, groups, or all
     clients. """
@@ -1274,7 +1717,7 @@ class EntrySet(Debuggable):
         Debuggable.__init__(self, name=basename)
         self.path = path
         self.entry_type = entry_type
-        self.entries = {}
+        self._entries = SpecificityIndex()
         self.metadata = default_path_metadata()
         self.infoxml = None
 
@@ -1293,6 +1736,20 @@ class EntrySet(Debuggable):
         #: be overridden on a per-entry basis in :func:`entry_init`.
         self.specific = re.compile(pattern)
 
+    def _get_entries(self):
+        """ Get the dict of entries in this EntrySet """
+        return self._entries
+
+    def _set_entries(self, entries):
+        """ Replace the dict of entries in this EntrySet """
+        self._entries = SpecificityIndex(entries)
+
+    #: A :class:`Bcfg2.Server.Plugin.helpers.SpecificityIndex` of
+    #: filename => ``entry_type`` object (see the constructor docs).
+    #: Any dict assigned to ``entries`` is converted to a
+    #: SpecificityIndex.
+    entries = property(_get_entries, _set_entries)
+
     def set_debug(self, debug):
         rv = Debuggable.set_debug(self, debug)
         for entry in self.entries.values():
@@ -1312,8 +1769,7 @@ class EntrySet(Debuggable):
         :returns: list -- all matching ``entry_type`` objects (see the
                   constructor docs for more details)
         """
-        return [item for item in list(self.entries.values())
-                if item.specific.matches(metadata)]
+        return self.entries.get_matching(metadata)
 
     def best_matching(self, metadata, matching=None):
         """ Return the single most specific matching entry from the
@@ -1332,12 +1788,22 @@ class EntrySet(Debuggable):
         :raises: :class:`Bcfg2.Server.Plugin.exceptions.PluginExecutionError`
                  if no matching entries are found
         """
+        best = None
         if matching is None:
-            matching = self.get_matching(metadata)
-
+            if (getattr(self.get_matching, "__func__", None) is
+                    getattr(EntrySet.get_matching, "__func__",
+                            EntrySet.get_matching)):
+                # get_matching() has not been overridden, so the
+                # index can be used directly
+                best = self.entries.best_matching(metadata)
+            else:
+                matching = self.get_matching(metadata)
         if matching:
             matching.sort(key=operator.attrgetter("specific"))
-            return matching[0]
+            best = matching[0]
+
+        if best is not None:
+            return best
         else:
             raise PluginExecutionError("No matching entries available for %s "
                                        "for %s" % (self.path,
@@ -35,8 +35,20 @@ class Generator(object):
     #. If the entry is not listed in ``Entries``, the Bcfg2 core calls
        :func:`HandlesEntry`; if that returns True, then it calls
        :func:`HandleEntry`.
+
+    The core keeps an index of the ``Entries`` dicts of all loaded
+    generators that is updated whenever the file monitor handles
+    events, so plugins should only modify ``Entries`` at init time
+    or in response to FAM events.
     """
 
+    #: A list of entry tags that :func:`HandlesEntry` may return True
+    #: for, or None if it may claim entries with any tag.  The core
+    #: uses this to avoid calling :func:`HandlesEntry` on generators
+    #: that can never handle a given entry.  Generators that do not
+    #: override :func:`HandlesEntry` are never consulted at all.
+    handles_entry_tags = None
+
     def HandlesEntry(self, entry, metadata):
         """ HandlesEntry is the slow path method for routing
         configuration binding requests.  It is called if the
@@ -68,6 +80,27 @@ class Generator(object):
         """
         return entry
 
+    def is_client_specific(self, entry, metadata):
+        """ Whether or not the bound form of the given entry can
+        differ between clients that have the same profile, groups,
+        bundles, and categories.  If ``[caching] bound_entries`` is
+        enabled, entries for which this returns False are bound once
+        per such equivalence class of clients, and the bound entry is
+        reused for all other clients in the class.  Entries that
+        depend on the client hostname, probe data, or any other
+        per-client data must return True.
+
+        The default implementation always returns True, so entries
+        are only shared by generators that explicitly opt in.
+
+        :param entry: The abstract entry to be bound
+        :type entry: lxml.etree._Element
+        :param metadata: The client metadata
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :return: bool
+        """
+        return True
+
 
 class Structure(object):
     """ Structure Plugins contribute to abstract client
@@ -305,7 +338,8 @@ class Probing(object):
         :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
         :param datalist: The probe data
         :type datalist: list of lxml.etree._Element objects
-        :return: None
+        :return: list of the names of probes whose full output the
+                 client must upload again, or None
         """
         raise NotImplementedError
 
@@ -620,7 +654,8 @@ class ClientRunHooks(object):
     def end_client_run(self, metadata):
         """ Invoked at the end of a client run, immediately after
         :class:`GoalValidator` plugins have been run and just before
-        the configuration is returned to the client.
+        the configuration is returned to the client.  This is also
+        invoked if building the configuration fails.
 
         :param metadata: The client metadata object
         :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
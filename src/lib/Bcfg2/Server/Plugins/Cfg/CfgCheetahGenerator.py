@@ -38,6 +38,10 @@ class CfgCheetahGenerator(CfgGenerator):
     #: .crypt.cheetah files
     __priority__ = 50
 
+    #: Templates may be rendered in worker processes when ``[cfg]
+    #: render_processes`` is set
+    __pooled__ = True
+
     #: :class:`Cheetah.Template.Template` compiler settings
     settings = dict(useStackFrames=False)
 
@@ -48,11 +52,19 @@ class CfgCheetahGenerator(CfgGenerator):
     __init__.__doc__ = CfgGenerator.__init__.__doc__
 
     def get_data(self, entry, metadata):
+        return self.render_template(entry,
+                                    self.get_template_vars(entry, metadata))
+    get_data.__doc__ = CfgGenerator.get_data.__doc__
+
+    def get_template_vars(self, entry, metadata):
+        return get_template_data(entry, metadata, self.name,
+                                 default=DefaultCheetahDataProvider())
+    get_template_vars.__doc__ = CfgGenerator.get_template_vars.__doc__
+
+    def render_template(self, entry, template_vars):
         template = Template(self.data.decode(Bcfg2.Options.setup.encoding),
                             compilerSettings=self.settings)
-        for key, val in get_template_data(
-            entry, metadata, self.name,
-            default=DefaultCheetahDataProvider()).items():
+        for key, val in template_vars.items():
             setattr(template, key, val)
         return template.respond()
-    get_data.__doc__ = CfgGenerator.get_data.__doc__
+    render_template.__doc__ = CfgGenerator.render_template.__doc__
@@ -77,6 +77,10 @@ class CfgGenshiGenerator(CfgGenerator):
     #: .crypt.genshi files
     __priority__ = 50
 
+    #: Templates may be rendered in worker processes when ``[cfg]
+    #: render_processes`` is set
+    __pooled__ = True
+
     #: Error-handling in Genshi is pretty obtuse.  This regex is used
     #: to extract the first line of the code block that raised an
     #: exception in a Genshi template so we can provide a decent error
@@ -91,14 +95,22 @@ class CfgGenshiGenerator(CfgGenerator):
     __init__.__doc__ = CfgGenerator.__init__.__doc__
 
     def get_data(self, entry, metadata):
+        return self.render_template(entry,
+                                    self.get_template_vars(entry, metadata))
+    get_data.__doc__ = CfgGenerator.get_data.__doc__
+
+    def get_template_vars(self, entry, metadata):
+        return get_template_data(entry, metadata, self.name,
+                                 default=DefaultGenshiDataProvider())
+    get_template_vars.__doc__ = CfgGenerator.get_template_vars.__doc__
+
+    def render_template(self, entry, template_vars):
         if self.template is None:
             raise PluginExecutionError("Failed to load template %s" %
                                        self.name)
 
         stream = self.template.generate(
-            **get_template_data(
-                entry, metadata, self.name,
-                default=DefaultGenshiDataProvider())).filter(removecomment)
+            **template_vars).filter(removecomment)
         try:
             try:
                 return stream.render('text',
@@ -121,7 +133,7 @@ class CfgGenshiGenerator(CfgGenerator):
             # this needs to be a blanket except, since it can catch
             # any error raised by the genshi template.
             self._handle_genshi_exception(sys.exc_info())
-    get_data.__doc__ = CfgGenerator.get_data.__doc__
+    render_template.__doc__ = CfgGenerator.render_template.__doc__
 
     def _handle_genshi_exception(self, exc):
         """ this is horrible, and I deeply apologize to whoever gets
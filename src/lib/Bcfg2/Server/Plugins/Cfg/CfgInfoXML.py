@@ -23,3 +23,7 @@ class CfgInfoXML(CfgInfo):
     def handle_event(self, event):
         self.infoxml.HandleEvent()
     handle_event.__doc__ = CfgInfo.handle_event.__doc__
+
+    def is_client_specific(self):
+        return self.infoxml.client_specific
+    is_client_specific.__doc__ = CfgInfo.is_client_specific.__doc__
@@ -61,6 +61,10 @@ class CfgJinja2Generator(CfgGenerator):
     #: .crypt.jinja2 files
     __priority__ = 50
 
+    #: Templates may be rendered in worker processes when ``[cfg]
+    #: render_processes`` is set
+    __pooled__ = True
+
     def __init__(self, fname, spec):
         CfgGenerator.__init__(self, fname, spec)
         if not HAS_JINJA2:
@@ -81,13 +85,21 @@ class CfgJinja2Generator(CfgGenerator):
     __init__.__doc__ = CfgGenerator.__init__.__doc__
 
     def get_data(self, entry, metadata):
+        return self.render_template(entry,
+                                    self.get_template_vars(entry, metadata))
+    get_data.__doc__ = CfgGenerator.get_data.__doc__
+
+    def get_template_vars(self, entry, metadata):
+        return get_template_data(entry, metadata, self.name,
+                                 default=DefaultJinja2DataProvider())
+    get_template_vars.__doc__ = CfgGenerator.get_template_vars.__doc__
+
+    def render_template(self, entry, template_vars):
         if self.template is None:
             raise PluginExecutionError("Failed to load template %s" %
                                        self.name)
-        return self.template.render(
-            get_template_data(entry, metadata, self.name,
-                              default=DefaultJinja2DataProvider()))
-    get_data.__doc__ = CfgGenerator.get_data.__doc__
+        return self.template.render(template_vars)
+    render_template.__doc__ = CfgGenerator.render_template.__doc__
 
     def handle_event(self, event):
         CfgGenerator.handle_event(self, event)
@@ -16,3 +16,7 @@ class CfgPlaintextGenerator(CfgGenerator):
     #: Very low priority to avoid matching host- or group-specific
     #: files with other extensions -- e.g., .genshi, .crypt, etc.
     __priority__ = 100
+
+    def is_client_specific(self):
+        return self.specific.hostname is not None
+    is_client_specific.__doc__ = CfgGenerator.is_client_specific.__doc__
@@ -3,14 +3,23 @@
 import re
 import os
 import sys
+import time
 import errno
+import signal
+import weakref
 import operator
+import threading
 import lxml.etree
+import multiprocessing
 import Bcfg2.Options
+import Bcfg2.Server.Cache
 import Bcfg2.Server.Plugin
+import Bcfg2.Server.Statistics
 from Bcfg2.Server.Plugin import PluginExecutionError
+from Bcfg2.Server.FileMonitor import Event
 # pylint: disable=W0622
-from Bcfg2.Compat import u_str, unicode, b64encode, any, walk_packages
+from Bcfg2.Compat import u_str, unicode, b64encode, any, walk_packages, \
+    cPickle
 # pylint: enable=W0622
 
 try:
@@ -24,6 +33,12 @@ _handlers = [m[1]  # pylint: disable=C0103
 
 _CFG = None
 
+#: Per-client cache of bound Cfg entries, used when ``[caching] cfg``
+#: is enabled.  Keys are client hostnames; values are ``(<metadata
+#: fingerprint>, <dict of rendered entries>)`` tuples.  See
+#: :func:`CfgEntrySet.bind_entry` for details.
+_RENDERED = Bcfg2.Server.Cache.Cache("Cfg", "rendered")
+
 
 def get_cfg():
     """ Get the :class:`Bcfg2.Server.Plugins.Cfg.Cfg` plugin object
@@ -35,6 +50,55 @@ def get_cfg():
     return _CFG
 
 
+def get_metadata_fingerprint(metadata):
+    """ Get a summary of the parts of a client metadata object that
+    can affect the content of a bound Cfg entry.  The fingerprint is
+    hashable and can be compared for equality; if the fingerprint of
+    a client's metadata changes, all rendered entries cached for that
+    client are discarded.
+
+    Probe data is included in the fingerprint, but data from other
+    Connector plugins is not; those plugins are expected to expire
+    the ``Metadata`` cache when their data changes.
+
+    :param metadata: The client metadata to summarize
+    :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+    :returns: tuple
+    """
+    probedata = getattr(metadata, "Probes", None) or dict()
+    return (metadata.hostname,
+            metadata.profile,
+            frozenset(metadata.groups),
+            frozenset(metadata.bundles),
+            frozenset(metadata.categories.items()),
+            frozenset(metadata.aliases),
+            frozenset(metadata.addresses),
+            metadata.version,
+            frozenset(probedata.items()))
+
+
+def _expire_rendered(tags, exact, _):
+    """ :func:`Bcfg2.Server.Cache.add_expire_hook` hook that discards
+    rendered Cfg entries when the ``Metadata`` cache is expired.
+    Expiring metadata for all clients discards all rendered entries;
+    expiring metadata for one client discards only that client's
+    rendered entries.  Exact expirations of a single client's
+    metadata, such as the one the core performs at the start of each
+    client run in ``cautious`` mode, signal that the metadata object
+    should be rebuilt rather than that its data has changed, so they
+    are left to the metadata fingerprint check. """
+    if "Metadata" not in tags or "Cfg" in tags:
+        return
+    hostnames = [t for t in tags if t != "Metadata"]
+    if not hostnames:
+        _RENDERED.expire()
+    elif not exact:
+        for hostname in hostnames:
+            _RENDERED.expire(hostname)
+
+Bcfg2.Server.Cache.add_expire_hook(_expire_rendered)
+
+
 class CfgBaseFileMatcher(Bcfg2.Server.Plugin.SpecificData):
     """ .. currentmodule:: Bcfg2.Server.Plugins.Cfg
 
@@ -161,6 +225,19 @@ class CfgBaseFileMatcher(Bcfg2.Server.Plugin.SpecificData):
         """
         return any(event.filename.endswith("." + e) for e in cls.__ignore__)
 
+    def is_client_specific(self):
+        """ Return True if the data this handler contributes to an
+        entry can differ between clients that have identical groups.
+        This is used to implement
+        :func:`Bcfg2.Server.Plugin.interfaces.Generator.is_client_specific`
+        for Cfg entries.  The default is True; handlers whose output
+        depends only on the file contents and the groups the file is
+        specific to can override this.
+
+        :returns: bool
+        """
+        return True
+
     def __str__(self):
         return "%s(%s)" % (self.__class__.__name__, self.name)
 
@@ -173,6 +250,15 @@ class CfgGenerator(CfgBaseFileMatcher):
     client. See :class:`Bcfg2.Server.Plugin.helpers.EntrySet` for more
     details on how the best handler is chosen."""
 
+    #: Whether or not entries may be rendered in a
+    #: :class:`Bcfg2.Server.Plugins.Cfg.CfgRenderPool` worker process
+    #: when ``[cfg] render_processes`` is set.  This should only be
+    #: True for generators that are CPU-bound, such as template
+    #: engines, and whose output depends only on the entry and the
+    #: template variables.  Generators that set it must implement
+    #: :func:`get_template_vars` and :func:`render_template`.
+    __pooled__ = False
+
     def __init__(self, name, specific):
         # we define an __init__ that just calls the parent __init__,
         # so that we can set the docstring on __init__ to something
@@ -196,6 +282,34 @@ class CfgGenerator(CfgBaseFileMatcher):
         """
         return self.data
 
+    def get_template_vars(self, entry, metadata):
+        """ Get the variables used to render a template for the given
+        entry and client.  This is only used by generators that set
+        :attr:`__pooled__`; it is called in the server process, and
+        the variables are then passed to :func:`render_template` in a
+        worker process.
+
+        :param entry: The entry to generate data for.
+        :type entry: lxml.etree._Element
+        :param metadata: The client metadata to generate data for.
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: dict of variable name -> value
+        """
+        raise NotImplementedError
+
+    def render_template(self, entry, template_vars):
+        """ Render a template with the variables returned by
+        :func:`get_template_vars`.  This is only used by generators
+        that set :attr:`__pooled__`.
+
+        :param entry: The entry to generate data for.
+        :type entry: lxml.etree._Element
+        :param template_vars: The template variables
+        :type template_vars: dict
+        :returns: string - the contents of the entry
+        """
+        raise NotImplementedError
+
 
 class CfgFilter(CfgBaseFileMatcher):
     """ CfgFilters modify the initial content of a file after it has
@@ -520,6 +634,11 @@ class CfgEntrySet(Bcfg2.Server.Plugin.EntrySet):
     def __init__(self, basename, path, entry_type):
         Bcfg2.Server.Plugin.EntrySet.__init__(self, basename, path, entry_type)
         self.specific = None
+
+        #: A counter that is incremented on every event on a file in
+        #: this entry set.  Rendered entries cached for an older
+        #: revision are treated as expired.
+        self.revision = 0
     __init__.__doc__ = Bcfg2.Server.Plugin.EntrySet.__doc__
 
     def set_debug(self, debug):
@@ -537,6 +656,7 @@ class CfgEntrySet(Bcfg2.Server.Plugin.EntrySet):
         :type event: Bcfg2.Server.FileMonitor.Event
         :returns: None
         """
+        self.revision += 1
         action = event.code2str()
 
         if event.filename not in self.entries:
@@ -618,6 +738,52 @@ class CfgEntrySet(Bcfg2.Server.Plugin.EntrySet):
             self.entries[event.filename].handle_event(event)
 
     def bind_entry(self, entry, metadata):
+        """ Bind the data for the given entry.  If ``[caching] cfg``
+        is enabled, the bound entry is cached per client and reused
+        as long as the files in this entry set, the client metadata
+        fingerprint (see :func:`get_metadata_fingerprint`), the
+        repository revision, and the attributes of the abstract entry
+        are all unchanged.
+
+        :param entry: The abstract entry to bind data for
+        :type entry: lxml.etree._Element
+        :param metadata: The client metadata to get data for
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: lxml.etree._Element - the fully-bound entry
+        """
+        if not Bcfg2.Options.setup.cfg_cache:
+            return self._bind_entry(entry, metadata)
+
+        start = time.time()
+        name = (self.path, entry.get('realname', entry.get('name')))
+        key = (self.revision, get_cfg().core.revision,
+               tuple(sorted(entry.attrib.items())))
+        fingerprint = get_metadata_fingerprint(metadata)
+        try:
+            cached_fingerprint, rendered = _RENDERED[metadata.hostname]
+        except KeyError:
+            cached_fingerprint = None
+        if cached_fingerprint != fingerprint:
+            rendered = dict()
+            _RENDERED[metadata.hostname] = (fingerprint, rendered)
+
+        cached = rendered.get(name)
+        if cached is not None and cached[0] == key:
+            entry.attrib.update(cached[1])
+            entry.text = cached[2]
+            Bcfg2.Server.Statistics.stats.add_value(
+                "Cfg:rendered_cache_hit", time.time() - start)
+            return entry
+
+        self._bind_entry(entry, metadata)
+        rendered[name] = (key, dict(entry.attrib), entry.text)
+        Bcfg2.Server.Statistics.stats.add_value("Cfg:rendered_cache_miss",
+                                                time.time() - start)
+        return entry
+
+    def _bind_entry(self, entry, metadata):
+        """ Bind the data for the given entry without consulting the
+        rendered entry cache.  See :func:`bind_entry`. """
         self.bind_info_to_entry(entry, metadata)
         data, generator = self._generate_data(entry, metadata)
 
@@ -673,7 +839,6 @@ class CfgEntrySet(Bcfg2.Server.Plugin.EntrySet):
         else:
             entry.set('empty', 'true')
         return entry
-    bind_entry.__doc__ = Bcfg2.Server.Plugin.EntrySet.bind_entry.__doc__
 
     def get_handlers(self, metadata, handler_type):
         """ Get all handlers of the given type for the given metadata.
@@ -684,12 +849,23 @@ class CfgEntrySet(Bcfg2.Server.Plugin.EntrySet):
         :type handler_type: type
         :returns: list of Cfg handler classes
         """
-        rv = []
-        for ent in self.entries.values():
-            if (isinstance(ent, handler_type) and
-                    (not ent.__specific__ or ent.specific.matches(metadata))):
-                rv.append(ent)
-        return rv
+        return self.entries.get_matching(metadata, entry_type=handler_type)
+
+    def is_client_specific(self, metadata):
+        """ Return True if the bound entry for the given client can
+        differ from the bound entry for other clients with identical
+        groups; i.e., if any handler that applies to the client is
+        client-specific.
+
+        :param metadata: The client metadata
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: bool
+        """
+        handlers = self.get_handlers(metadata, CfgBaseFileMatcher)
+        if not self.get_handlers(metadata, CfgGenerator):
+            # data may be created specifically for this client
+            return True
+        return any(hdlr.is_client_specific() for hdlr in handlers)
 
     def bind_info_to_entry(self, entry, metadata):
         """ Bind entry metadata to the entry with the best CfgInfo
@@ -753,6 +929,11 @@ class CfgEntrySet(Bcfg2.Server.Plugin.EntrySet):
             return (self._create_data(entry, metadata), None)
 
         try:
+            pool = getattr(get_cfg(), "render_pool", None)
+            if pool is not None and generator.__pooled__:
+                data = pool.render(generator, entry, metadata)
+                if data is not None:
+                    return (data, generator)
             return (generator.get_data(entry, metadata), generator)
         except:
             # TODO: the exceptions raised by ``get_data`` are not
@@ -860,6 +1041,234 @@ class CfgEntrySet(Bcfg2.Server.Plugin.EntrySet):
                            flag=log)
 
 
+#: The Cfg generation (see :attr:`CfgRenderPool.generation`) of the
+#: templates loaded in a :class:`CfgRenderPool` worker process
+_RENDER_GENERATION = None
+
+#: The generators loaded in a :class:`CfgRenderPool` worker process.
+#: Keys are generator filenames; values are
+#: :class:`Bcfg2.Server.Plugins.Cfg.CfgGenerator` objects.
+_RENDER_GENERATORS = dict()
+
+
+def _init_render_worker():
+    """ Initialize a :class:`Bcfg2.Server.Plugins.Cfg.CfgRenderPool`
+    worker process.  Any database connection inherited from the
+    server is closed, so that the worker never shares one with the
+    server, and ``SIGINT`` is ignored so that interrupting a server
+    running in the foreground only interrupts the server. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if get_cfg().core.database_available:
+        from django import db
+        db.close_connection()
+
+
+def _render_in_pool(cls, name, specific, generation, entry, template_vars):
+    """ Render a Cfg entry in a
+    :class:`Bcfg2.Server.Plugins.Cfg.CfgRenderPool` worker process.
+    The worker loads the template from disk the first time it is
+    used, and again after the Cfg generation changes.
+
+    :param cls: The class of the generator to render with
+    :type cls: type
+    :param name: The full path to the template file
+    :type name: string
+    :param specific: The specificity of the template file
+    :type specific: Bcfg2.Server.Plugin.helpers.Specificity
+    :param generation: The current :attr:`CfgRenderPool.generation`
+    :type generation: int
+    :param entry: The abstract entry to render, as an XML string
+    :type entry: string
+    :param template_vars: The template variables to render with, as
+                          a dict of variable name -> pickled value
+    :type template_vars: dict
+    :returns: tuple of ``(<status>, <data or error message>)``, where
+              ``<status>`` is True on success and False if rendering
+              failed
+    """
+    global _RENDER_GENERATION  # pylint: disable=W0603
+    try:
+        if generation != _RENDER_GENERATION:
+            _RENDER_GENERATORS.clear()
+            _RENDER_GENERATION = generation
+        generator = _RENDER_GENERATORS.get(name)
+        if generator is None or generator.__class__ is not cls:
+            generator = cls(name, specific)
+            generator.handle_event(Event(None, name, "changed"))
+            _RENDER_GENERATORS[name] = generator
+        return (True, generator.render_template(
+            lxml.etree.XML(entry),
+            dict((key, cPickle.loads(val))
+                 for key, val in template_vars.items())))
+    except:  # pylint: disable=W0702
+        # the exceptions raised by ``render_template`` are not
+        # constrained in any way, and may not be picklable, so we
+        # return the error message rather than letting the pool
+        # re-raise it
+        err = sys.exc_info()[1]
+        return (False, "%s: %s" % (err.__class__.__name__, err))
+
+
+class UnpicklableValue(object):
+    """ Stand-in for a template variable or client metadata attribute
+    that cannot be pickled, and so cannot be sent to a
+    :class:`Bcfg2.Server.Plugins.Cfg.CfgRenderPool` worker process
+    (e.g., the :class:`Bcfg2.Server.Plugins.Metadata.MetadataQuery`
+    object, or modules from the TemplateHelper plugin).  Any use of
+    the value in a template raises
+    :exc:`Bcfg2.Server.Plugin.exceptions.PluginExecutionError`, so
+    the template is rendered in the server process instead of being
+    rendered with a missing value.  (Attribute errors are not raised,
+    since some template engines render missing attributes as empty
+    strings.) """
+
+    def __init__(self, name):
+        #: The name of the value that could not be pickled
+        self.name = name
+
+    def _unavailable(self, *args):
+        """ Raise an exception for any use of the value """
+        raise PluginExecutionError("%s is not available in render "
+                                   "processes" % self.name)
+
+    __call__ = __contains__ = __getitem__ = __iter__ = __len__ = \
+        __nonzero__ = __bool__ = __str__ = __unicode__ = _unavailable
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            # the pickle module looks up special methods
+            raise AttributeError(attr)
+        self._unavailable()
+
+
+def _picklable(value, name):
+    """ Get a value to send to a
+    :class:`Bcfg2.Server.Plugins.Cfg.CfgRenderPool` worker process:
+    either the value itself, or an :class:`UnpicklableValue` if it
+    cannot be pickled. """
+    try:
+        cPickle.dumps(value, 2)
+        return value
+    except:  # pylint: disable=W0702
+        return UnpicklableValue(name)
+
+
+class CfgRenderPool(Bcfg2.Server.Plugin.Debuggable):
+    """ A pool of worker processes that render
+    :class:`Bcfg2.Server.Plugins.Cfg.CfgGenerator` objects whose
+    :attr:`CfgGenerator.__pooled__` flag is set, so that concurrent
+    client runs can render templates on more than one CPU.
+
+    The workers are forked when the pool is created, which is while
+    the Cfg plugin is loaded, before the server has started any
+    threads.  They do not share any plugin state with the server.
+    The server collects the template variables for each entry,
+    including the client metadata, and sends them to a worker
+    pickled; the worker loads the template itself, and caches it
+    until the Cfg plugin handles a file monitor event.  Values that
+    cannot be pickled are replaced with :class:`UnpicklableValue`
+    objects; if a template uses one, or fails to render in a worker
+    for any other reason, it is rendered in the server process
+    instead. """
+
+    def __init__(self, core, processes):
+        """
+        :param core: The Bcfg2 server core
+        :type core: Bcfg2.Server.Core.BaseCore
+        :param processes: The number of worker processes to start
+        :type processes: int
+        """
+        Bcfg2.Server.Plugin.Debuggable.__init__(self)
+        self.core = core
+
+        #: The number of worker processes in the pool
+        self.processes = processes
+
+        #: A counter that is incremented whenever the Cfg plugin
+        #: handles a file monitor event.  Workers discard the
+        #: templates they have loaded when it changes.
+        self.generation = 0
+
+        #: A dict of client metadata object -> pickled copy of the
+        #: metadata, so that the metadata for a client run is only
+        #: pickled once
+        self._metadata = weakref.WeakKeyDictionary()
+
+        #: Lock that must be held to access :attr:`_metadata`
+        self._lock = threading.Lock()
+
+        # workers must never share a database connection with the
+        # server, so make sure there is none open to inherit
+        if core.database_available:
+            from django import db
+            db.close_connection()
+
+        self.logger.debug("Cfg: Starting %s render processes" % processes)
+
+        #: The :class:`multiprocessing.pool.Pool` of workers
+        self.pool = multiprocessing.Pool(processes=processes,
+                                         initializer=_init_render_worker)
+
+    def expire(self):
+        """ Make workers discard the templates they have loaded.  This
+        is called whenever the Cfg plugin handles a file monitor
+        event. """
+        self.generation += 1
+
+    def _pickle_metadata(self, metadata):
+        """ Get a pickled copy of the given client metadata, with
+        attributes that cannot be pickled replaced by
+        :class:`UnpicklableValue` objects. """
+        self._lock.acquire()
+        try:
+            if metadata not in self._metadata:
+                rv = object.__new__(metadata.__class__)
+                for key, val in metadata.__dict__.items():
+                    setattr(rv, key, _picklable(val, "metadata.%s" % key))
+                self._metadata[metadata] = cPickle.dumps(rv, 2)
+            return self._metadata[metadata]
+        finally:
+            self._lock.release()
+
+    def render(self, generator, entry, metadata):
+        """ Render an entry in a worker process.
+
+        :param generator: The generator to render the entry with
+        :type generator: Bcfg2.Server.Plugins.Cfg.CfgGenerator
+        :param entry: The abstract entry to render
+        :type entry: lxml.etree._Element
+        :param metadata: The client metadata to render for
+        :type metadata: Bcfg2.Server.Plugins.Metadata.ClientMetadata
+        :returns: string - the rendered data, or None if the entry
+                  must be rendered in the server process instead
+        """
+        start = time.time()
+        template_vars = dict()
+        for key, val in generator.get_template_vars(entry,
+                                                    metadata).items():
+            if val is metadata:
+                template_vars[key] = self._pickle_metadata(metadata)
+            else:
+                template_vars[key] = cPickle.dumps(_picklable(val, key), 2)
+        status, data = self.pool.apply(
+            _render_in_pool,
+            (generator.__class__, generator.name, generator.specific,
+             self.generation, lxml.etree.tostring(entry), template_vars))
+        if not status:
+            self.debug_log("Cfg: Failed to render %s in render processes, "
+                           "rendering locally: %s" % (generator.name, data))
+            Bcfg2.Server.Statistics.stats.add_value("Cfg:render_pool_failed",
+                                                    time.time() - start)
+            return None
+        Bcfg2.Server.Statistics.stats.add_value("Cfg:render_pool",
+                                                time.time() - start)
+        return data
+
+    def close(self):
+        """ Shut down the worker pool """
+        self.pool.terminate()
+
+
 class CfgHandlerAction(Bcfg2.Options.ComponentAction):
     """ Option parser action to load Cfg handlers """
     bases = ['Bcfg2.Server.Plugins.Cfg']
@@ -874,6 +1283,7 @@ class Cfg(Bcfg2.Server.Plugin.GroupSpool,
     __author__ = 'bcfg-dev@mcs.anl.gov'
     es_cls = CfgEntrySet
     es_child_cls = Bcfg2.Server.Plugin.SpecificData
+    __rmi__ = Bcfg2.Server.Plugin.GroupSpool.__rmi__ + ['expire_cache']
 
     options = Bcfg2.Server.Plugin.GroupSpool.options + [
         Bcfg2.Options.BooleanOption(
@@ -890,7 +1300,14 @@ class Cfg(Bcfg2.Server.Plugin.GroupSpool,
             cf=("cfg", "handlers"), dest="cfg_handlers",
             help="Cfg handlers to load",
             type=Bcfg2.Options.Types.comma_list, action=CfgHandlerAction,
-            default=_handlers)]
+            default=_handlers),
+        Bcfg2.Options.BooleanOption(
+            cf=('caching', 'cfg'), dest="cfg_cache", default=False,
+            help='Cache bound Cfg entries for each client'),
+        Bcfg2.Options.Option(
+            cf=('cfg', 'render_processes'), dest="cfg_render_processes",
+            type=int, default=0,
+            help='Render Cfg templates in this many worker processes')]
 
     def __init__(self, core):
         global _CFG  # pylint: disable=W0603
@@ -899,8 +1316,28 @@ class Cfg(Bcfg2.Server.Plugin.GroupSpool,
         Bcfg2.Options.setup.cfg_handlers.sort(
             key=operator.attrgetter("__priority__"))
         _CFG = self
+
+        #: The :class:`Bcfg2.Server.Plugins.Cfg.CfgRenderPool` used
+        #: to render templates, or None if ``[cfg] render_processes``
+        #: is not set
+        self.render_pool = None
+        if Bcfg2.Options.setup.cfg_render_processes > 0:
+            self.render_pool = CfgRenderPool(
+                core, Bcfg2.Options.setup.cfg_render_processes)
     __init__.__doc__ = Bcfg2.Server.Plugin.GroupSpool.__init__.__doc__
 
+    def shutdown(self):
+        if self.render_pool is not None:
+            self.render_pool.close()
+        Bcfg2.Server.Plugin.GroupSpool.shutdown(self)
+    shutdown.__doc__ = Bcfg2.Server.Plugin.GroupSpool.shutdown.__doc__
+
+    def HandleEvent(self, event):
+        if self.render_pool is not None:
+            self.render_pool.expire()
+        Bcfg2.Server.Plugin.GroupSpool.HandleEvent(self, event)
+    HandleEvent.__doc__ = Bcfg2.Server.Plugin.GroupSpool.HandleEvent.__doc__
+
     def has_generator(self, entry, metadata):
         """ Return True if the given entry can be generated for the
         given metadata; False otherwise
@@ -920,6 +1357,18 @@ class Cfg(Bcfg2.Server.Plugin.GroupSpool,
         return bool(self.entries[entry.get('name')].get_handlers(metadata,
                                                                  CfgGenerator))
 
+    def expire_cache(self, key=None):
+        """ Expire rendered Cfg entries for one host, or for all
+        hosts.  This is exposed as an XML-RPC RMI so that entries
+        that depend on data outside of the Bcfg2 repository can be
+        refreshed on demand. """
+        _RENDERED.expire(key=key)
+
+    def is_client_specific(self, entry, metadata):
+        return self.entries[entry.get('name')].is_client_specific(metadata)
+    is_client_specific.__doc__ = \
+        Bcfg2.Server.Plugin.Generator.is_client_specific.__doc__
+
     def AcceptChoices(self, entry, metadata):
         return self.entries[entry.get('name')].list_accept_choices(entry,
                                                                    metadata)
@@ -21,12 +21,14 @@ class Defaults(Bcfg2.Server.Plugins.Rules.Rules,
     # validation phase.  so we overload Handle(s)Entry and HandleEvent
     # to ensure that Defaults handles no entries, even though it's a
     # Generator.
+    handles_entry_tags = []
 
     def HandlesEntry(self, entry, metadata):
         return False
 
     def HandleEvent(self, event):
         Bcfg2.Server.Plugin.XMLDirectoryBacked.HandleEvent(self, event)
+        self.expire_match_indexes()
 
     def validate_goals(self, metadata, config):
         """ Apply defaults """
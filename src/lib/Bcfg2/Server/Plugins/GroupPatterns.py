@@ -12,6 +12,75 @@ class PatternInitializationError(Exception):
     """Raised when creating a PatternMap object fails."""
 
 
+#: Characters with special meaning in regular expressions
+REGEX_META = ".^$*+?{}[]\\|()"
+
+
+def literal_prefix(regex):
+    """ Get the literal text that every string matched by the given
+    regex (as used with :func:`re.search`) must start with, or an
+    empty string if there is none that can safely be determined. """
+    if not regex.startswith("^") or "|" in regex:
+        return ""
+    prefix = []
+    for char in regex[1:]:
+        if char in REGEX_META:
+            if char in "*?{" and prefix:
+                # the last literal character is optional
+                prefix.pop()
+            break
+        prefix.append(char)
+    return "".join(prefix)
+
+
+def noncapturing(regex):
+    """ Rewrite the given regex so that all of its groups are
+    non-capturing, so that it can be combined with other regexes in
+    a single alternation.  Returns None if the regex cannot safely be
+    combined with others, i.e., if it uses backreferences,
+    conditionals or inline flags. """
+    rv = []
+    i = 0
+    in_class = False
+    while i < len(regex):
+        char = regex[i]
+        if char == "\\":
+            if i + 1 < len(regex) and regex[i + 1] in "123456789":
+                return None
+            rv.append(regex[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if char == "]":
+                in_class = False
+        elif char == "[":
+            # a ] at the start of a character class is literal
+            end = i + 1
+            if regex[end:end + 1] == "^":
+                end += 1
+            if regex[end:end + 1] == "]":
+                end += 1
+            rv.append(regex[i:end])
+            i = end
+            in_class = True
+            continue
+        elif char == "(":
+            if regex.startswith("(?P<", i):
+                rv.append("(?:")
+                i = regex.index(">", i) + 1
+                continue
+            elif regex.startswith("(?", i):
+                if regex[i + 2:i + 3] in "P(aiLmsux":
+                    return None
+            else:
+                rv.append("(?:")
+                i += 1
+                continue
+        rv.append(char)
+        i += 1
+    return "".join(rv)
+
+
 class PatternMap(object):
     """Handler for a single pattern or range."""
 
@@ -72,6 +141,77 @@ class PatternMap(object):
                               self.groups)
 
 
+class PatternMatcher(object):
+    """ Match hostnames against a list of
+    :class:`Bcfg2.Server.Plugins.GroupPatterns.PatternMap` objects
+    without trying each pattern in turn.  Patterns that are anchored
+    at the start of the hostname with some literal text are bucketed
+    by that text, and only tried against hostnames that start with
+    it.  The rest are combined into alternations of
+    :attr:`chunk_size` patterns each, and the patterns in a chunk are
+    only tried if the combined regex matches. """
+
+    #: The number of patterns to combine into each alternation
+    chunk_size = 50
+
+    def __init__(self, patterns):
+        #: A dict of <literal prefix>: <list of (<index>, <pattern>)>
+        self.prefixes = dict()
+
+        #: The distinct lengths of the keys of :attr:`prefixes`,
+        #: sorted
+        self.prefix_lengths = []
+
+        #: A list of (<compiled alternation or None>, <list of
+        #: (<index>, <pattern>)>).  Patterns that cannot be combined
+        #: are put in a chunk of their own with no alternation, and
+        #: are always tried.
+        self.chunks = []
+
+        combinable = []
+        for idx, pmap in enumerate(patterns):
+            regex = pmap._re.pattern  # pylint: disable=W0212
+            prefix = literal_prefix(regex)
+            if prefix:
+                self.prefixes.setdefault(prefix, []).append((idx, pmap))
+                continue
+            regex = noncapturing(regex)
+            if regex is None:
+                self.chunks.append((None, [(idx, pmap)]))
+            else:
+                combinable.append((regex, (idx, pmap)))
+        self.prefix_lengths = sorted(set(len(p) for p in self.prefixes))
+
+        for i in range(0, len(combinable), self.chunk_size):
+            chunk = combinable[i:i + self.chunk_size]
+            try:
+                alternation = re.compile("|".join("(?:%s)" % regex
+                                                  for regex, _ in chunk))
+            except (re.error, OverflowError, AssertionError):
+                alternation = None
+            self.chunks.append((alternation, [p for _, p in chunk]))
+
+    def process(self, hostname):
+        """ Get the groups that the patterns add to the given
+        hostname, in the order of the patterns. """
+        candidates = []
+        for length in self.prefix_lengths:
+            if length > len(hostname):
+                break
+            candidates.extend(self.prefixes.get(hostname[:length], []))
+        for alternation, chunk in self.chunks:
+            if alternation is None or alternation.search(hostname):
+                candidates.extend(chunk)
+        candidates.sort(key=lambda c: c[0])
+
+        ret = []
+        for _, pmap in candidates:
+            grps = pmap.process(hostname)
+            if grps is not None:
+                ret.extend(grps)
+        return ret
+
+
 class PatternFile(Bcfg2.Server.Plugin.XMLFileBacked):
     """representation of GroupPatterns config.xml."""
     __identifier__ = None
@@ -82,6 +222,11 @@ class PatternFile(Bcfg2.Server.Plugin.XMLFileBacked):
                                                    should_monitor=True)
         self.core = core
         self.patterns = []
+        self.matcher = PatternMatcher(self.patterns)
+
+        #: A dict of <hostname>: <list of groups> for the hostnames
+        #: that have been processed since config.xml was last read
+        self.cache = dict()
 
     def Index(self):
         Bcfg2.Server.Plugin.XMLFileBacked.Index(self)
@@ -102,16 +247,15 @@ class PatternFile(Bcfg2.Server.Plugin.XMLFileBacked):
                 self.logger.error("GroupPatterns: Failed to initialize "
                                   "pattern %s: %s" % (entry.text,
                                                       sys.exc_info()[1]))
+        self.matcher = PatternMatcher(self.patterns)
+        self.cache = dict()
 
     def process_patterns(self, hostname):
         """ return a list of groups that should be added to the given
         client based on patterns that match the hostname """
-        ret = []
-        for pattern in self.patterns:
-            grps = pattern.process(hostname)
-            if grps is not None:
-                ret.extend(grps)
-        return ret
+        if hostname not in self.cache:
+            self.cache[hostname] = self.matcher.process(hostname)
+        return list(self.cache[hostname])
 
 
 class GroupPatterns(Bcfg2.Server.Plugin.Plugin,
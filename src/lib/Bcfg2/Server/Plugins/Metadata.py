@@ -9,13 +9,15 @@ import copy
 import errno
 import socket
 import logging
+import threading
 import lxml.etree
 import Bcfg2.Server
 import Bcfg2.Options
+import Bcfg2.Server.Cache
 import Bcfg2.Server.Plugin
 import Bcfg2.Server.FileMonitor
 from Bcfg2.Utils import locked
-from Bcfg2.Server.Cache import Cache
+from Bcfg2.Server.Cache import Cache, LRUCache, add_expire_hook
 # pylint: disable=W0622
 from Bcfg2.Compat import MutableMapping, all, any, wraps
 # pylint: enable=W0622
@@ -118,6 +120,15 @@ class XMLMetadataConfig(Bcfg2.Server.Plugin.XMLFileBacked):
         self.pseudo_monitor = isinstance(Bcfg2.Server.FileMonitor.get_fam(),
                                          Bcfg2.Server.FileMonitor.Pseudo)
 
+        #: A list of elements that have been added to the data with
+        #: :func:`add_pending`, but not yet written to disk
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+        # (inode, mtime, size) of the file as last written by
+        # flush(), used to skip rereading it on the resulting event
+        self._written = None
+
     def _get_xdata(self):
         """ getter for xdata property """
         if not self.data:
@@ -158,15 +169,65 @@ class XMLMetadataConfig(Bcfg2.Server.Plugin.XMLFileBacked):
             except lxml.etree.XIncludeError:
                 self.logger.error("Failed to process XInclude for file %s" %
                                   self.basefile)
+        # elements that have not been written yet are kept in the
+        # new data until they are
+        existing = set((el.tag, el.get("name"))
+                       for el in self.basedata.getroot())
+        for element in self.pending:
+            if (element.tag, element.get("name")) not in existing:
+                self.basedata.getroot().append(copy.deepcopy(element))
+                xdata.getroot().append(copy.deepcopy(element))
         self.data = xdata
 
+    def add_pending(self, element):
+        """ Add an element to the top level of the data immediately,
+        but defer writing it to disk until :func:`flush` is called.
+        This lets many elements (e.g., new clients) be written at
+        once. """
+        self.pending_lock.acquire()
+        try:
+            self.pending.append(element)
+            self.basedata.getroot().append(copy.deepcopy(element))
+            self.data.getroot().append(copy.deepcopy(element))
+        finally:
+            self.pending_lock.release()
+
+    def flush(self):
+        """ Write elements added with :func:`add_pending` to disk.
+        Since the in-memory data already contains them, the file is
+        not reread afterwards. """
+        self.pending_lock.acquire()
+        try:
+            if not self.pending:
+                return
+            count = len(self.pending)
+            self.pending = []
+            fname = os.path.join(self.basedir, self.basefile)
+            self.write_xml(fname, self.basedata, reread=False)
+            self._written = self._get_signature()
+        finally:
+            self.pending_lock.release()
+        self.logger.debug("Wrote %s pending entries to %s" %
+                          (count, self.basefile))
+
+    def _get_signature(self):
+        """ Get a tuple that identifies the current version of the
+        file on disk """
+        try:
+            stat = os.stat(os.path.join(self.basedir, self.basefile))
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime, stat.st_size)
+
     def write(self):
         """Write changes to xml back to disk."""
+        self.pending = []
         self.write_xml(os.path.join(self.basedir, self.basefile),
                        self.basedata)
 
-    def write_xml(self, fname, xmltree):
-        """Write changes to xml back to disk."""
+    def write_xml(self, fname, xmltree, reread=True):
+        """Write changes to xml back to disk.  If ``reread`` is True,
+        the data is reread from disk afterwards."""
         tmpfile = "%s.new" % fname
         datafile = None
         fd = None
@@ -217,7 +278,8 @@ class XMLMetadataConfig(Bcfg2.Server.Plugin.XMLFileBacked):
                                                          sys.exc_info()[1])
             self.logger.error(msg)
             raise Bcfg2.Server.Plugin.MetadataRuntimeError(msg)
-        self.load_xml()
+        if reread:
+            self.load_xml()
 
     def find_xml_for_xpath(self, xpath):
         """Find and load xml file containing the xpath query"""
@@ -258,6 +320,11 @@ class XMLMetadataConfig(Bcfg2.Server.Plugin.XMLFileBacked):
             return False
         if event.code2str() == 'endExist':
             return False
+        if (filename == self.basefile and self._written is not None and
+                self._written == self._get_signature()):
+            # this is the event for our own write of pending
+            # elements, which are already in the data
+            return False
         self.load_xml()
         return True
 
@@ -475,6 +542,10 @@ class MetadataGroup(tuple):  # pylint: disable=E0012,R0924
         self.warned = []
     # pylint: enable=R0913
 
+    def __getnewargs__(self):
+        return (self.name, self.bundles, self.category, self.is_profile,
+                self.is_public)
+
     def __str__(self):
         return repr(self)
 
@@ -487,6 +558,329 @@ class MetadataGroup(tuple):  # pylint: disable=E0012,R0924
         return hash(self.name)
 
 
+class GroupMembershipEvaluator(object):
+    """ A compiled form of the group memberships declared in
+    groups.xml.  Each group is given an integer id, and a set of
+    groups is represented as an integer with the bit for each
+    member's id set, so each condition on a membership declaration
+    can be checked with a couple of bitwise operations.  Only the
+    groups whose conditions may have changed are re-evaluated on each
+    pass, and the results are memoized, since many clients start with
+    identical groups. """
+
+    def __init__(self, membership, groups, cache_size=1000):
+        """
+        :param membership: A list of group membership declarations,
+                           as described in
+                           :func:`Metadata._get_group_membership`
+        :type membership: list of tuples
+        :param groups: A dict of group name ->
+                       :class:`Bcfg2.Server.Plugins.Metadata.MetadataGroup`
+        :type groups: dict
+        :param cache_size: The maximum number of results to memoize
+        :type cache_size: int
+        """
+        #: Mapping of group name -> bit
+        self.bits = dict()
+
+        #: List of group names, indexed by id
+        self.names = []
+
+        #: Mapping of group bit -> id.  (``int.bit_length()`` would
+        #: do this, but it is not available on Python 2.6.)
+        self.ids = dict()
+
+        #: Client names that appear in Client conditions.  All other
+        #: clients are equivalent for the purposes of memoization.
+        self.clients = set()
+
+        #: List of ``(<bit>, <declarations>, <category>)`` tuples for
+        #: the groups that clients can be added to, in the order that
+        #: they were first declared.  Each declaration is a tuple of
+        #: ``(<required bits>, <forbidden bits>, <required client
+        #: names>, <forbidden client names>, <check category>)``.
+        self.positive = []
+
+        #: List of ``(<bit>, <declarations>, <category>)`` tuples for
+        #: the groups that clients can be removed from
+        self.negative = []
+
+        #: Mapping of group id -> set of indexes into :attr:`positive`
+        #: of the groups whose membership depends on it
+        self.dependents = dict()
+
+        #: Mapping of category -> set of indexes into :attr:`positive`
+        #: of the groups in that category
+        self.by_category = dict()
+
+        self.cache = LRUCache(cache_size)
+
+        positions = dict()
+        negative = dict()
+        for gname, negate, conditions, check_category in membership:
+            required = 0
+            forbidden = 0
+            clients = set()
+            not_clients = set()
+            for tag, pname, cnegate in conditions:
+                if tag == 'Group':
+                    if cnegate:
+                        forbidden |= self._get_bit(pname)
+                    else:
+                        required |= self._get_bit(pname)
+                elif tag == 'Client':
+                    self.clients.add(pname)
+                    if cnegate:
+                        not_clients.add(pname)
+                    else:
+                        clients.add(pname)
+            decl = (required, forbidden, frozenset(clients),
+                    frozenset(not_clients), check_category)
+            bit = self._get_bit(gname)
+            category = None
+            if gname in groups:
+                category = groups[gname].category
+            if negate:
+                if gname not in negative:
+                    negative[gname] = (bit, [], category)
+                    self.negative.append(negative[gname])
+                negative[gname][1].append(decl)
+                continue
+            if gname not in positions:
+                positions[gname] = len(self.positive)
+                self.positive.append((bit, [], category))
+                if category:
+                    self.by_category.setdefault(category, set()).add(
+                        positions[gname])
+            pos = positions[gname]
+            self.positive[pos][1].append(decl)
+            for gid in self._get_ids(required | forbidden | bit):
+                self.dependents.setdefault(gid, set()).add(pos)
+
+    def _get_bit(self, name):
+        """ Get the bit for the named group, assigning it a new id if
+        it does not have one yet """
+        try:
+            return self.bits[name]
+        except KeyError:
+            self.bits[name] = 1 << len(self.names)
+            self.ids[self.bits[name]] = len(self.names)
+            self.names.append(name)
+            return self.bits[name]
+
+    def _get_ids(self, bits):
+        """ Get the ids of the groups in a set of bits """
+        rv = []
+        while bits:
+            low = bits & -bits
+            rv.append(self.ids[low])
+            bits ^= low
+        return rv
+
+    def _matches(self, decl, client, bits):
+        """ Determine if a declaration's group and client conditions
+        are met """
+        required, forbidden, clients, not_clients = decl[:4]
+        return ((bits & required) == required and
+                not bits & forbidden and
+                client not in not_clients and
+                (not clients or (len(clients) == 1 and client in clients)))
+
+    def evaluate(self, client, groups, categories):
+        """ Determine the full set of groups a client is a member of.
+
+        :param client: The client hostname
+        :type client: string
+        :param groups: The groups the client is initially a member of
+        :type groups: set
+        :param categories: Mapping of category -> group name for the
+                           categories the client is already a member of
+        :type categories: dict
+        :returns: tuple of ``(<groups>, <categories>,
+                  <suppressed>)``.  ``<groups>`` is a frozenset of
+                  group names, ``<categories>`` is a dict like
+                  ``categories``, and ``<suppressed>`` is a list of
+                  ``(<group>, <category>, <member>)`` tuples
+                  describing groups that the client was not added to
+                  because it was already a member of ``<member>``, in
+                  the same category.  The return values must not be
+                  modified.
+        """
+        if client in self.clients:
+            key = (client, frozenset(groups), frozenset(categories.items()))
+        else:
+            key = (None, frozenset(groups), frozenset(categories.items()))
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+
+        bits = 0
+        for name in groups:
+            bits |= self.bits.get(name, 0)
+        other = set(g for g in groups if g not in self.bits)
+        categories = dict(categories)
+        suppressed = []
+        candidates = range(len(self.positive))
+        while True:
+            numgroups = bin(bits).count("1")
+            newbits = 0
+            for pos in sorted(candidates):
+                bit, decls, category = self.positive[pos]
+                if bits & bit:
+                    continue
+                for decl in decls:
+                    if not self._matches(decl, client, bits):
+                        continue
+                    if decl[4] and category in categories:
+                        suppressed.append((self._get_name(bit), category,
+                                           categories[category]))
+                        continue
+                    newbits |= bit
+                    if category:
+                        categories[category] = self._get_name(bit)
+                    break
+            bits |= newbits
+
+            removebits = 0
+            freed = set()
+            for bit, decls, category in self.negative:
+                if not bits & bit:
+                    continue
+                for decl in decls:
+                    if self._matches(decl, client, bits):
+                        removebits |= bit
+                        if category:
+                            categories.pop(category, None)
+                            freed.add(category)
+                        break
+            bits &= ~removebits
+            if bin(bits).count("1") == numgroups:
+                break
+
+            candidates = set()
+            for gid in self._get_ids(newbits | removebits):
+                candidates.update(self.dependents.get(gid, ()))
+            for category in freed:
+                candidates.update(self.by_category.get(category, ()))
+
+        other.update(self.names[gid] for gid in self._get_ids(bits))
+        rv = (frozenset(other), categories, suppressed)
+        self.cache[key] = rv
+        return rv
+
+    def _get_name(self, bit):
+        """ Get the name of the group with the given bit """
+        return self.names[self.ids[bit]]
+
+
+class ClientMetadataIndex(object):
+    """ Reverse indexes from group, profile, and bundle names to the
+    clients whose final metadata includes them.  Client name queries
+    (e.g., :func:`Metadata.get_client_names_by_groups`) can then be
+    answered with set operations rather than by building metadata
+    for every client on every query.
+
+    Entries are dropped whenever the ``Metadata`` cache is expired
+    for the client they describe (or for all clients), so the index
+    is exactly as fresh as the core's cache of final metadata
+    objects. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        #: A dict of client name -> ``(profile, groups, bundles)``
+        #: for each indexed client
+        self.clients = dict()
+
+        #: A dict of ``"profile"``, ``"groups"``, and ``"bundles"``
+        #: -> dict of name -> set of indexed clients
+        self.indexes = dict(profile=dict(), groups=dict(), bundles=dict())
+
+        #: A counter that is incremented whenever entries are
+        #: dropped, so that metadata built before an expiration is
+        #: not added to the index after it
+        self.epoch = 0
+
+    def add(self, client, metadata, epoch):
+        """ Add the final metadata for a client to the index, unless
+        the index has been expired since ``epoch`` """
+        self.lock.acquire()
+        try:
+            if epoch != self.epoch:
+                return
+            self._discard(client)
+            entry = dict(profile=frozenset([metadata.profile]),
+                         groups=frozenset(metadata.groups),
+                         bundles=frozenset(metadata.bundles))
+            for key, names in entry.items():
+                index = self.indexes[key]
+                for name in names:
+                    index.setdefault(name, set()).add(client)
+            self.clients[client] = entry
+        finally:
+            self.lock.release()
+
+    def _discard(self, client):
+        """ Remove a client from the index.  The caller must hold
+        :attr:`lock`. """
+        entry = self.clients.pop(client, None)
+        if entry is None:
+            return
+        for key, names in entry.items():
+            index = self.indexes[key]
+            for name in names:
+                index[name].discard(client)
+                if not index[name]:
+                    del index[name]
+
+    def expire(self, tags, exact, _):  # pylint: disable=W0613
+        """ :func:`Bcfg2.Server.Cache.add_expire_hook` hook that drops
+        index entries when the ``Metadata`` cache is expired """
+        if "Metadata" not in tags:
+            return
+        hostnames = [t for t in tags if t != "Metadata"]
+        self.lock.acquire()
+        try:
+            self.epoch += 1
+            if not hostnames:
+                self.clients.clear()
+                for index in self.indexes.values():
+                    index.clear()
+            else:
+                for hostname in hostnames:
+                    self._discard(hostname)
+        finally:
+            self.lock.release()
+
+    def missing(self, clients):
+        """ Get the clients in the given list that are not indexed """
+        self.lock.acquire()
+        try:
+            return [c for c in clients if c not in self.clients]
+        finally:
+            self.lock.release()
+
+    def match(self, clients, key, names, union=False):
+        """ Get the clients in the given list that have all of the
+        given names (or, if ``union`` is True, any of them) in their
+        ``key`` index, i.e., ``profile``, ``groups``, or ``bundles``. """
+        self.lock.acquire()
+        try:
+            index = self.indexes[key]
+            matches = [index.get(name, set()) for name in names]
+            if union:
+                rv = set().union(*matches)
+            elif matches:
+                matches.sort(key=len)
+                rv = matches[0].intersection(*matches[1:])
+            else:
+                rv = set(self.clients.keys())
+        finally:
+            self.lock.release()
+        return [c for c in clients if c in rv]
+
+
 class Metadata(Bcfg2.Server.Plugin.Metadata,
                Bcfg2.Server.Plugin.ClientRunHooks,
                Bcfg2.Server.Plugin.DatabaseBacked):
@@ -501,12 +895,25 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
         Bcfg2.Options.BooleanOption(
             cf=('metadata', 'use_database'), dest="metadata_db",
             help="Use database capabilities of the Metadata plugin"),
+        Bcfg2.Options.Option(
+            cf=('metadata', 'registration_interval'),
+            dest="metadata_registration_interval",
+            type=Bcfg2.Options.Types.timeout,
+            help="Interval at which newly registered clients are written "
+            "to clients.xml"),
         Bcfg2.Options.Option(
             cf=('communication', 'authentication'), default='cert+password',
             choices=['cert', 'bootstrap', 'cert+password'],
             help='Default client authentication method')]
     options_parsed_hook = staticmethod(load_django_models)
 
+    #: The attributes included in snapshots taken by
+    #: :func:`get_snapshot`
+    _snapshot_attrs = ['clients', 'clientgroups', 'aliases', 'raliases',
+                       'secure', 'floating', 'addresses', 'raddresses',
+                       'auth', 'uuid', 'ruuid', 'passwords', 'default',
+                       'groups', 'membership']
+
     def __init__(self, core):
         Bcfg2.Server.Plugin.Metadata.__init__(self)
         Bcfg2.Server.Plugin.ClientRunHooks.__init__(self)
@@ -525,19 +932,23 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
 
         # mapping of clientname -> authtype
         self.auth = dict()
-        # list of clients required to have non-global password
-        self.secure = []
-        # list of floating clients
-        self.floating = []
+        # set of clients required to have non-global password
+        self.secure = set()
+        # set of floating clients
+        self.floating = set()
         # mapping of clientname -> password
         self.passwords = {}
+        # mapping of address -> [clientnames]
         self.addresses = {}
+        # mapping of clientname -> set of addresses
         self.raddresses = {}
         # mapping of clientname -> [groups]
         self.clientgroups = {}
-        # list of clients
-        self.clients = []
+        # set of clients
+        self.clients = set()
+        # mapping of alias -> clientname
         self.aliases = {}
+        # mapping of clientname -> set of aliases
         self.raliases = {}
         # mapping of groupname -> MetadataGroup object
         self.groups = {}
@@ -546,15 +957,47 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
         self.negated_groups = dict()
         # list of group names in document order
         self.ordered_groups = []
+        #: The :class:`GroupMembershipEvaluator` used to resolve
+        #: client group membership
+        self.group_evaluator = GroupMembershipEvaluator([], dict())
         # mapping of hostname -> version string
         if self._use_db:
             self.versions = ClientVersions(core)  # pylint: disable=E1102
         else:
             self.versions = dict()
 
+        # mapping of uuid -> clientname, and the reverse mapping of
+        # clientname -> uuid.  these must only be changed with
+        # _set_uuid() to keep them consistent
         self.uuid = {}
+        self.ruuid = {}
+        # list of (<group name>, <negate>, <conditions>, <check
+        # category>) tuples describing the group memberships declared
+        # in groups.xml.  see _get_group_membership()
+        self.membership = []
+
+        #: A counter that is incremented whenever client or group
+        #: data changes, used to tell when a new snapshot must be
+        #: taken with :func:`get_snapshot`
+        self.generation = 0
         self.session_cache = {}
         self.cache = Cache("Metadata")
+
+        # mapping of client name -> list of summaries of the
+        # <Client> tags for that client in clients.xml; see
+        # _get_client_fingerprint()
+        self._client_fingerprints = {}
+
+        #: A :class:`ClientMetadataIndex` of the final metadata of
+        #: each client, used to answer client name queries when
+        #: final metadata objects are cached
+        self.client_index = ClientMetadataIndex()
+        add_expire_hook(self.client_index.expire)
+
+        # timer that writes newly registered clients to clients.xml;
+        # see _register_client()
+        self._registration_timer = None
+        self._registration_lock = threading.Lock()
         self.default = None
         self.pdirty = False
         self.password = Bcfg2.Options.setup.password
@@ -791,86 +1234,129 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
 
     def _handle_clients_xml_event(self, _):  # pylint: disable=R0912
         """ handle all events for clients.xml and files xincluded from
-        clients.xml """
-        # disable metadata builds during parsing.  this prevents
-        # clients from getting bogus metadata during the brief time it
-        # takes to rebuild the clients.xml data
-        self.states['clients.xml'] = False
-
+        clients.xml.  The new client data is built separately and then
+        swapped in with a single update of this object's attributes,
+        so metadata builds can continue while clients.xml is parsed;
+        only clients whose entries in clients.xml have changed are
+        expired from the cache. """
         xdata = self.clients_xml.xdata
-        self.clients = []
-        self.clientgroups = {}
-        self.aliases = {}
-        self.raliases = {}
-        self.secure = []
-        self.floating = []
-        self.addresses = {}
-        self.raddresses = {}
+        state = dict(clients=set(), clientgroups={}, aliases={},
+                     raliases={}, secure=set(), floating=set(),
+                     addresses={}, raddresses={},
+                     _client_fingerprints={})
         for client in xdata.findall('.//Client'):
-            clname = client.get('name').lower()
-            if 'address' in client.attrib:
-                caddr = client.get('address')
-                if caddr in self.addresses:
-                    self.addresses[caddr].append(clname)
-                else:
-                    self.addresses[caddr] = [clname]
-                if clname not in self.raddresses:
-                    self.raddresses[clname] = set()
-                self.raddresses[clname].add(caddr)
-            if 'auth' in client.attrib:
-                self.auth[client.get('name')] = client.get('auth')
-            if 'uuid' in client.attrib:
-                self.uuid[client.get('uuid')] = clname
-            if client.get('secure', 'false').lower() == 'true':
-                self.secure.append(clname)
-            if (client.get('location', 'fixed') == 'floating' or
-                    client.get('floating', 'false').lower() == 'true'):
-                self.floating.append(clname)
-            if 'password' in client.attrib:
-                self.passwords[clname] = client.get('password')
-            if 'version' in client.attrib:
-                self.versions[clname] = client.get('version')
-
-            self.raliases[clname] = set()
-            for alias in client.findall('Alias'):
-                self.aliases.update({alias.get('name'): clname})
-                self.raliases[clname].add(alias.get('name'))
-                if 'address' not in alias.attrib:
-                    continue
-                if alias.get('address') in self.addresses:
-                    self.addresses[alias.get('address')].append(clname)
-                else:
-                    self.addresses[alias.get('address')] = [clname]
-                if clname not in self.raddresses:
-                    self.raddresses[clname] = set()
-                self.raddresses[clname].add(alias.get('address'))
-            self.clients.append(clname)
-            profile = client.get("profile")
-            if self.groups:  # check if we've parsed groups.xml yet
-                if profile not in self.groups:
-                    self.logger.warning("Metadata: %s has nonexistent "
-                                        "profile group %s" % (clname, profile))
-                elif not self.groups[profile].is_profile:
-                    self.logger.warning("Metadata: %s set as profile for "
-                                        "%s, but is not a profile group" %
-                                        (profile, clname))
-            try:
-                self.clientgroups[clname].append(profile)
-            except KeyError:
-                self.clientgroups[clname] = [profile]
+            self._parse_client(client, state)
+
+        if self.states.get('clients.xml'):
+            old = self._client_fingerprints
+            fingerprints = state['_client_fingerprints']
+            changed = [c for c in set(old) | set(fingerprints)
+                       if old.get(c) != fingerprints.get(c)]
+        else:
+            changed = None
+        self.__dict__.update(state)
         self.update_client_list()
-        self.cache.expire()
+        self._expire_clients(changed)
         self.states['clients.xml'] = True
 
-    def _get_condition(self, element):
+    def _parse_client(self, client, state):  # pylint: disable=R0912
+        """ Add the data from a single ``<Client>`` tag in clients.xml
+        to the given dict of client data structures (``clients``,
+        ``clientgroups``, ``aliases``, etc.), keyed by the names of
+        the attributes of this object they will replace. """
+        addresses = state['addresses']
+        raddresses = state['raddresses']
+        clname = client.get('name').lower()
+        state['_client_fingerprints'].setdefault(clname, []).append(
+            self._get_client_fingerprint(client))
+        if 'address' in client.attrib:
+            caddr = client.get('address')
+            if caddr in addresses:
+                addresses[caddr].append(clname)
+            else:
+                addresses[caddr] = [clname]
+            if clname not in raddresses:
+                raddresses[clname] = set()
+            raddresses[clname].add(caddr)
+        if 'auth' in client.attrib:
+            self.auth[client.get('name')] = client.get('auth')
+        if 'uuid' in client.attrib:
+            self._set_uuid(client.get('uuid'), clname)
+        if client.get('secure', 'false').lower() == 'true':
+            state['secure'].add(clname)
+        if (client.get('location', 'fixed') == 'floating' or
+                client.get('floating', 'false').lower() == 'true'):
+            state['floating'].add(clname)
+        if 'password' in client.attrib:
+            self.passwords[clname] = client.get('password')
+        if 'version' in client.attrib:
+            self.versions[clname] = client.get('version')
+
+        state['raliases'][clname] = set()
+        for alias in client.findall('Alias'):
+            state['aliases'].update({alias.get('name'): clname})
+            state['raliases'][clname].add(alias.get('name'))
+            if 'address' not in alias.attrib:
+                continue
+            if alias.get('address') in addresses:
+                addresses[alias.get('address')].append(clname)
+            else:
+                addresses[alias.get('address')] = [clname]
+            if clname not in raddresses:
+                raddresses[clname] = set()
+            raddresses[clname].add(alias.get('address'))
+        state['clients'].add(clname)
+        profile = client.get("profile")
+        if self.groups:  # check if we've parsed groups.xml yet
+            if profile not in self.groups:
+                self.logger.warning("Metadata: %s has nonexistent "
+                                    "profile group %s" % (clname, profile))
+            elif not self.groups[profile].is_profile:
+                self.logger.warning("Metadata: %s set as profile for "
+                                    "%s, but is not a profile group" %
+                                    (profile, clname))
+        try:
+            state['clientgroups'][clname].append(profile)
+        except KeyError:
+            state['clientgroups'][clname] = [profile]
+
+    def _set_uuid(self, uuid, client):
+        """ Record that the given uuid identifies the given client """
+        old = self.uuid.get(uuid)
+        if old is not None and self.ruuid.get(old) == uuid:
+            del self.ruuid[old]
+        self.uuid[uuid] = client
+        self.ruuid[client] = uuid
+
+    @staticmethod
+    def _get_client_fingerprint(client):
+        """ Get a hashable summary of a ``<Client>`` tag in
+        clients.xml, used to tell which clients have changed when
+        clients.xml is reread """
+        return (tuple(sorted(client.attrib.items())),
+                tuple(tuple(sorted(a.attrib.items()))
+                      for a in client.findall('Alias')))
+
+    def _expire_clients(self, clients):
+        """ Expire cached data for the given clients, including data
+        cached by other plugins that is tagged with the client name.
+        If ``clients`` is None, data for all clients is expired. """
+        if clients is None:
+            self.cache.expire()
+            return
+        if clients:
+            self.debug_log("Metadata: Expiring cached metadata for %s "
+                           "changed clients" % len(clients))
+        for client in clients:
+            Bcfg2.Server.Cache.expire("Metadata", client)
+
+    def _get_condition(self, tag, pname, negate):
         """ Return a predicate that returns True if a client meets
-        the condition specified in the given Group or Client
-        element """
-        negate = element.get('negate', 'false').lower() == 'true'
-        pname = element.get("name")
-        if element.tag == 'Group':
+        the condition specified by a Group or Client element with the
+        given tag, name, and negation """
+        if tag == 'Group':
             return lambda c, g, _: negate != (pname in g)
-        elif element.tag == 'Client':
+        elif tag == 'Client':
             return lambda c, g, _: negate != (pname == c)
 
     def _get_category_condition(self, grpname):
@@ -886,17 +1372,50 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
         return lambda client, groups, cats: \
             all(cond(client, groups, cats) for cond in conditions)
 
-    def _handle_groups_xml_event(self, _):  # pylint: disable=R0912
-        """ re-read groups.xml on any event on it """
-        # disable metadata builds during parsing.  this prevents
-        # clients from getting bogus metadata during the brief time it
-        # takes to rebuild the groups.xml data
-        self.states['groups.xml'] = False
+    def _get_group_membership(self, membership, groups):
+        """ Turn a list of group membership declarations, as stored
+        in :attr:`membership`, into predicates.
+
+        :param membership: A list of ``(<group name>, <negate>,
+                           <conditions>, <check category>)`` tuples.
+                           ``<conditions>`` is a tuple of ``(<tag>,
+                           <name>, <negate>)`` tuples, one for each
+                           Group or Client element that the
+                           declaration is nested in.
+        :type membership: list of tuples
+        :param groups: A dict of group name ->
+                       :class:`Bcfg2.Server.Plugins.Metadata.MetadataGroup`
+        :type groups: dict
+        :returns: tuple of ``(<group membership>, <negated groups>,
+                  <ordered groups>, <group evaluator>)``, as stored in
+                  the attributes of the same names
+        """
+        group_membership = dict()
+        negated_groups = dict()
+        ordered_groups = []
+        for gname, negate, conditions, check_category in membership:
+            predicates = [self._get_condition(*c) for c in conditions]
+            if check_category:
+                predicates.append(self._get_category_condition(gname))
+            if negate:
+                negated_groups.setdefault(gname, []).append(
+                    self._aggregate_conditions(predicates))
+            else:
+                if gname not in ordered_groups:
+                    ordered_groups.append(gname)
+                group_membership.setdefault(gname, []).append(
+                    self._aggregate_conditions(predicates))
+        return (group_membership, negated_groups, ordered_groups,
+                GroupMembershipEvaluator(membership, groups))
 
-        self.groups = {}
-        self.group_membership = dict()
-        self.negated_groups = dict()
-        self.ordered_groups = []
+    def _handle_groups_xml_event(self, _):  # pylint: disable=R0912
+        """ re-read groups.xml on any event on it.  As with
+        clients.xml, the new group data is swapped in atomically, and
+        only clients that may be affected by the changes are expired
+        from the cache. """
+        groups = {}
+        default = self.default
+        membership = []
 
         # first, we get a list of all of the groups declared in the
         # file.  we do this in two stages because the old way of
@@ -909,9 +1428,9 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
         # is the original behavior
         for grp in self.groups_xml.xdata.xpath("//Groups/Group") + \
                 self.groups_xml.xdata.xpath("//Groups/Group//Group"):
-            if grp.get("name") in self.groups:
+            if grp.get("name") in groups:
                 continue
-            self.groups[grp.get("name")] = \
+            groups[grp.get("name")] = \
                 MetadataGroup(grp.get("name"),
                               bundles=[b.get("name")
                                        for b in grp.findall("Bundle")],
@@ -919,7 +1438,7 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
                               is_profile=grp.get("profile", "false") == "true",
                               is_public=grp.get("public", "false") == "true")
             if grp.get('default', 'false') == 'true':
-                self.default = grp.get('name')
+                default = grp.get('name')
 
         # confusing loop condition; the XPath query asks for all
         # elements under a Group tag under a Groups tag; that is
@@ -933,43 +1452,103 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
             if (el.tag != 'Group' and el.tag != 'Client') or el.getchildren():
                 continue
 
-            conditions = []
-            for parent in el.iterancestors():
-                cond = self._get_condition(parent)
-                if cond:
-                    conditions.append(cond)
+            conditions = tuple(
+                (parent.tag, parent.get("name"),
+                 parent.get('negate', 'false').lower() == 'true')
+                for parent in el.iterancestors()
+                if parent.tag in ['Group', 'Client'])
 
             gname = el.get("name")
             if el.get("negate", "false").lower() == "true":
-                self.negated_groups.setdefault(gname, [])
-                self.negated_groups[gname].append(
-                    self._aggregate_conditions(conditions))
+                membership.append((gname, True, conditions, False))
             else:
-                if self.groups[gname].category:
-                    conditions.append(self._get_category_condition(gname))
-
-                if gname not in self.ordered_groups:
-                    self.ordered_groups.append(gname)
-                self.group_membership.setdefault(gname, [])
-                self.group_membership[gname].append(
-                    self._aggregate_conditions(conditions))
-        self.cache.expire()
+                membership.append((gname, False, conditions,
+                                   bool(groups[gname].category)))
+        state = dict(groups=groups, default=default, membership=membership)
+        (state['group_membership'], state['negated_groups'],
+         state['ordered_groups'], state['group_evaluator']) = \
+            self._get_group_membership(membership, groups)
+
+        if self.states.get('groups.xml'):
+            changed = self._get_clients_affected_by_groups(groups, default,
+                                                           membership)
+        else:
+            changed = None
+        self.__dict__.update(state)
+        self._expire_clients(changed)
         self.states['groups.xml'] = True
 
+    def _get_clients_affected_by_groups(self, groups, default, membership):
+        """ Get the clients whose metadata may change when the
+        current groups.xml data is replaced with the given group
+        definitions, default group, and group memberships.  Only
+        clients with cached metadata are considered, since metadata
+        that is not cached will be built from the new data anyway.
+        Returns None if all clients may be affected. """
+        if default != self.default:
+            return None
+        if (set(membership) == set(self.membership) and
+                membership != self.membership):
+            # only the order of memberships changed
+            return None
+
+        def _key(group):
+            """ get the parts of a group definition that can affect
+            client metadata """
+            if group is None:
+                return None
+            return (tuple(sorted(group.bundles)), group.category,
+                    group.is_profile, group.is_public)
+
+        changed = set(
+            g for g in set(groups) | set(self.groups)
+            if _key(groups.get(g)) != _key(self.groups.get(g)))
+        clients = set()
+        for gname, negate, conditions, _ in \
+                set(membership).symmetric_difference(self.membership):
+            if negate:
+                # a negated membership can affect clients that are
+                # not members of any of the groups involved
+                return None
+            changed.add(gname)
+            for tag, name, cnegate in conditions:
+                if cnegate:
+                    return None
+                elif tag == 'Group':
+                    changed.add(name)
+                else:
+                    clients.add(name.lower())
+
+        # a change to the category of a group can change the
+        # category suppression of clients with a group in either the
+        # old or new category
+        categories = set()
+        for gname in changed:
+            for group in groups.get(gname), self.groups.get(gname):
+                if group is not None and group.category:
+                    categories.add(group.category)
+
+        for client in self.cache.keys():
+            metadata = self.cache.get(client)
+            if metadata is None:
+                continue
+            if (metadata.profile in changed or
+                    not changed.isdisjoint(metadata.groups) or
+                    not categories.isdisjoint(metadata.categories)):
+                clients.add(client)
+        return clients
+
     def HandleEvent(self, event):
         """Handle update events for data files."""
         for handles, event_handler in self.handlers.items():
             if handles(event):
-                # clear the entire cache when we get an event for any
-                # metadata file
-                self.cache.expire()
-
                 # clear out the list of category suppressions that
                 # have been warned about, since this may change when
                 # clients.xml or groups.xml changes.
                 for group in self.groups.values():
                     group.warned = []
                 event_handler(event)
+                self.generation += 1
 
         if False not in list(self.states.values()) and self.debug_flag:
             # check that all groups are real and complete. this is
@@ -981,6 +1560,51 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
                         self.debug_log("Client %s set as nonexistent group %s"
                                        % (client, group))
 
+    def get_snapshot(self):
+        """ Get a snapshot of the client and group data parsed from
+        ``clients.xml`` and ``groups.xml``, which can be pickled and
+        loaded into another Metadata object with
+        :func:`load_snapshot`.  Data that is stored in the database
+        is not included.
+
+        :returns: dict
+        """
+        rv = dict([(attr, getattr(self, attr))
+                   for attr in self._snapshot_attrs])
+        if not self._use_db:
+            rv['versions'] = self.versions
+        return rv
+
+    def load_snapshot(self, snapshot):
+        """ Replace the client and group data in this object with a
+        snapshot taken by :func:`get_snapshot`.  The new data is
+        swapped in with a single update of the object's attributes,
+        so concurrent metadata builds see either all of the old data
+        or all of the new.
+
+        :param snapshot: The snapshot to load
+        :type snapshot: dict
+        """
+        state = dict(snapshot)
+        (state['group_membership'], state['negated_groups'],
+         state['ordered_groups'], state['group_evaluator']) = \
+            self._get_group_membership(snapshot['membership'],
+                                       snapshot['groups'])
+        self.__dict__.update(state)
+        self.states = dict(snapshot=True)
+        self.cache.expire()
+
+    def use_snapshots(self):
+        """ Stop handling events on ``clients.xml`` and
+        ``groups.xml``, and get client and group data only from
+        :func:`load_snapshot`.  This is used by the children of
+        :class:`Bcfg2.Server.MultiprocessingCore.MultiprocessingCore`,
+        which get snapshots from the parent process rather than
+        parsing the files themselves.  Metadata cannot be built until
+        the first snapshot is loaded. """
+        self.handlers = dict()
+        self.states = dict(snapshot=False)
+
     def set_profile(self, client, profile,  # pylint: disable=W0221
                     addresspair, require_public=True):
         """Set group parameter for provided client."""
@@ -1029,15 +1653,62 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
             else:
                 if addresspair in self.session_cache:
                     # we are working with a uuid'd client
-                    self.add_client(self.session_cache[addresspair][1],
-                                    dict(uuid=client, profile=profile,
-                                         address=addresspair[0]))
+                    name = self.session_cache[addresspair][1]
+                    attribs = dict(uuid=client, profile=profile,
+                                   address=addresspair[0])
                 else:
-                    self.add_client(client, dict(profile=profile))
-                self.clients.append(client)
+                    name = client
+                    attribs = dict(profile=profile)
+                if Bcfg2.Options.setup.metadata_registration_interval:
+                    self._register_client(name, attribs)
+                else:
+                    self.add_client(name, attribs)
+                    self.clients_xml.write()
+                self.clients.add(client)
                 self.clientgroups[client] = [profile]
-            if not self._use_db:
-                self.clients_xml.write()
+        self.generation += 1
+
+    def _register_client(self, client_name, attribs):
+        """ Add a new client to the in-memory clients.xml data and
+        client data structures immediately, but defer writing
+        clients.xml until the next batch of new clients is flushed by
+        :func:`flush_registrations`.  This avoids rewriting and
+        rereading clients.xml once for each new client when many
+        clients register at once. """
+        element = lxml.etree.Element("Client", name=client_name)
+        for key, val in attribs.items():
+            element.set(key, val)
+        self.clients_xml.add_pending(element)
+        self._parse_client(element,
+                           dict([(attr, getattr(self, attr))
+                                 for attr in ['clients', 'clientgroups',
+                                              'aliases', 'raliases',
+                                              'secure', 'floating',
+                                              'addresses', 'raddresses',
+                                              '_client_fingerprints']]))
+        self._registration_lock.acquire()
+        try:
+            if self._registration_timer is None:
+                self._registration_timer = threading.Timer(
+                    Bcfg2.Options.setup.metadata_registration_interval,
+                    self.flush_registrations)
+                self._registration_timer.daemon = True
+                self._registration_timer.start()
+        finally:
+            self._registration_lock.release()
+
+    def flush_registrations(self):
+        """ Write all clients registered since the last flush to
+        clients.xml with a single write. """
+        self._registration_lock.acquire()
+        try:
+            if self._registration_timer is not None:
+                self._registration_timer.cancel()
+                self._registration_timer = None
+        finally:
+            self._registration_lock.release()
+        if not self._use_db:
+            self.clients_xml.flush()
 
     def set_version(self, client, version):
         """Set version for provided client."""
@@ -1052,6 +1723,7 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
                 self.update_client(client, dict(version=version))
                 self.clients_xml.write()
             self.versions[client] = version
+            self.generation += 1
 
     def resolve_client(self, addresspair, cleanup_cache=False):
         """Lookup address locally or in DNS to get a hostname."""
@@ -1102,34 +1774,30 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
         """ set group membership based on the contents of groups.xml
         and initial group membership of this client. Returns a tuple
         of (allgroups, categories)"""
-        numgroups = -1  # force one initial pass
         if categories is None:
             categories = dict()
-        while numgroups != len(groups):
-            numgroups = len(groups)
-            newgroups = set()
-            removegroups = set()
-            for grpname in self.ordered_groups:
-                if grpname in groups:
-                    continue
-                if any(p(client, groups, categories)
-                       for p in self.group_membership[grpname]):
-                    newgroups.add(grpname)
-                    if (grpname in self.groups and
-                            self.groups[grpname].category):
-                        categories[self.groups[grpname].category] = grpname
-            groups.update(newgroups)
-            for grpname, predicates in self.negated_groups.items():
-                if grpname not in groups:
-                    continue
-                if any(p(client, groups, categories) for p in predicates):
-                    removegroups.add(grpname)
-                    if (grpname in self.groups and
-                            self.groups[grpname].category):
-                        del categories[self.groups[grpname].category]
-            groups.difference_update(removegroups)
+        allgroups, allcategories, suppressed = \
+            self.group_evaluator.evaluate(client, groups, categories)
+        for grpname, category, member in suppressed:
+            self._warn_category_suppressed(client, grpname, category,
+                                           member)
+        groups.clear()
+        groups.update(allgroups)
+        categories.clear()
+        categories.update(allcategories)
         return (groups, categories)
 
+    def _warn_category_suppressed(self, client, grpname, category, member):
+        """ Warn, once per client, that a client was not added to a
+        group because it is already a member of another group in the
+        same category """
+        if client not in self.groups[grpname].warned:
+            self.logger.warning("%s: Group %s suppressed by category %s; "
+                                "%s already a member of %s" %
+                                (self.name, grpname, category, client,
+                                 member))
+            self.groups[grpname].warned.append(client)
+
     def _check_category(self, client, grpname, categories):
         """ Determine if the given client is already a member of a
         group in the same category as the named group.
@@ -1154,12 +1822,8 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
         if not category:
             return True
         if category in categories:
-            if client not in self.groups[grpname].warned:
-                self.logger.warning("%s: Group %s suppressed by category %s; "
-                                    "%s already a member of %s" %
-                                    (self.name, grpname, category,
-                                     client, categories[category]))
-                self.groups[grpname].warned.append(client)
+            self._warn_category_suppressed(client, grpname, category,
+                                           categories[category])
             return False
         return category
 
@@ -1265,12 +1929,7 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
             password = self.passwords[client]
         else:
             password = None
-        uuids = [item for item, value in list(self.uuid.items())
-                 if value == client]
-        if uuids:
-            uuid = uuids[0]
-        else:
-            uuid = None
+        uuid = self.ruuid.get(client, None)
         if not profile:
             # one last ditch attempt at setting the profile
             profiles = [g for g in groups
@@ -1300,8 +1959,29 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
         return set([g.name for g in self.groups.values()
                     if g.category == category])
 
+    def _use_client_index(self):
+        """ Whether or not client name queries can be answered from
+        :attr:`client_index`.  This is only the case when final
+        metadata objects are cached, since otherwise other plugins
+        may return different groups each time metadata is built. """
+        return self.core.metadata_cache_mode in ['cautious', 'aggressive']
+
+    def _index_clients(self):
+        """ Add the final metadata of every client that is not yet in
+        :attr:`client_index` to the index, and return the list of all
+        clients """
+        clients = self.list_clients()
+        for client in self.client_index.missing(clients):
+            epoch = self.client_index.epoch
+            self.client_index.add(client, self.core.build_metadata(client),
+                                  epoch)
+        return clients
+
     def get_client_names_by_profiles(self, profiles):
         """ return a list of names of clients in the given profile groups """
+        if self._use_client_index():
+            return self.client_index.match(self._index_clients(), "profile",
+                                           profiles, union=True)
         rv = []
         for client in self.list_clients():
             mdata = self.core.build_metadata(client)
@@ -1311,6 +1991,9 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
 
     def get_client_names_by_groups(self, groups):
         """ return a list of names of clients in the given groups """
+        if self._use_client_index():
+            return self.client_index.match(self._index_clients(), "groups",
+                                           groups)
         rv = []
         for client in self.list_clients():
             mdata = self.core.build_metadata(client)
@@ -1321,6 +2004,9 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
     def get_client_names_by_bundles(self, bundles):
         """ given a list of bundles, return a list of names of clients
         that use those bundles """
+        if self._use_client_index():
+            return self.client_index.match(self._index_clients(), "bundles",
+                                           bundles)
         rv = []
         for client in self.list_clients():
             mdata = self.core.build_metadata(client)
@@ -1408,7 +2094,7 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
             # user maps to client
             if user not in self.uuid:
                 client = user
-                self.uuid[user] = user
+                self._set_uuid(user, user)
             else:
                 client = self.uuid[user]
 
@@ -1484,6 +2170,12 @@ class Metadata(Bcfg2.Server.Plugin.Metadata,
             for client in added.union(removed):
                 self.cache.expire(client)
 
+    def shutdown(self):
+        """ Write any pending client registrations to clients.xml
+        before shutting down """
+        self.flush_registrations()
+        Bcfg2.Server.Plugin.Metadata.shutdown(self)
+
     def start_client_run(self, metadata):
         """ Hook to reread client list if the database is in use """
         self.update_client_list()
@@ -470,13 +470,168 @@ class Collection(list, Debuggable):
         return list(complete.difference(initial))
 
     @track_statistics()
-    def complete(self, packagelist,  # pylint: disable=R0912,R0914
-                 recommended=None):
+    def _classify(self, symbol, vpkg_cache, recommended):
+        """ Classify a symbol found while resolving dependencies, and
+        determine what it contributes to the resolved package set on
+        its own.
+
+        :param symbol: The symbol to classify
+        :type symbol: string, but see :ref:`pkg-objects`
+        :param vpkg_cache: The virtual packages provided by the
+                           sources in this collection, as returned by
+                           :func:`get_vpkgs`
+        :type vpkg_cache: dict
+        :param recommended: Recommended package settings, as passed
+                            to :func:`complete`
+        :type recommended: dict
+        :returns: tuple - ``(<packages>, <unknown>, <deferred>,
+                  <requirements>)``.  ``<deferred>`` contains the
+                  symbol if it is both a package and a virtual
+                  package, in which case whether or not it is added
+                  depends on the rest of the package set.
+        """
+        is_pkg = self.is_package(symbol)
+        is_vpkg = symbol in vpkg_cache
+        if is_pkg and is_vpkg:
+            return ((), (), (symbol,), ())
+        elif is_pkg:
+            return ((symbol,), (), (), self.get_deps(symbol, recommended))
+        elif is_vpkg:
+            # virtual dependencies are satisfied if one of N is in the
+            # config, or can be forced if there is only one provider
+            if len(vpkg_cache[symbol]) == 1:
+                self.debug_log("Packages: requirement %s satisfied by %s" %
+                               (symbol, vpkg_cache[symbol]))
+                return ((), (), (), vpkg_cache[symbol])
+            return ((), (), (), ())
+        return ((), (symbol,), (), ())
+
+    def _get_closures(self, symbols, vpkg_cache, recommended, closures):
+        """ Get the dependency closure of each of the given symbols,
+        i.e., the packages, unknown symbols, and deferred symbols (see
+        :func:`_classify`) that the symbol requires.
+
+        Closures are looked up in (and added to) ``closures`` where
+        possible.  Otherwise, the dependency graph is walked once,
+        and the closure of each strongly connected component (e.g., a
+        set of packages that all require each other) is built from
+        the closures of the components it requires, so that every
+        symbol encountered gets a closure that can be reused later.
+        Closures that depend on ``recommended`` are not added to
+        ``closures``.
+
+        :param symbols: The symbols to get closures for
+        :type symbols: iterable
+        :param vpkg_cache: The virtual packages provided by the
+                           sources in this collection
+        :type vpkg_cache: dict
+        :param recommended: Recommended package settings
+        :type recommended: dict
+        :param closures: Cache of closures that do not depend on
+                         ``recommended``
+        :type closures: dict-like object
+        :returns: dict of ``<symbol>: (<packages>, <unknown>,
+                  <deferred>)``, where each value is a frozenset.  The
+                  dict contains all given symbols, and may contain
+                  others.
+        """
+        found = dict()
+
+        def lookup(symbol):
+            """ Get a closure that has already been computed """
+            if symbol in found:
+                return True
+            try:
+                closure = closures[symbol]
+            except KeyError:
+                return False
+            if recommended and not closure[0].isdisjoint(recommended):
+                return False
+            found[symbol] = closure
+            return True
+
+        # iterative implementation of Tarjan's strongly connected
+        # components algorithm
+        classes = dict()
+        index = dict()
+        lowlink = dict()
+        stack = []
+        for root in symbols:
+            if root in index or lookup(root):
+                continue
+            classes[root] = self._classify(root, vpkg_cache, recommended)
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            work = [(root, iter(classes[root][3]))]
+            while work:
+                symbol, requirements = work[-1]
+                for req in requirements:
+                    if req in index:
+                        if req not in found:
+                            # req is on the stack, i.e., in the same
+                            # component as symbol
+                            lowlink[symbol] = min(lowlink[symbol], index[req])
+                    elif not lookup(req):
+                        classes[req] = self._classify(req, vpkg_cache,
+                                                      recommended)
+                        index[req] = lowlink[req] = len(index)
+                        stack.append(req)
+                        work.append((req, iter(classes[req][3])))
+                        break
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent],
+                                              lowlink[symbol])
+                    if lowlink[symbol] != index[symbol]:
+                        continue
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        component.append(member)
+                        if member == symbol:
+                            break
+                    packages = set()
+                    unknown = set()
+                    deferred = set()
+                    for member in component:
+                        pkgs, unk, dfr, reqs = classes[member]
+                        packages.update(pkgs)
+                        unknown.update(unk)
+                        deferred.update(dfr)
+                        for req in reqs:
+                            if req in found:
+                                closure = found[req]
+                                packages.update(closure[0])
+                                unknown.update(closure[1])
+                                deferred.update(closure[2])
+                    closure = (frozenset(packages), frozenset(unknown),
+                               frozenset(deferred))
+                    cacheable = (not recommended or
+                                 packages.isdisjoint(recommended))
+                    for member in component:
+                        found[member] = closure
+                        if cacheable:
+                            closures[member] = closure
+        return found
+
+    def complete(self, packagelist, recommended=None, closures=None):
         """ Build a complete list of all packages and their dependencies.
 
         :param packagelist: Set of initial packages computed from the
                             specification.
         :type packagelist: set of strings, but see :ref:`pkg-objects`
+        :param recommended: Mapping of package name to the
+                            ``recommended`` attribute given for that
+                            package in the specification
+        :type recommended: dict
+        :param closures: A cache of the dependency closures of
+                         individual symbols, which will be used and
+                         updated while resolving ``packagelist``.  It
+                         must only be shared between collections with
+                         the same :attr:`cachekey`.
+        :type closures: dict-like object
         :returns: tuple of sets - The first element contains a set of
                   strings (but see :ref:`pkg-objects`) describing the
                   complete package list, and the second element is a
@@ -488,101 +643,52 @@ class Collection(list, Debuggable):
         if pgrps not in self.virt_pkgs:
             self.virt_pkgs[pgrps] = self.get_vpkgs()
         vpkg_cache = self.virt_pkgs[pgrps]
-
-        # unclassified is set of unsatisfied requirements (may be pkg
-        # for vpkg)
-        unclassified = set(packagelist)
-        vpkgs = set()
-        both = set()
-        pkgs = set(packagelist)
+        if closures is None:
+            closures = dict()
 
         packages = set()
-        examined = set()
         unknown = set()
 
-        final_pass = False
-        really_done = False
-        # do while unclassified or vpkgs or both or pkgs
-        while unclassified or pkgs or both or final_pass:
-            if really_done:
-                break
-            if len(unclassified) + len(pkgs) + len(both) == 0:
-                # one more pass then exit
-                really_done = True
-
-            while unclassified:
-                current = unclassified.pop()
-                examined.add(current)
-                is_pkg = False
-                if self.is_package(current):
-                    is_pkg = True
-
-                is_vpkg = current in vpkg_cache
-
-                if is_pkg and is_vpkg:
-                    both.add(current)
-                elif is_pkg and not is_vpkg:
-                    pkgs.add(current)
-                elif is_vpkg and not is_pkg:
-                    vpkgs.add(current)
-                elif not is_vpkg and not is_pkg:
-                    unknown.add(current)
-
-            while pkgs:
-                # direct packages; current can be added, and all deps
-                # should be resolved
-                current = pkgs.pop()
+        # every symbol in the initial package list is added, whether
+        # or not it is a real package.  symbols that are both
+        # packages and virtual packages that are only required by
+        # other packages are deferred until the rest of the package
+        # set is known; if it does not contain a provider of the
+        # virtual package by then, the package itself is forced.
+        forced = set(packagelist)
+        while forced:
+            requirements = set()
+            for current in forced:
                 self.debug_log("Packages: handling package requirement %s" %
                                (current,))
                 packages.add(current)
-                deps = self.get_deps(current, recommended)
-                newdeps = set(deps).difference(examined)
-                if newdeps:
-                    self.debug_log("Packages: Package %s added requirements %s"
-                                   % (current, newdeps))
-                unclassified.update(newdeps)
-
-            satisfied_vpkgs = set()
-            for current in vpkgs:
-                # virtual dependencies, satisfied if one of N in the
-                # config, or can be forced if only one provider
-                if len(vpkg_cache[current]) == 1:
-                    self.debug_log("Packages: requirement %s satisfied by %s" %
-                                   (current, vpkg_cache[current]))
-                    unclassified.update(
-                        vpkg_cache[current].difference(examined))
-                    satisfied_vpkgs.add(current)
+                if current in vpkg_cache and self.is_package(current):
+                    requirements.update(self.get_deps(current, recommended))
                 else:
-                    satisfiers = [item for item in vpkg_cache[current]
-                                  if item in packages]
-                    self.debug_log("Packages: requirement %s satisfied by %s" %
-                                   (current, satisfiers))
-                    satisfied_vpkgs.add(current)
-            vpkgs.difference_update(satisfied_vpkgs)
-
-            satisfied_both = set()
-            for current in both:
-                # packages that are both have virtual providers as
-                # well as a package with that name. allow use of virt
-                # through explicit specification, then fall back to
-                # forcing current on last pass
+                    # the closure of anything else includes exactly
+                    # what it requires
+                    requirements.add(current)
+
+            deferred = set()
+            found = self._get_closures(requirements, vpkg_cache,
+                                       recommended, closures)
+            for req in requirements:
+                closure = found[req]
+                packages.update(closure[0])
+                unknown.update(closure[1])
+                deferred.update(closure[2])
+
+            forced = set()
+            for current in deferred.difference(packages):
                 satisfiers = [item for item in vpkg_cache[current]
                               if item in packages]
                 if satisfiers:
                     self.debug_log("Packages: requirement %s satisfied by %s" %
                                    (current, satisfiers))
-                    satisfied_both.add(current)
-                elif current in packagelist or final_pass:
-                    pkgs.add(current)
-                    satisfied_both.add(current)
-            both.difference_update(satisfied_both)
-
-            if len(unclassified) + len(pkgs) == 0:
-                final_pass = True
-            else:
-                final_pass = False
-
-            self.filter_unknown(unknown)
+                else:
+                    forced.add(current)
+
+        self.filter_unknown(unknown)
         return packages, unknown
 
     def __repr__(self):
@@ -55,6 +55,7 @@ import re
 import sys
 import time
 import copy
+import gzip
 import errno
 import socket
 import logging
@@ -66,7 +67,7 @@ from Bcfg2.Utils import Executor
 from distutils.spawn import find_executable  # pylint: disable=E0611
 # pylint: disable=W0622
 from Bcfg2.Compat import StringIO, cPickle, HTTPError, URLError, \
-    ConfigParser, any
+    ConfigParser, any, intern
 # pylint: enable=W0622
 from Bcfg2.Server.Plugins.Packages.Collection import Collection
 from Bcfg2.Server.Plugins.Packages.Source import SourceInitError, Source, \
@@ -164,6 +165,46 @@ def _setup_pulp():
     return PULPSERVER
 
 
+def _intern(string):
+    """ Intern a package or symbol name, so that the many copies of
+    common names found in repository metadata share memory.  Strings
+    that cannot be interned (e.g., unicode strings on Python 2) are
+    returned unchanged. """
+    try:
+        return intern(string)
+    except TypeError:
+        return string
+
+
+def iterparse_packages(fname, tag):
+    """ Iterate over the elements with the given tag in a (possibly
+    gzipped) repository metadata file without building a tree of the
+    whole file.  Each element is cleared, and removed from the
+    partially built tree, once the caller is done with it, so memory
+    use is bounded by the size of a single element.
+
+    :param fname: The path to the metadata file
+    :type fname: string
+    :param tag: The fully qualified tag of the elements to return
+    :type tag: string
+    :returns: generator of lxml.etree._Element objects
+    """
+    fileobj = open(fname, 'rb')
+    if fileobj.read(2) == b'\x1f\x8b':
+        fileobj.close()
+        fileobj = gzip.open(fname, 'rb')
+    else:
+        fileobj.seek(0)
+    try:
+        for _, elem in lxml.etree.iterparse(fileobj, tag=tag):
+            yield elem
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    finally:
+        fileobj.close()
+
+
 class PulpCertificateData(Bcfg2.Server.Plugin.SpecificData):
     """ Handle pulp consumer certificate data for
     :class:`PulpCertificateSet` """
@@ -853,7 +894,7 @@ class YumCollection(Collection):
         return new
 
     @track_statistics()
-    def complete(self, packagelist, recommended=None):
+    def complete(self, packagelist, recommended=None, closures=None):
         """ Build a complete list of all packages and their dependencies.
 
         When using the Python yum libraries, this defers to the
@@ -871,7 +912,8 @@ class YumCollection(Collection):
                   resolved.
         """
         if not self.use_yum:
-            return Collection.complete(self, packagelist, recommended)
+            return Collection.complete(self, packagelist, recommended,
+                                       closures=closures)
 
         lock = FileLock(os.path.join(self.cachefile, "lock"))
         slept = 0
@@ -1246,13 +1288,11 @@ class YumSource(Source):
                 groups.append(fname)
 
         for fname in primaries:
-            farch = self.file_to_arch[fname]
-            fdata = lxml.etree.parse(fname).getroot()
-            self.parse_primary(fdata, farch)
+            self.parse_primary(iterparse_packages(fname, XP + 'package'),
+                               self.file_to_arch[fname])
         for fname in filelists:
-            farch = self.file_to_arch[fname]
-            fdata = lxml.etree.parse(fname).getroot()
-            self.parse_filelist(fdata, farch)
+            self.parse_filelist(iterparse_packages(fname, FL + 'package'),
+                                self.file_to_arch[fname])
         for fname in groups:
             fdata = lxml.etree.parse(fname).getroot()
             self.parse_group(fdata)
@@ -1276,32 +1316,55 @@ class YumSource(Source):
 
     @track_statistics()
     def parse_filelist(self, data, arch):
-        """ parse filelists.xml.gz data """
+        """ parse filelists.xml.gz data
+
+        :param data: The ``package`` elements from filelists.xml.gz,
+                     e.g., as returned by :func:`iterparse_packages`
+        :type data: iterable of lxml.etree._Element objects
+        :param arch: The architecture of the repository
+        :type arch: string
+        """
         if arch not in self.filemap:
             self.filemap[arch] = dict()
-        for pkg in data.findall(FL + 'package'):
-            for fentry in pkg.findall(FL + 'file'):
+        filemap = self.filemap[arch]
+        for pkg in data:
+            pkgname = None
+            for fentry in pkg.iterchildren(FL + 'file'):
                 if fentry.text in self.needed_paths:
-                    if fentry.text in self.filemap[arch]:
-                        self.filemap[arch][fentry.text].add(pkg.get('name'))
+                    if pkgname is None:
+                        pkgname = _intern(pkg.get('name'))
+                    if fentry.text in filemap:
+                        filemap[fentry.text].add(pkgname)
                     else:
-                        self.filemap[arch][fentry.text] = \
-                            set([pkg.get('name')])
+                        filemap[fentry.text] = set([pkgname])
 
     @track_statistics()
     def parse_primary(self, data, arch):
-        """ parse primary.xml.gz data """
+        """ parse primary.xml.gz data
+
+        Package and symbol names are interned, and the dependencies
+        of each package and the providers of each symbol are stored
+        as tuples.
+
+        :param data: The ``package`` elements from primary.xml.gz,
+                     e.g., as returned by :func:`iterparse_packages`
+        :type data: iterable of lxml.etree._Element objects
+        :param arch: The architecture of the repository
+        :type arch: string
+        """
         if arch not in self.packages:
             self.packages[arch] = set()
         if arch not in self.deps:
             self.deps[arch] = {}
         if arch not in self.provides:
             self.provides[arch] = {}
+        deps = self.deps[arch]
+        provides = dict()
         versionmap = {}
-        for pkg in data.getchildren():
+        for pkg in data:
             if not pkg.tag.endswith('package'):
                 continue
-            pkgname = pkg.find(XP + 'name').text
+            pkgname = _intern(pkg.find(XP + 'name').text)
             vtag = pkg.find(XP + 'version')
             epoch = vtag.get('epoch')
             version = vtag.get('ver')
@@ -1324,20 +1387,26 @@ class YumSource(Source):
             self.packages[arch].add(pkgname)
 
             pdata = pkg.find(XP + 'format')
-            self.deps[arch][pkgname] = set()
+            requires = set()
             pre = pdata.find(RP + 'requires')
             if pre is not None:
-                for entry in pre.getchildren():
-                    self.deps[arch][pkgname].add(entry.get('name'))
-                    if entry.get('name').startswith('/'):
-                        self.needed_paths.add(entry.get('name'))
+                for entry in pre.iterchildren(RP + 'entry'):
+                    name = _intern(entry.get('name'))
+                    requires.add(name)
+                    if name.startswith('/'):
+                        self.needed_paths.add(name)
+            deps[pkgname] = tuple(requires)
             pro = pdata.find(RP + 'provides')
             if pro is not None:
-                for entry in pro.getchildren():
-                    prov = entry.get('name')
-                    if prov not in self.provides[arch]:
-                        self.provides[arch][prov] = list()
-                    self.provides[arch][prov].append(pkgname)
+                for entry in pro.iterchildren(RP + 'entry'):
+                    prov = _intern(entry.get('name'))
+                    if prov not in provides:
+                        provides[prov] = list()
+                    provides[prov].append(pkgname)
+
+        for prov, pkgs in provides.items():
+            self.provides[arch][prov] = \
+                tuple(self.provides[arch].get(prov, ())) + tuple(pkgs)
 
     @track_statistics()
     def parse_group(self, data):
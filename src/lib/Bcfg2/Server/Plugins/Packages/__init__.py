@@ -29,6 +29,26 @@ def packages_boolean(value):
         return value
 
 
+def _expire_client_collections(tags, exact, _):
+    """ :func:`Bcfg2.Server.Cache.add_expire_hook` hook that discards
+    the collection chosen for a client when that client's metadata
+    is expired (other than by an exact expiration, which signals that
+    the metadata object should be rebuilt rather than that its data
+    has changed), since the collection depends on the client's
+    groups. """
+    if "Metadata" not in tags or exact:
+        return
+    hostnames = [t for t in tags if t != "Metadata"]
+    clients = Bcfg2.Server.Cache.Cache("Packages", "cache")
+    if not hostnames:
+        clients.expire()
+    else:
+        for hostname in hostnames:
+            clients.expire(hostname)
+
+Bcfg2.Server.Cache.add_expire_hook(_expire_client_collections)
+
+
 class PackagesBackendAction(Bcfg2.Options.ComponentAction):
     """ ComponentAction to load Packages backends """
     bases = ['Bcfg2.Server.Plugins.Packages']
@@ -116,6 +136,16 @@ class Packages(Bcfg2.Server.Plugin.Plugin,
             cf=("packages", "metadata"), dest="packages_metadata",
             help="Disable all Packages metadata processing",
             type=packages_boolean, default=True),
+        Bcfg2.Options.Option(
+            cf=("packages", "set_cache_size"),
+            dest="packages_set_cache_size", type=int, default=1000,
+            help="Maximum number of resolved package sets to cache for "
+            "each set of sources"),
+        Bcfg2.Options.Option(
+            cf=("packages", "closure_cache_size"),
+            dest="packages_closure_cache_size", type=int, default=50000,
+            help="Maximum number of per-package dependency closures to "
+            "cache for each set of sources"),
         Bcfg2.Options.Option(
             cf=("packages", "version"), dest="packages_version",
             help="Set default Package entry version", default="auto",
@@ -138,6 +168,10 @@ class Packages(Bcfg2.Server.Plugin.Plugin,
     #: and :func:`Reload`
     __rmi__ = Bcfg2.Server.Plugin.Plugin.__rmi__ + ['Refresh', 'Reload']
 
+    #: Packages only claims Package entries and the generated
+    #: yum/apt config Path entries; see :func:`HandlesEntry`
+    handles_entry_tags = ['Package', 'Path']
+
     def __init__(self, core):
         Bcfg2.Server.Plugin.Plugin.__init__(self, core)
         Bcfg2.Server.Plugin.StructureValidator.__init__(self)
@@ -401,12 +435,20 @@ class Packages(Bcfg2.Server.Plugin.Plugin,
         # essential pkgs are those marked as such by the distribution
         base.update(collection.get_essential())
 
-        # check for this set of packages in the package cache
-        pkey = hash(tuple(base))
-        pcache = Bcfg2.Server.Cache.Cache("Packages", "pkg_sets",
-                                          collection.cachekey)
+        # check for this set of packages in the package cache.  if
+        # it's not there, resolve it, reusing the dependency closures
+        # of individual packages that have already been resolved for
+        # other package sets.
+        pkey = hash((frozenset(base), tuple(sorted(recommended.items()))))
+        pcache = self._get_lru_cache(
+            "pkg_sets", collection.cachekey,
+            Bcfg2.Options.setup.packages_set_cache_size)
         if pkey not in pcache:
-            pcache[pkey] = collection.complete(base, recommended)
+            closures = self._get_lru_cache(
+                "closures", collection.cachekey,
+                Bcfg2.Options.setup.packages_closure_cache_size)
+            pcache[pkey] = collection.complete(base, recommended,
+                                               closures=closures)
         packages, unknown = pcache[pkey]
         if unknown:
             self.logger.info("Packages: Got %d unknown entries" % len(unknown))
@@ -417,6 +459,30 @@ class Packages(Bcfg2.Server.Plugin.Plugin,
         newpkgs.sort()
         collection.packages_to_entry(newpkgs, independent)
 
+    def _get_lru_cache(self, name, cachekey, maxsize):
+        """ Get a bounded cache of resolver data for the collections
+        with the given cache key.  It is expired along with the rest
+        of the Packages cache, e.g., on :func:`Refresh` or
+        :func:`Reload`.
+
+        :param name: The name of the cache
+        :type name: string
+        :param cachekey: The
+                         :attr:`Bcfg2.Server.Plugins.Packages.Collection.Collection.cachekey`
+                         of the collection
+        :type cachekey: string
+        :param maxsize: The maximum number of items in the cache
+        :type maxsize: int
+        :returns: :class:`Bcfg2.Server.Cache.LRUCache`
+        """
+        cache = Bcfg2.Server.Cache.Cache("Packages", name)
+        try:
+            return cache[cachekey]
+        except KeyError:
+            rv = Bcfg2.Server.Cache.LRUCache(maxsize)
+            cache[cachekey] = rv
+            return rv
+
     @track_statistics()
     def Refresh(self):
         """ Packages.Refresh() => True|False
@@ -256,6 +256,7 @@ class Pkgmgr(Bcfg2.Server.Plugin.PrioDir):
     __author__ = 'bcfg-dev@mcs.anl.gov'
     __child__ = PkgSrc
     __element__ = 'Package'
+    handles_entry_tags = ['Package']
 
     def HandleEvent(self, event):
         '''Handle events and update dispatch table'''
@@ -268,6 +269,7 @@ class Pkgmgr(Bcfg2.Server.Plugin.PrioDir):
                     except KeyError:
                         self.Entries[itype] = FuzzyDict([(child,
                                                           self.BindEntry)])
+        self.expire_match_indexes()
 
     def BindEntry(self, entry, metadata):
         """Bind data for entry, and remove instances that are not requested."""
@@ -13,6 +13,7 @@ import Bcfg2.Server.Plugin
 from Bcfg2.Compat import unicode, any  # pylint: disable=W0622
 import Bcfg2.Server.FileMonitor
 from Bcfg2.Logger import Debuggable
+from Bcfg2.Utils import probe_hash
 from Bcfg2.Server.Statistics import track_statistics
 
 HAS_DJANGO = False
@@ -84,7 +85,8 @@ class ProbeStore(Debuggable):
         return self._groupcache.get(hostname, [])
 
     def set_groups(self, hostname, groups):
-        """ Set the list of groups for the given host """
+        """ Set the list of groups for the given host.  Returns True
+        if the groups differ from those previously stored. """
         raise NotImplementedError
 
     def get_data(self, hostname):
@@ -94,7 +96,8 @@ class ProbeStore(Debuggable):
         return self._datacache.get(hostname, dict())
 
     def set_data(self, hostname, data):
-        """ Set probe data for the given host """
+        """ Set probe data for the given host.  Returns True if the
+        data differs from that previously stored. """
         raise NotImplementedError
 
     def _load_groups(self, hostname):
@@ -138,8 +141,8 @@ class DBProbeStore(ProbeStore, Bcfg2.Server.Plugin.DatabaseBacked):
 
     @Bcfg2.Server.Plugin.DatabaseBacked.get_db_lock
     def set_groups(self, hostname, groups):
-        Bcfg2.Server.Cache.expire("Probes", "probegroups", hostname)
         olddata = self._groupcache.get(hostname, [])
+        Bcfg2.Server.Cache.expire("Probes", "probegroups", hostname)
         self._groupcache[hostname] = groups
         for group in groups:
             try:
@@ -154,8 +157,10 @@ class DBProbeStore(ProbeStore, Bcfg2.Server.Plugin.DatabaseBacked):
                     group=group)
         ProbesGroupsModel.objects.filter(
             hostname=hostname).exclude(group__in=groups).delete()
-        if olddata != groups:
+        if set(olddata) != set(groups):
             Bcfg2.Server.Cache.expire("Metadata", hostname)
+            return True
+        return False
 
     def _load_data(self, hostname):
         Bcfg2.Server.Cache.expire("Probes", "probegroups", hostname)
@@ -199,6 +204,7 @@ class DBProbeStore(ProbeStore, Bcfg2.Server.Plugin.DatabaseBacked):
             expire_metadata = True
         if expire_metadata:
             Bcfg2.Server.Cache.expire("Metadata", hostname)
+        return expire_metadata
 
 
 class XMLProbeStore(ProbeStore):
@@ -270,22 +276,24 @@ class XMLProbeStore(ProbeStore):
             self.logger.error("Failed to write %s: %s" % (self._fname, err))
 
     def set_groups(self, hostname, groups):
-        Bcfg2.Server.Cache.expire("Probes", "probegroups", hostname)
         olddata = self._groupcache.get(hostname, [])
+        Bcfg2.Server.Cache.expire("Probes", "probegroups", hostname)
         self._groupcache[hostname] = groups
-        if olddata != groups:
+        if set(olddata) != set(groups):
             Bcfg2.Server.Cache.expire("Metadata", hostname)
+            return True
+        return False
 
     def set_data(self, hostname, data):
+        olddata = self._datacache.get(hostname, dict())
         Bcfg2.Server.Cache.expire("Probes", "probedata", hostname)
         self._datacache[hostname] = ClientProbeDataSet()
-        expire_metadata = False
         for probe, pdata in data.items():
-            olddata = self._datacache[hostname].get(probe, ProbeData(''))
             self._datacache[hostname][probe] = pdata
-            expire_metadata |= olddata != data
-        if expire_metadata:
+        if dict(olddata) != dict(data):
             Bcfg2.Server.Cache.expire("Metadata", hostname)
+            return True
+        return False
 
 
 class ClientProbeDataSet(dict):
@@ -359,6 +367,8 @@ class ProbeSet(Bcfg2.Server.Plugin.EntrySet):
     probename = \
         re.compile(r'(.*/)?(?P<basename>\S+?)(\.(?P<mode>(?:G\d\d)|H)_\S+)?$')
     bangline = re.compile(r'^#!\s*(?P<interpreter>.*)$')
+    timeout = re.compile(r'^#\s*timeout:\s*(?P<timeout>\d+(\.\d+)?)\s*$',
+                         re.MULTILINE)
     basename_is_regex = True
 
     def __init__(self, path, plugin_name):
@@ -396,6 +406,9 @@ class ProbeSet(Bcfg2.Server.Plugin.EntrySet):
             probe = lxml.etree.Element('probe')
             probe.set('name', os.path.basename(name))
             probe.set('source', self.plugin_name)
+            # tell the client that it can send an unchanged marker
+            # instead of the full output of this probe
+            probe.set('conditional', 'true')
             if (metadata.version_info and
                     metadata.version_info > (1, 3, 1, '', 0)):
                 try:
@@ -415,6 +428,9 @@ class ProbeSet(Bcfg2.Server.Plugin.EntrySet):
                 probe.set('interpreter', match.group('interpreter'))
             else:
                 probe.set('interpreter', '/bin/sh')
+            match = self.timeout.search(entry.data)
+            if match:
+                probe.set('timeout', match.group('timeout'))
             ret.append(probe)
         return ret
 
@@ -453,6 +469,14 @@ class Probes(Bcfg2.Server.Plugin.Probing,
         else:
             self.probestore = XMLProbeStore(core, self.data)
 
+        #: Cache of hostname -> dict of probe name -> (hash of the
+        #: raw probe output, groups assigned by that output).  This
+        #: lets a client report that a probe's output is unchanged
+        #: instead of sending it again.  It's tagged so that it is
+        #: expired along with the probe data for the host.
+        self.probehashes = Bcfg2.Server.Cache.Cache("Probes", "probedata",
+                                                    "hashes")
+
     @track_statistics()
     def GetProbes(self, metadata):
         return self.probes.get_probe_data(metadata)
@@ -460,13 +484,40 @@ class Probes(Bcfg2.Server.Plugin.Probing,
     def ReceiveData(self, client, datalist):
         cgroups = set()
         cdata = dict()
+        hashes = dict()
+        olddata = self.probestore.get_data(client.hostname)
+        oldhashes = self.probehashes.get(client.hostname, dict())
+        resend = []
         for data in datalist:
-            groups, cdata[data.get("name")] = \
-                self.ReceiveDataItem(client, data)
+            name = data.get("name")
+            digest = data.get("unchanged")
+            if digest is None:
+                groups, cdata[name] = self.ReceiveDataItem(client, data)
+                digest = probe_hash(data.text)
+            elif (name in olddata and name in oldhashes and
+                  oldhashes[name][0] == digest):
+                groups = oldhashes[name][1]
+                cdata[name] = olddata[name]
+            else:
+                # the client must send the full probe output again
+                resend.append(name)
+                continue
+            hashes[name] = (digest, groups)
             cgroups.update(groups)
-        self.probestore.set_groups(client.hostname, list(cgroups))
-        self.probestore.set_data(client.hostname, cdata)
-        self.probestore.commit()
+        if resend:
+            # this is expected after a server restart, since the
+            # hashes are not persisted
+            self.logger.info("Probe(s) %s from %s reported unchanged, but "
+                             "no matching data is stored; requesting full "
+                             "output" % (", ".join(resend), client.hostname))
+            return resend
+        changed = self.probestore.set_groups(client.hostname,
+                                             sorted(cgroups))
+        changed = self.probestore.set_data(client.hostname, cdata) or changed
+        self.probehashes[client.hostname] = hashes
+        if changed:
+            self.probestore.commit()
+        return resend
 
     def ReceiveDataItem(self, client, data):
         """ Receive probe results pertaining to client.  Returns a
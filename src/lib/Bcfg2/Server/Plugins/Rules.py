@@ -24,19 +24,69 @@ class Rules(Bcfg2.Server.Plugin.PrioDir):
             cf=("rules", "replace_name"), dest="rules_replace_name",
             help="Replace %{name} in attributes with name of target entry")]
 
+    #: Regular expression that matches rule names containing regex
+    #: metacharacters; names that do not match are literal entry
+    #: names, and are only matched exactly
+    regex_chars = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
     def __init__(self, core):
         Bcfg2.Server.Plugin.PrioDir.__init__(self, core)
         self._regex_cache = dict()
 
     def HandlesEntry(self, entry, metadata):
-        for src in self.entries.values():
-            for candidate in src.XMLMatch(metadata).xpath("//%s" % entry.tag):
-                if self._matches(entry, metadata, candidate):
-                    return True
-        return False
+        return bool(self._get_matching(entry, metadata))
 
     HandleEntry = Bcfg2.Server.Plugin.PrioDir.BindEntry
 
+    def _index_name(self, tag, name):
+        if tag == "Path" and name:
+            # special case for Path tags:
+            # http://trac.mcs.anl.gov/projects/bcfg2/ticket/967
+            return name.rstrip("/")
+        return name
+
+    def _index(self, data):
+        """ Index the data in a file that applies to a client.  In
+        addition to the index of names built by
+        :func:`Bcfg2.Server.Plugin.helpers.PrioDir._index`, if regular
+        expressions are enabled, the rules whose names contain regex
+        metacharacters are kept in a list per tag, with their
+        compiled regexes, in document order.
+
+        :returns: tuple of (<dict of names>, <dict of <tag>: <list of
+                  (<compiled regex>, <candidate>)>>)
+        """
+        regexes = dict()
+        if self._regex_enabled:
+            for candidate in data.iterdescendants():
+                if callable(candidate.tag):
+                    continue
+                rule = candidate.get("name")
+                if not rule or not self.regex_chars.search(rule):
+                    continue
+                if rule not in self._regex_cache:
+                    self._regex_cache[rule] = re.compile("%s$" % rule)
+                regexes.setdefault(candidate.tag, []).append(
+                    (self._regex_cache[rule], candidate))
+        return (Bcfg2.Server.Plugin.PrioDir._index(self, data), regexes)
+
+    def _get_candidates(self, entry, index):
+        """ Get the candidate concrete entries from an index that may
+        match the given abstract entry.  This returns the rules with
+        the entry's name and the regular expression rules that match
+        it, so that an exact rule and a regex at the same priority
+        still conflict. """
+        names, regexes = index
+        rv = Bcfg2.Server.Plugin.PrioDir._get_candidates(self, entry, names)
+        if entry.tag not in regexes:
+            return rv
+        rv = list(rv)
+        name = entry.get("name")
+        for regex, candidate in regexes[entry.tag]:
+            if regex.match(name) and not any(c is candidate for c in rv):
+                rv.append(candidate)
+        return rv
+
     def _matches(self, entry, metadata, candidate):
         if Bcfg2.Server.Plugin.PrioDir._matches(self, entry, metadata,
                                                 candidate):
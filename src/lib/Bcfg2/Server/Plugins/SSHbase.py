@@ -3,15 +3,19 @@
 import re
 import os
 import sys
+import time
 import socket
 import shutil
+import logging
 import tempfile
+import threading
 import lxml.etree
 import Bcfg2.Options
+import Bcfg2.Server.Cache
 import Bcfg2.Server.Plugin
 from itertools import chain
-from Bcfg2.Utils import Executor
-from Bcfg2.Server.Plugin import PluginExecutionError
+from Bcfg2.Utils import Executor, parallel_map
+from Bcfg2.Server.Plugin import PluginExecutionError, SpecificityError
 from Bcfg2.Compat import any, u_str, b64encode  # pylint: disable=W0622
 try:
     from Bcfg2.Server.Encryption import ssl_encrypt, bruteforce_decrypt, \
@@ -102,6 +106,162 @@ class KnownHostsEntrySet(Bcfg2.Server.Plugin.EntrySet):
                          'mode': '0644'}
 
 
+class HostResolver(object):
+    """ Forward and reverse DNS lookups for the ``ssh_known_hosts``
+    file.  Results, including failed lookups, are cached for a
+    limited time, and many lookups can be made at once with
+    :func:`prefetch`. """
+
+    def __init__(self, ttl, negative_ttl):
+        """
+        :param ttl: The number of seconds to cache successful lookups
+        :type ttl: int
+        :param negative_ttl: The number of seconds to cache failed
+                             lookups
+        :type negative_ttl: int
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.cmd = Executor()
+        self.lock = threading.Lock()
+
+        #: A dict of <hostname>: (<expiry time>, <set of addresses,
+        #: or None if the lookup failed>)
+        self.addresses = dict()
+
+        #: A dict of <address>: (<expiry time>, <list of names, or
+        #: None if the lookup failed>)
+        self.names = dict()
+
+    def _get_cached(self, cache, key):
+        """ Get a cached lookup result.  Returns a tuple of (<whether
+        the result was cached>, <result>). """
+        self.lock.acquire()
+        try:
+            if key in cache:
+                expires, result = cache[key]
+                if expires > time.time():
+                    return (True, result)
+                del cache[key]
+            return (False, None)
+        finally:
+            self.lock.release()
+
+    def _set_cached(self, cache, key, result):
+        """ Cache a lookup result """
+        if result is None:
+            expires = time.time() + self.negative_ttl
+        else:
+            expires = time.time() + self.ttl
+        self.lock.acquire()
+        try:
+            cache[key] = (expires, result)
+        finally:
+            self.lock.release()
+
+    def get_addresses(self, hostname):
+        """ Get the IP addresses of a host.
+
+        :param hostname: The hostname to look up
+        :type hostname: string
+        :returns: set of strings
+        :raises: :class:`Bcfg2.Server.Plugin.exceptions.PluginExecutionError`
+                 if the host has no addresses
+        """
+        cached, addresses = self._get_cached(self.addresses, hostname)
+        if not cached:
+            addresses = self._lookup_addresses(hostname)
+            self._set_cached(self.addresses, hostname, addresses)
+        if addresses is None:
+            raise PluginExecutionError("No cached IP address for %s" %
+                                       hostname)
+        return addresses
+
+    def _lookup_addresses(self, hostname):
+        """ Look up the IP addresses of a host, returning None if
+        there are none """
+        try:
+            return set([info[4][0]
+                        for info in socket.getaddrinfo(hostname, None)])
+        except socket.gaierror:
+            result = self.cmd.run(["getent", "hosts", hostname])
+            if result.success:
+                addresses = set([line.split()[0]
+                                 for line in result.stdout.splitlines()
+                                 if line.strip()])
+                if addresses:
+                    return addresses
+            self.logger.error("Failed to find IP address for %s: %s" %
+                              (hostname, result.error))
+            return None
+
+    def get_names(self, address):
+        """ Get the names of the host with the given IP address.
+
+        :param address: The IP address to look up
+        :type address: string
+        :returns: list of strings
+        :raises: :class:`socket.herror` if the address has no names
+        """
+        cached, names = self._get_cached(self.names, address)
+        if not cached:
+            names = self._lookup_names(address)
+            self._set_cached(self.names, address, names)
+        if names is None:
+            raise socket.herror
+        return names
+
+    def _lookup_names(self, address):
+        """ Look up the names of the host with the given IP address,
+        returning None if the lookup fails """
+        try:
+            rvlookup = socket.gethostbyaddr(address)
+        except socket.herror:
+            self.logger.error("Failed to find any names associated with "
+                              "IP address %s" % address)
+            return None
+        names = []
+        if rvlookup[0]:
+            names.append(rvlookup[0])
+        names.extend(rvlookup[1])
+        return names
+
+    def _prefetch_addresses(self, hostname):
+        """ Look up the addresses of a host for :func:`prefetch` """
+        try:
+            return self.get_addresses(hostname)
+        except PluginExecutionError:
+            return set()
+
+    def _prefetch_names(self, address):
+        """ Look up the names of an address for :func:`prefetch` """
+        try:
+            self.get_names(address)
+        except socket.herror:
+            pass
+
+    def prefetch(self, hostnames, workers):
+        """ Look up the addresses of the given hosts, and the names of
+        those addresses, making up to ``workers`` lookups at once, so
+        that later calls to :func:`get_addresses` and
+        :func:`get_names` for them are answered from the cache.
+
+        :param hostnames: The hostnames to look up
+        :type hostnames: list of strings
+        :param workers: The maximum number of lookups to make at once
+        :type workers: int
+        """
+        addresses = set()
+        for result in parallel_map(self._prefetch_addresses, list(hostnames),
+                                   workers, name="SSHbaseResolver"):
+            addresses.update(result)
+        addresses = [a for a in addresses
+                     if not self._get_cached(self.names, a)[0]]
+        parallel_map(self._prefetch_names, addresses, workers,
+                     name="SSHbaseResolver")
+
+
 class SSHbase(Bcfg2.Server.Plugin.Plugin,
               Bcfg2.Server.Plugin.Connector,
               Bcfg2.Server.Plugin.Generator,
@@ -124,6 +284,11 @@ class SSHbase(Bcfg2.Server.Plugin.Plugin,
        ssh_known_hosts -> the current known hosts file. this
          is regenerated each time a new key is generated.
 
+       The known hosts file is assembled from a cached line for each
+       public key.  Those lines are only rebuilt when the key or the
+       metadata of the clients it applies to changes, or when the DNS
+       lookups of those clients expire.
+
     """
     __author__ = 'bcfg-dev@mcs.anl.gov'
     keypatterns = ["ssh_host_dsa_key",
@@ -138,17 +303,51 @@ class SSHbase(Bcfg2.Server.Plugin.Plugin,
     options = [
         Bcfg2.Options.Option(
             cf=("sshbase", "passphrase"), dest="sshbase_passphrase",
-            help="Passphrase used to encrypt generated private SSH host keys")]
+            help="Passphrase used to encrypt generated private SSH host keys"),
+        Bcfg2.Options.Option(
+            cf=("sshbase", "dns_concurrency"), dest="sshbase_dns_concurrency",
+            type=int, default=10,
+            help="Number of DNS lookups to make at once when building "
+            "ssh_known_hosts"),
+        Bcfg2.Options.Option(
+            cf=("sshbase", "dns_ttl"), dest="sshbase_dns_ttl",
+            type=int, default=3600,
+            help="Number of seconds to cache DNS lookups"),
+        Bcfg2.Options.Option(
+            cf=("sshbase", "dns_negative_ttl"),
+            dest="sshbase_dns_negative_ttl", type=int, default=300,
+            help="Number of seconds to cache failed DNS lookups")]
 
     def __init__(self, core):
         Bcfg2.Server.Plugin.Plugin.__init__(self, core)
         Bcfg2.Server.Plugin.Connector.__init__(self)
         Bcfg2.Server.Plugin.Generator.__init__(self)
         Bcfg2.Server.Plugin.PullTarget.__init__(self)
-        self.ipcache = {}
-        self.namecache = {}
+        self.resolver = HostResolver(
+            Bcfg2.Options.setup.sshbase_dns_ttl,
+            Bcfg2.Options.setup.sshbase_dns_negative_ttl)
         self.__skn = False
 
+        #: The time at which the first of the DNS lookups used in the
+        #: cached ssh_known_hosts data expires
+        self._skn_expires = 0
+
+        #: A dict of <hostname>: (<expiry time>, <sorted list of the
+        #: names and addresses of the client>)
+        self._client_names = dict()
+
+        #: A dict of <hostname>: <dict of <public key filename>:
+        #: <ssh_known_hosts line, or None>> for host-specific keys
+        self._host_lines = dict()
+
+        #: A dict of (<public key filename>, <key file name>):
+        #: <ssh_known_hosts line, or None> for group-specific and
+        #: global keys
+        self._group_lines = dict()
+
+        self.skn_lock = threading.RLock()
+        Bcfg2.Server.Cache.add_expire_hook(self.expire_metadata)
+
         # keep track of which bogus keys we've warned about, and only
         # do so once
         self.badnames = dict()
@@ -177,89 +376,221 @@ class SSHbase(Bcfg2.Server.Plugin.Plugin,
                 Bcfg2.Options.setup.sshbase_passphrase]
         return None
 
+    def _get_key_files(self):
+        """ Get a list of (<public key filename>, <key data>) for all
+        public keys, in the order in which they appear in
+        ssh_known_hosts """
+        rv = []
+        pubkeys = [pubk for pubk in list(self.entries.keys())
+                   if pubk.endswith('.pub')]
+        pubkeys.sort()
+        for pubkey in pubkeys:
+            for entry in sorted(self.entries[pubkey].entries.values(),
+                                key=lambda e: (e.specific.hostname or
+                                               e.specific.group)):
+                rv.append((pubkey, entry))
+        return rv
+
+    def _get_cached_line(self, pubkey, entry):
+        """ Get the cache that holds the ssh_known_hosts line for the
+        given key, and the key of the line in that cache """
+        if entry.specific.hostname:
+            return (self._host_lines.setdefault(entry.specific.hostname,
+                                                dict()),
+                    pubkey)
+        return (self._group_lines, (pubkey, entry.name))
+
+    def _get_key_clients(self, entry, clients):
+        """ Get the hostnames of the clients a key applies to """
+        specific = entry.specific
+        if specific.hostname:
+            if specific.hostname in clients:
+                return [specific.hostname]
+            return []
+        elif specific.group:
+            return self.core.metadata.query.names_by_groups([specific.group])
+        elif specific.all:
+            # a generic key for all hosts?  really?
+            return list(clients)
+        return []
+
+    def _get_line(self, entry, clients):
+        """ Build the ssh_known_hosts line for a key, or return None
+        if it applies to no clients """
+        hostnames = list(chain(
+            *[self.get_client_names(client)
+              for client in self._get_key_clients(entry, clients)]))
+        if not hostnames:
+            specific = entry.specific
+            if specific.hostname:
+                key = specific.hostname
+                ktype = "host"
+            elif specific.group:
+                key = specific.group
+                ktype = "group"
+            else:
+                # user has added a global SSH key, but have no
+                # clients yet.  don't warn about this.
+                return None
+
+            if key not in self.badnames:
+                self.badnames[key] = True
+                self.logger.info("Ignoring key for unknown %s %s" %
+                                 (ktype, key))
+            return None
+        return "%s %s" % (','.join(hostnames), entry.data.rstrip())
+
+    def _get_names(self, cmeta):
+        """ Get the names and addresses of a client for
+        ssh_known_hosts """
+        names = set([cmeta.hostname])
+        names.update(cmeta.aliases)
+        newnames = set()
+        newips = set()
+        for name in names:
+            newnames.add(name.split('.')[0])
+            try:
+                newips.update(self.resolver.get_addresses(name))
+            except PluginExecutionError:
+                continue
+        names.update(newnames)
+        names.update(cmeta.addresses)
+        names.update(newips)
+        # TODO: Only perform reverse lookups on IPs if an option is
+        # set.
+        for ip in newips:
+            try:
+                names.update(self.resolver.get_names(ip))
+            except socket.herror:
+                continue
+        return sorted(names)
+
+    def _update_client_names(self, hostnames):
+        """ Look up the names and addresses of the given clients,
+        making the DNS lookups concurrently """
+        metadata = [self.core.metadata.query.by_name(hostname)
+                    for hostname in hostnames]
+        lookups = set()
+        for cmeta in metadata:
+            lookups.add(cmeta.hostname)
+            lookups.update(cmeta.aliases)
+        self.resolver.prefetch(lookups,
+                               Bcfg2.Options.setup.sshbase_dns_concurrency)
+        expires = time.time() + self.resolver.ttl
+        for cmeta in metadata:
+            self._client_names[cmeta.hostname] = (expires,
+                                                  self._get_names(cmeta))
+
+    def get_client_names(self, hostname):
+        """ Get the names and addresses of a client that are listed
+        with its keys in ssh_known_hosts.
+
+        :param hostname: The client to get names for
+        :type hostname: string
+        :returns: sorted list of strings
+        """
+        if hostname not in self._client_names:
+            self._update_client_names([hostname])
+        return self._client_names[hostname][1]
+
+    def _expire_client_names(self):
+        """ Forget the names of clients whose DNS lookups have
+        expired, and the ssh_known_hosts lines that use them """
+        now = time.time()
+        expired = [hostname
+                   for hostname, (expires, _) in self._client_names.items()
+                   if expires <= now]
+        if expired:
+            self.debug_log("SSHbase: DNS lookups for %s clients expired" %
+                           len(expired))
+            for hostname in expired:
+                self._expire_client(hostname)
+
+    def _expire_client(self, hostname):
+        """ Forget the names of a client and the ssh_known_hosts
+        lines that use them """
+        self._client_names.pop(hostname, None)
+        self._host_lines.pop(hostname, None)
+        self._group_lines.clear()
+        self.__skn = False
+
+    def expire_metadata(self, tags, exact, _):
+        """ :func:`Bcfg2.Server.Cache.add_expire_hook` hook that
+        forgets the names of clients and the ssh_known_hosts lines
+        that use them when the ``Metadata`` cache is expired.  Exact
+        expirations of a single client's metadata only signal that
+        the metadata object should be rebuilt, so they are ignored. """
+        if "Metadata" not in tags:
+            return
+        hostnames = [t for t in tags if t != "Metadata"]
+        self.skn_lock.acquire()
+        try:
+            if not hostnames:
+                self._client_names.clear()
+                self._host_lines.clear()
+                self._group_lines.clear()
+                self.__skn = False
+            elif not exact:
+                for hostname in hostnames:
+                    self._expire_client(hostname)
+        finally:
+            self.skn_lock.release()
+
     def get_skn(self):
         """Build memory cache of the ssh known hosts file."""
-        if not self.__skn:
+        self.skn_lock.acquire()
+        try:
+            if self.__skn and self._skn_expires > time.time():
+                return self.__skn
+
+            clients = self.core.metadata.query.all_clients()
             # if no metadata is registered yet, defer
-            if len(self.core.metadata.query.all()) == 0:
+            if len(clients) == 0:
                 self.__skn = False
                 return self.__skn
+            clients = set(clients)
+
+            self._expire_client_names()
+            keys = self._get_key_files()
+
+            # look up the names of all clients that are needed for
+            # keys whose lines aren't cached, so that the DNS lookups
+            # can be made concurrently
+            needed = set()
+            for pubkey, entry in keys:
+                cache, key = self._get_cached_line(pubkey, entry)
+                if key not in cache:
+                    needed.update(self._get_key_clients(entry, clients))
+            needed = [h for h in needed if h not in self._client_names]
+            if needed:
+                self.debug_log("SSHbase: Looking up names of %s clients" %
+                               len(needed))
+                self._update_client_names(needed)
 
             skn = [s.data.rstrip()
                    for s in list(self.static.values())]
-
-            mquery = self.core.metadata.query
-
-            # build hostname cache
-            names = dict()
-            for cmeta in mquery.all():
-                names[cmeta.hostname] = set([cmeta.hostname])
-                names[cmeta.hostname].update(cmeta.aliases)
-                newnames = set()
-                newips = set()
-                for name in names[cmeta.hostname]:
-                    newnames.add(name.split('.')[0])
-                    try:
-                        newips.update(self.get_ipcache_entry(name)[0])
-                    except PluginExecutionError:
-                        continue
-                names[cmeta.hostname].update(newnames)
-                names[cmeta.hostname].update(cmeta.addresses)
-                names[cmeta.hostname].update(newips)
-                # TODO: Only perform reverse lookups on IPs if an
-                # option is set.
-                for ip in newips:
-                    try:
-                        names[cmeta.hostname].update(
-                            self.get_namecache_entry(ip))
-                    except socket.herror:
-                        continue
-                names[cmeta.hostname] = sorted(names[cmeta.hostname])
-
-            pubkeys = [pubk for pubk in list(self.entries.keys())
-                       if pubk.endswith('.pub')]
-            pubkeys.sort()
-            for pubkey in pubkeys:
-                for entry in sorted(self.entries[pubkey].entries.values(),
-                                    key=lambda e: (e.specific.hostname or
-                                                   e.specific.group)):
-                    specific = entry.specific
-                    hostnames = []
-                    if specific.hostname and specific.hostname in names:
-                        hostnames = names[specific.hostname]
-                    elif specific.group:
-                        hostnames = list(
-                            chain(
-                                *[names[cmeta.hostname]
-                                  for cmeta in
-                                  mquery.by_groups([specific.group])]))
-                    elif specific.all:
-                        # a generic key for all hosts?  really?
-                        hostnames = list(chain(*list(names.values())))
-                    if not hostnames:
-                        if specific.hostname:
-                            key = specific.hostname
-                            ktype = "host"
-                        elif specific.group:
-                            key = specific.group
-                            ktype = "group"
-                        else:
-                            # user has added a global SSH key, but
-                            # have no clients yet.  don't warn about
-                            # this.
-                            continue
-
-                        if key not in self.badnames:
-                            self.badnames[key] = True
-                            self.logger.info("Ignoring key for unknown %s %s" %
-                                             (ktype, key))
-                        continue
-
-                    skn.append("%s %s" % (','.join(hostnames),
-                                          entry.data.rstrip()))
-
+            for pubkey, entry in keys:
+                cache, key = self._get_cached_line(pubkey, entry)
+                if key in cache:
+                    line = cache[key]
+                else:
+                    line = self._get_line(entry, clients)
+                    # keys for hosts that aren't clients yet are
+                    # checked again each time
+                    if line is not None or not entry.specific.hostname:
+                        cache[key] = line
+                if line:
+                    skn.append(line)
+
+            if self._client_names:
+                self._skn_expires = min(
+                    e for e, _ in self._client_names.values())
+            else:
+                self._skn_expires = time.time() + self.resolver.ttl
             self.__skn = "\n".join(skn) + "\n"
-        return self.__skn
+            return self.__skn
+        finally:
+            self.skn_lock.release()
 
     def set_skn(self, value):
         """Set backing data for skn."""
@@ -285,7 +616,7 @@ class SSHbase(Bcfg2.Server.Plugin.Plugin,
                        if kp.endswith(".pub")):
                     self.debug_log("New public key %s; invalidating "
                                    "ssh_known_hosts cache" % event.filename)
-                    self.skn = False
+                    self.expire_key(entry, fname)
                 return
 
         if event.filename == 'info.xml':
@@ -309,57 +640,41 @@ class SSHbase(Bcfg2.Server.Plugin.Plugin,
         self.logger.warn("SSHbase: Got unknown event %s %s" %
                          (event.filename, action))
 
-    def get_ipcache_entry(self, client):
-        """Build a cache of dns results."""
-        if client in self.ipcache:
-            if self.ipcache[client]:
-                return self.ipcache[client]
-            else:
-                raise PluginExecutionError("No cached IP address for %s" %
-                                           client)
-        else:
-            # need to add entry
+    def expire_key(self, entryset, fname):
+        """ Forget the ssh_known_hosts line for a public key that has
+        changed.
+
+        :param entryset: The entry set the key belongs to
+        :type entryset: Bcfg2.Server.Plugins.SSHbase.HostKeyEntrySet
+        :param fname: The filename of the key, without ``.crypt``
+        :type fname: string
+        """
+        self.skn_lock.acquire()
+        try:
             try:
-                ipaddr = set([info[4][0]
-                              for info in socket.getaddrinfo(client, None)])
-                self.ipcache[client] = (ipaddr, client)
-                return (ipaddr, client)
-            except socket.gaierror:
-                result = self.cmd.run(["getent", "hosts", client])
-                if result.success:
-                    ipaddr = result.stdout.strip().split()
-                    if ipaddr:
-                        self.ipcache[client] = (ipaddr, client)
-                        return (ipaddr, client)
-                self.ipcache[client] = False
-                msg = "Failed to find IP address for %s: %s" % (client,
-                                                                result.error)
-                self.logger.error(msg)
-                raise PluginExecutionError(msg)
+                specific = entryset.specificity_from_filename(fname)
+            except SpecificityError:
+                specific = None
+            if specific is not None and specific.hostname:
+                self._host_lines.pop(specific.hostname, None)
+            else:
+                self._host_lines.clear()
+                self._group_lines.clear()
+            self.__skn = False
+        finally:
+            self.skn_lock.release()
+
+    def get_ipcache_entry(self, client):
+        """ Get the IP addresses of a client from the DNS cache.
+
+        :returns: tuple of (<set of addresses>, <client>)
+        """
+        return (self.resolver.get_addresses(client), client)
 
     def get_namecache_entry(self, cip):
-        """Build a cache of name lookups from client IP addresses."""
-        if cip in self.namecache:
-            # lookup cached name from IP
-            if self.namecache[cip]:
-                return self.namecache[cip]
-            else:
-                raise socket.herror
-        else:
-            # add an entry that has not been cached
-            try:
-                rvlookup = socket.gethostbyaddr(cip)
-                if rvlookup[0]:
-                    self.namecache[cip] = [rvlookup[0]]
-                else:
-                    self.namecache[cip] = []
-                self.namecache[cip].extend(rvlookup[1])
-                return self.namecache[cip]
-            except socket.herror:
-                self.namecache[cip] = False
-                self.logger.error("Failed to find any names associated with "
-                                  "IP address %s" % cip)
-                raise
+        """ Get the names associated with an IP address from the DNS
+        cache. """
+        return self.resolver.get_names(cip)
 
     def build_skn(self, entry, metadata):
         """This function builds builds a host specific known_hosts file."""
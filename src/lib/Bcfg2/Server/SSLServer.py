@@ -10,8 +10,10 @@ import logging
 import ssl
 import threading
 import time
+import Bcfg2.Server.Statistics
+from Bcfg2.Utils import gzip_compress, gzip_decompress
 from Bcfg2.Compat import xmlrpclib, SimpleXMLRPCServer, SocketServer, \
-    b64decode
+    b64decode, BytesIO
 
 
 class XMLRPCACLCheckException(Exception):
@@ -238,26 +240,49 @@ class XMLRPCRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
             return False
         return True
 
+    def accepts_gzip(self):
+        """ Determine whether the client accepts gzip-compressed
+        responses. """
+        header = self.headers.get("Accept-Encoding", "")
+        return "gzip" in [enc.split(";")[0].strip().lower()
+                          for enc in header.split(",")]
+
     def do_POST(self):
+        compressed = False
         try:
             max_chunk_size = 10 * 1024 * 1024
             size_remaining = int(self.headers["content-length"])
-            L = []
+            buf = BytesIO()
             while size_remaining:
                 chunk_size = min(size_remaining, max_chunk_size)
-                chunk = self.rfile.read(chunk_size).decode('utf-8')
+                chunk = self.rfile.read(chunk_size)
                 if not chunk:
                     break
-                L.append(chunk)
-                size_remaining -= len(L[-1])
-            data = ''.join(L)
-            if data is None:
-                return  # response has been sent
+                buf.write(chunk)
+                size_remaining -= len(chunk)
+            data = buf.getvalue()
+            Bcfg2.Server.Statistics.stats.add_value(
+                "XMLRPC:request_wire_bytes", len(data))
+            encoding = self.headers.get("Content-Encoding", "identity")
+            if encoding.lower() == "gzip":
+                data = gzip_decompress(data)
+            Bcfg2.Server.Statistics.stats.add_value("XMLRPC:request_bytes",
+                                                    len(data))
+            data = data.decode('utf-8')
 
             response = self.server._marshaled_dispatch(self.client_address,
                                                        data)
             if sys.hexversion >= 0x03000000:
                 response = response.encode('utf-8')
+            Bcfg2.Server.Statistics.stats.add_value("XMLRPC:response_bytes",
+                                                    len(response))
+            threshold = self.server.compression_threshold
+            if (threshold is not None and len(response) > threshold and
+                    self.accepts_gzip()):
+                response = gzip_compress(response)
+                compressed = True
+            Bcfg2.Server.Statistics.stats.add_value(
+                "XMLRPC:response_wire_bytes", len(response))
         except XMLRPCACLCheckException:
             self.send_error(401, self.responses[401][0])
             self.end_headers()
@@ -280,6 +305,10 @@ class XMLRPCRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
                 self.send_response(200)
                 self.send_header("Content-type", "text/xml")
                 self.send_header("Content-length", str(len(response)))
+                # tell the client that it can compress its requests
+                self.send_header("Accept-Encoding", "gzip")
+                if compressed:
+                    self.send_header("Content-Encoding", "gzip")
                 self.end_headers()
                 failcount = 0
                 while True:
@@ -337,7 +366,8 @@ class XMLRPCServer(SocketServer.ThreadingMixIn, SSLServer,
     def __init__(self, listen_all, server_address, RequestHandlerClass=None,
                  keyfile=None, certfile=None, ca=None, protocol='xmlrpc/tlsv1',
                  timeout=10, logRequests=False,
-                 register=True, allow_none=True, encoding=None):
+                 register=True, allow_none=True, encoding=None,
+                 compression_threshold=None):
         """
         :param listen_all: Listen on all interfaces
         :type listen_all: bool
@@ -356,6 +386,12 @@ class XMLRPCServer(SocketServer.ThreadingMixIn, SSLServer,
         :param allow_none: Allow None values in XML-RPC
         :type allow_none: bool
         :param encoding: Encoding to use for XML-RPC
+        :param compression_threshold: Compress responses larger than
+                                      this many bytes if the client
+                                      accepts gzip encoding.  If
+                                      this is None, responses are
+                                      never compressed.
+        :type compression_threshold: int
         """
 
         XMLRPCDispatcher.__init__(self, allow_none, encoding)
@@ -377,6 +413,7 @@ class XMLRPCServer(SocketServer.ThreadingMixIn, SSLServer,
                            certfile=certfile,
                            protocol=protocol)
         self.logRequests = logRequests
+        self.compression_threshold = compression_threshold
         self.serve = False
         self.register = register
         self.register_introspection_functions()
@@ -237,7 +237,8 @@ class CLI(object):
     def run(self):
         """ Run bcfg2-test """
         core = self.get_core()
-        clients = Bcfg2.Options.setup.clients or core.metadata.clients
+        clients = (Bcfg2.Options.setup.clients or
+                   sorted(core.metadata.clients))
         ignore = self.get_ignore()
 
         if Bcfg2.Options.setup.children:
@@ -2,16 +2,21 @@
 used by both client and server.  Stuff that doesn't fit anywhere
 else. """
 
+import gzip
 import fcntl
 import logging
 import os
 import re
 import select
 import shlex
+import signal
 import sys
 import subprocess
 import threading
-from Bcfg2.Compat import input, any  # pylint: disable=W0622
+# pylint: disable=W0622
+from Bcfg2.Compat import input, any, BytesIO, Queue, Empty, reraise, \
+    unicode, md5  # pylint: disable=W0622
+# pylint: enable=W0622
 
 
 class ClassName(object):
@@ -177,6 +182,12 @@ class Executor(object):
     """ A convenient way to run external commands with
     :class:`subprocess.Popen` """
 
+    #: Lock held while starting a command with a ``preexec_fn``.
+    #: ``preexec_fn`` runs in the forked child before ``exec``, which
+    #: is not safe while other threads are forking, so those commands
+    #: are started one at a time.
+    _preexec_lock = threading.Lock()
+
     def __init__(self, timeout=None):
         """
         :param timeout: Set a default timeout for all commands run by
@@ -188,14 +199,21 @@ class Executor(object):
 
     def _timeout(self, proc):
         """ A function suitable for passing to
-        :class:`threading.Timer` that kills the given process.
+        :class:`threading.Timer` that kills the given process.  If the
+        process is the leader of its own process group (e.g., because
+        it was started in a new session), the whole group
+        is killed, so that children of the process that hold its
+        output open do not keep the command running.
 
         :param proc: The process to kill upon timeout.
         :type proc: subprocess.Popen
         :returns: None """
         if proc.poll() is None:
             try:
-                proc.kill()
+                if os.getpgid(proc.pid) == proc.pid:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
                 self.logger.warning("Process exceeeded timeout, killing")
             except OSError:
                 pass
@@ -231,7 +249,14 @@ class Executor(object):
         args.update(kwargs)
         args.update(stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE)
-        proc = subprocess.Popen(command, **args)
+        if args.get('preexec_fn') is not None:
+            self._preexec_lock.acquire()
+            try:
+                proc = subprocess.Popen(command, **args)
+            finally:
+                self._preexec_lock.release()
+        else:
+            proc = subprocess.Popen(command, **args)
         if timeout is None:
             timeout = self.timeout
         if timeout is not None:
@@ -321,6 +346,101 @@ def safe_input(msg):
     return input(msg)
 
 
+def parallel_map(func, items, workers, name="Worker"):
+    """ Call ``func`` on each of ``items``, running up to ``workers``
+    calls at once in separate threads.  If any call raises an
+    exception, no further calls are started, and the first exception
+    is raised, with its original traceback, once the calls that are
+    running have finished.  With
+    fewer than two workers, the calls are simply made one at a time
+    in the calling thread.
+
+    :param func: The function to call on each item
+    :type func: callable
+    :param items: The items to call ``func`` on
+    :type items: list
+    :param workers: The maximum number of calls to run at once
+    :type workers: int
+    :param name: A name for the worker threads
+    :type name: string
+    :returns: list - The return values of ``func``, in the same order
+              as ``items``
+    """
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    queue = Queue()
+    for item in enumerate(items):
+        queue.put(item)
+    failures = []
+
+    def worker():
+        """ call func on items from the queue until it is empty or a
+        call fails """
+        while not failures:
+            try:
+                idx, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[idx] = func(item)
+            except:  # pylint: disable=W0702
+                failures.append(sys.exc_info())
+
+    threads = [threading.Thread(name="%s-%d" % (name, i), target=worker)
+               for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        reraise(failures[0])
+    return results
+
+
+def gzip_compress(data, level=6):
+    """ Compress a byte string in gzip format, e.g., for use with
+    ``Content-Encoding: gzip`` """
+    buf = BytesIO()
+    gzfile = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level)
+    try:
+        gzfile.write(data)
+    finally:
+        gzfile.close()
+    return buf.getvalue()
+
+
+def gzip_decompress(data):
+    """ Decompress a gzip-format byte string, e.g., one sent with
+    ``Content-Encoding: gzip`` """
+    gzfile = gzip.GzipFile(fileobj=BytesIO(data), mode='rb')
+    try:
+        return gzfile.read()
+    finally:
+        gzfile.close()
+
+
+def probe_hash(text):
+    """ Get the hash of the output of a probe that the client and
+    server use to tell whether it has changed since the last upload.
+    The output is hashed in the form the server parses it from the
+    probe data: line endings are normalized as the XML parser does,
+    and the text is encoded as UTF-8.
+
+    :param text: The probe output, which may be None
+    :type text: string
+    :returns: string - the hex digest of the output
+    """
+    if text is None:
+        text = ''
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return md5(text.encode('utf-8')).hexdigest()
+
+
 def safe_module_name(prefix, module):
     """ Munge the name of a module with prefix to avoid collisions
     with other Python modules.  E.g., if you want to import user
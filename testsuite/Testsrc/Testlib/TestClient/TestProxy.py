@@ -0,0 +1,89 @@
+import os
+import sys
+from mock import Mock
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+from Bcfg2.Compat import xmlrpclib
+from Bcfg2.Utils import gzip_compress, gzip_decompress
+from Bcfg2.Client.Proxy import XMLRPCTransport
+
+
+class TestXMLRPCTransport(Bcfg2TestCase):
+    def get_obj(self, compression_threshold=None):
+        return XMLRPCTransport(compression_threshold=compression_threshold)
+
+    def get_response(self, body, **headers):
+        response = Mock()
+        response.status = 200
+        response.read.return_value = body
+        response.getheader.side_effect = \
+            lambda name, default=None: headers.get(name, default)
+        return response
+
+    def get_sent_body(self, conn):
+        """ get the request body sent on a mock connection, and the
+        headers sent with it """
+        headers = dict(c[0] for c in conn.putheader.call_args_list)
+        body = conn.send.call_args[0][0]
+        self.assertEqual(headers["Content-Length"], str(len(body)))
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip_decompress(body)
+        return body, headers
+
+    def test_request(self):
+        trans = self.get_obj(compression_threshold=10)
+        conn = Mock()
+        trans.send_request = Mock(return_value=conn)
+        request = xmlrpclib.dumps(("test" * 10,), "test").encode('utf-8')
+        result = xmlrpclib.dumps(("result",), methodresponse=True)
+
+        def request_sent():
+            """ get the body and headers of the last request sent """
+            trans.send_content(conn, request)
+            return self.get_sent_body(conn)
+
+        # before the server says it accepts gzip, requests are not
+        # compressed
+        body, headers = request_sent()
+        self.assertEqual(body, request)
+        self.assertNotIn("Content-Encoding", headers)
+
+        conn.getresponse.return_value = self.get_response(
+            gzip_compress(result.encode('utf-8')),
+            **{"Content-Encoding": "gzip", "Accept-Encoding": "gzip"})
+        self.assertEqual(trans.request("localhost", "/", request),
+                         ("result",))
+        self.assertTrue(trans.server_accepts_gzip)
+
+        conn.reset_mock()
+        body, headers = request_sent()
+        self.assertEqual(body, request)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+
+        # small requests are not compressed
+        conn.reset_mock()
+        trans.compression_threshold = len(request)
+        body, headers = request_sent()
+        self.assertNotIn("Content-Encoding", headers)
+
+        # a server that doesn't accept gzip never gets compressed
+        # requests
+        conn.getresponse.return_value = self.get_response(
+            result.encode('utf-8'))
+        self.assertEqual(trans.request("localhost", "/", request),
+                         ("result",))
+        self.assertFalse(trans.server_accepts_gzip)
+        conn.reset_mock()
+        trans.compression_threshold = 0
+        body, headers = request_sent()
+        self.assertNotIn("Content-Encoding", headers)
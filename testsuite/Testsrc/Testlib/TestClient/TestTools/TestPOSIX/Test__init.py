@@ -1,5 +1,7 @@
 import os
 import sys
+import time
+import threading
 import lxml.etree
 from mock import Mock, MagicMock, patch
 import Bcfg2.Client.Tools
@@ -28,6 +30,10 @@ def get_config(entries):
 class TestPOSIX(TestTool):
     test_obj = POSIX
 
+    def setUp(self):
+        TestTool.setUp(self)
+        set_setup_default('posix_verify_concurrency', 1)
+
     def test__init(self):
         entries = [lxml.etree.Element("Path", name="test", type="file")]
         posix = self.get_obj(config=get_config(entries))
@@ -123,6 +129,52 @@ class TestPOSIX(TestTool):
         self.assertFalse(posix.VerifyPath(entry, modlist))
         self.assertIsNotNone(entry.get('qtext'))
 
+    def test_verify_entries(self):
+        posix = self.get_obj()
+        entries = [lxml.etree.Element("Path", name="/test%d" % i,
+                                      type="file")
+                   for i in range(20)]
+        modlist = ["/test0"]
+
+        # track how many entries are verified at once.  each call
+        # waits for up to ``target`` calls to be running, so that
+        # concurrent calls always overlap; the timeout is only reached
+        # if they are (wrongly) made one at a time
+        cond = threading.Condition()
+        running = [0, 0]
+        target = [1]
+
+        def verify(entry, mlist):
+            self.assertEqual(mlist, modlist)
+            cond.acquire()
+            try:
+                running[0] += 1
+                running[1] = max(running)
+                cond.notify_all()
+                end = time.time() + 5
+                while running[1] < target[0] and time.time() < end:
+                    cond.wait(end - time.time())
+                running[0] -= 1
+            finally:
+                cond.release()
+            return entry.get("name").endswith("0")
+
+        posix.VerifyPath = Mock(side_effect=verify)
+        expected = [(e, e.get("name").endswith("0")) for e in entries]
+        self.assertEqual(posix.verify_entries(entries, modlist), expected)
+        self.assertEqual(running[1], 1)
+
+        old_concurrency = Bcfg2.Options.setup.posix_verify_concurrency
+        try:
+            Bcfg2.Options.setup.posix_verify_concurrency = 10
+            running[1] = 0
+            target[0] = 10
+            self.assertEqual(posix.verify_entries(entries, modlist),
+                             expected)
+            self.assertEqual(running[1], 10)
+        finally:
+            Bcfg2.Options.setup.posix_verify_concurrency = old_concurrency
+
     @patch('os.remove')
     def test_prune_old_backups(self, mock_remove):
         entry = lxml.etree.Element("Path", name="/etc/foo", type="file")
@@ -0,0 +1,316 @@
+import os
+import sys
+import time
+import shutil
+import threading
+import tempfile
+import lxml.etree
+import xml.etree.ElementTree
+from mock import Mock, patch
+from Bcfg2.Compat import md5, xmlrpclib
+import Bcfg2.Options
+import Bcfg2.Server
+from Bcfg2.Client import Client, Proxy
+from Bcfg2.Server.Plugins.Probes import probe_hash
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+
+class TestClient(Bcfg2TestCase):
+    test_obj = Client
+
+    def setUp(self):
+        set_setup_default('probe_timeout')
+        set_setup_default('probe_concurrency', 1)
+        set_setup_default('inventory_concurrency', 1)
+        set_setup_default('probe_cache', '/nonexistent/probes')
+        set_setup_default('config_cache')
+        set_setup_default('exit_on_probe_failure', True)
+        set_setup_default('bundle_quick', False)
+        set_setup_default('remove')
+        set_setup_default('server', 'https://localhost:6789')
+        set_setup_default('encoding', 'UTF-8')
+
+    def get_obj(self):
+        return self.test_obj()
+
+    def get_probe(self, name, text, **attrs):
+        probe = lxml.etree.Element("probe", name=name, source="Probes",
+                                   interpreter="/bin/sh", **attrs)
+        probe.text = text
+        return probe
+
+    @skipUnless(os.path.exists("/bin/sh"), "/bin/sh not found")
+    def test_run_probe(self):
+        client = self.get_obj()
+        rv = client.run_probe(self.get_probe("test", "echo foo"))
+        self.assertEqual(rv.tag, "probe-data")
+        self.assertEqual(rv.get("name"), "test")
+        self.assertEqual(rv.get("source"), "Probes")
+        self.assertEqual(rv.text.strip(), "foo")
+        self.assertIn("probe-test", client.times)
+
+        # a probe that runs past its timeout is killed
+        client._probe_failure = Mock()
+        start = time.time()
+        client.run_probe(self.get_probe("slow", "sleep 10", timeout="0.5"))
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(client._probe_failure.called)
+        self.assertLess(client.times["probe-slow"], 5)
+
+    @skipUnless(os.path.exists("/bin/sh"), "/bin/sh not found")
+    def test_run_probe_list(self):
+        client = self.get_obj()
+        probes = [self.get_probe("probe%d" % i,
+                                 "sleep %s; echo %d" % (0.5 * (i % 2), i))
+                  for i in range(6)]
+
+        old_concurrency = Bcfg2.Options.setup.probe_concurrency
+        try:
+            Bcfg2.Options.setup.probe_concurrency = 6
+            start = time.time()
+            results = client.run_probe_list(probes)
+            # the three slow probes run at the same time
+            self.assertLess(time.time() - start, 1.4)
+            self.assertEqual([r.get("name") for r in results],
+                             [p.get("name") for p in probes])
+            self.assertEqual([r.text.strip() for r in results],
+                             [str(i) for i in range(6)])
+
+            # a fatal probe failure in a worker is raised
+            probes.insert(2, self.get_probe("fail", "exit 1"))
+            self.assertRaises(SystemExit, client.run_probe_list, probes)
+        finally:
+            Bcfg2.Options.setup.probe_concurrency = old_concurrency
+
+        # probes are run one at a time by default
+        client.run_probe = Mock()
+        results = client.run_probe_list(probes)
+        self.assertEqual(results,
+                         [client.run_probe.return_value] * len(probes))
+
+    def test_run_probes(self):
+        client = self.get_obj()
+        client.times = dict()
+        probes = lxml.etree.Element("probes")
+        for i in range(3):
+            probes.append(self.get_probe("probe%d" % i, "echo %d" % i,
+                                         conditional="true"))
+        probes.append(self.get_probe("probe3", "echo 3"))
+        client._proxy = Mock()
+        client.proxy.GetProbes.return_value = lxml.etree.tostring(probes)
+
+        def run_probe(probe):
+            rv = lxml.etree.Element("probe-data", name=probe.get("name"),
+                                    source=probe.get("source"))
+            rv.text = outputs[probe.get("name")]
+            return rv
+        client.run_probe = Mock(side_effect=run_probe)
+
+        def uploaded(call=-1):
+            """ get a dict of probe name -> (text, unchanged hash)
+            from the probe data uploaded on the given call """
+            data = lxml.etree.XML(
+                client.proxy.RecvProbeData.call_args_list[call][0][0])
+            return dict((d.get("name"), (d.text, d.get("unchanged")))
+                        for d in data)
+
+        tmpdir = tempfile.mkdtemp()
+        old_cache = Bcfg2.Options.setup.probe_cache
+        try:
+            Bcfg2.Options.setup.probe_cache = os.path.join(tmpdir, "probes")
+
+            # with no cache, all probe output is uploaded
+            outputs = dict(probe0="0", probe1="1", probe2="2", probe3="3")
+            client.run_probes()
+            self.assertEqual(uploaded(),
+                             dict(probe0=("0", None), probe1=("1", None),
+                                  probe2=("2", None), probe3=("3", None)))
+            self.assertTrue(
+                os.path.exists(Bcfg2.Options.setup.probe_cache))
+
+            # unchanged output of conditional probes is not uploaded
+            outputs['probe1'] = "changed"
+            client.proxy.reset_mock()
+            client.run_probes()
+            data = uploaded()
+            self.assertEqual(data['probe1'], ("changed", None))
+            self.assertEqual(data['probe3'], ("3", None))
+            self.assertIsNone(data['probe0'][0])
+            self.assertEqual(data['probe0'][1],
+                             client._probe_hash(run_probe(probes[0])))
+            self.assertIsNone(data['probe2'][0])
+            self.assertIsNotNone(data['probe2'][1])
+
+            # if the server asks for the output of unchanged probes,
+            # all probe output is uploaded again
+            client.proxy.reset_mock()
+            client.proxy.RecvProbeData.side_effect = \
+                [[["Probes", "probe0"]], True]
+            client.run_probes()
+            self.assertEqual(client.proxy.RecvProbeData.call_count, 2)
+            self.assertEqual(uploaded(0)['probe0'][0], None)
+            self.assertEqual(uploaded(1),
+                             dict(probe0=("0", None),
+                                  probe1=("changed", None),
+                                  probe2=("2", None), probe3=("3", None)))
+        finally:
+            Bcfg2.Options.setup.probe_cache = old_cache
+            shutil.rmtree(tmpdir)
+
+    def test__probe_hash(self):
+        client = self.get_obj()
+        # the hash of the probe output must match the hash the server
+        # computes from the probe data it parses, even if the output
+        # has trailing whitespace, non-ASCII characters, or CRs, and
+        # whichever XML library the client uses
+        for etree in [lxml.etree, xml.etree.ElementTree]:
+            for text in ["foo", "foo \t\n\n", u"caf\xe9\n", "a\r\nb\r",
+                         "\n", ""]:
+                probedata = etree.Element("ProbeData")
+                result = etree.SubElement(probedata, "probe-data",
+                                          name="test", source="Probes")
+                result.text = text
+                upload = xmlrpclib.loads(xmlrpclib.dumps(
+                    (etree.tostring(probedata,
+                                    encoding='utf-8').decode('utf-8'),),
+                    methodname="RecvProbeData"))[0][0]
+                received = lxml.etree.XML(upload.encode('utf-8'),
+                                          parser=Bcfg2.Server.XMLParser)
+                self.assertEqual(client._probe_hash(result),
+                                 probe_hash(received[0].text))
+
+    def test_download_config(self):
+        client = self.get_obj()
+        client._proxy = Mock()
+        config = "<Configuration><Bundle name='test'/></Configuration>"
+        client.proxy.GetConfig.return_value = config
+
+        # without a config cache, the configuration is always
+        # downloaded in full
+        self.assertEqual(client.download_config(), config.encode('utf-8'))
+        client.proxy.GetConfig.assert_called_with()
+
+        tmpdir = tempfile.mkdtemp()
+        old_cache = Bcfg2.Options.setup.config_cache
+        try:
+            Bcfg2.Options.setup.config_cache = os.path.join(tmpdir, "config")
+            self.assertEqual(client.download_config(), config.encode('utf-8'))
+            client.proxy.GetConfig.assert_called_with()
+            self.assertTrue(os.path.exists(Bcfg2.Options.setup.config_cache))
+
+            # the digest of the cached copy is sent, and the copy is
+            # used if the server says it is not modified
+            client.proxy.GetConfig.return_value = "<NotModified/>"
+            self.assertEqual(client.download_config(), config.encode('utf-8'))
+            digest = md5(config.encode('utf-8')).hexdigest()
+            client.proxy.GetConfig.assert_called_with(digest)
+
+            # a new configuration replaces the cached copy
+            newconfig = "<Configuration/>"
+            client.proxy.GetConfig.return_value = newconfig
+            self.assertEqual(client.download_config(),
+                             newconfig.encode('utf-8'))
+            client.proxy.GetConfig.assert_called_with(digest)
+            self.assertEqual(client._load_config_cache(),
+                             newconfig.encode('utf-8'))
+
+            # servers that don't accept a digest are asked for the
+            # full configuration
+            client.proxy.GetConfig.reset_mock()
+            client.proxy.GetConfig.side_effect = \
+                [Proxy.ProxyError(Exception("unknown argument")), config]
+            self.assertEqual(client.download_config(), config.encode('utf-8'))
+            self.assertEqual(client.proxy.GetConfig.call_count, 2)
+            client.proxy.GetConfig.assert_called_with()
+        finally:
+            Bcfg2.Options.setup.config_cache = old_cache
+            shutil.rmtree(tmpdir)
+
+    def test_Inventory(self):
+        client = self.get_obj()
+        client.times = dict()
+        client.states = dict()
+        client.config = lxml.etree.Element("Configuration")
+        bundle = lxml.etree.SubElement(client.config, "Bundle", name="test")
+        entries = [lxml.etree.SubElement(bundle, "Path", name="/test%d" % i)
+                   for i in range(4)]
+
+        # track which tools are running at once.  each tool waits for
+        # up to ``target`` tools to be running, so that the tools that
+        # can run concurrently always overlap; the timeout is only
+        # reached if they are (wrongly) run one at a time
+        cond = threading.Condition()
+        running = []
+        overlaps = []
+        max_running = [0]
+        target = [1]
+
+        def get_tool(name, states, concurrent=True):
+            tool = Mock()
+            tool.name = name
+            tool.concurrent_inventory = concurrent
+
+            def inventory():
+                cond.acquire()
+                try:
+                    running.append(name)
+                    overlaps.append(tuple(sorted(running)))
+                    max_running[0] = max(max_running[0], len(running))
+                    cond.notify_all()
+                    end = time.time() + 5
+                    while max_running[0] < target[0] and time.time() < end:
+                        cond.wait(end - time.time())
+                    running.remove(name)
+                finally:
+                    cond.release()
+                if isinstance(states, Exception):
+                    raise states
+                return states
+            tool.Inventory.side_effect = inventory
+            return tool
+
+        # results are merged in tool order, so later tools win, and
+        # entries that no tool verifies are bad
+        client.tools = [get_tool("Tool1", {entries[0]: True,
+                                           entries[1]: True}),
+                        get_tool("Tool2", Exception()),
+                        get_tool("Tool3", {entries[2]: True},
+                                 concurrent=False),
+                        get_tool("Tool4", dict(), concurrent=False)]
+        expected = {entries[0]: True, entries[1]: True, entries[2]: True,
+                    entries[3]: False}
+
+        client.Inventory()
+        self.assertEqual(client.states, expected)
+        self.assertEqual(max_running[0], 1)
+        for tool in client.tools:
+            self.assertIn("inventory-%s" % tool.name, client.times)
+
+        old_concurrency = Bcfg2.Options.setup.inventory_concurrency
+        try:
+            Bcfg2.Options.setup.inventory_concurrency = 4
+            client.states = dict()
+            client.tools[1] = get_tool("Tool2", {entries[1]: False})
+            expected[entries[1]] = False
+            max_running[0] = 0
+            target[0] = 3
+            client.Inventory()
+            self.assertEqual(client.states, expected)
+            # the tools that can't run concurrently run one after the
+            # other, at the same time as the others
+            self.assertEqual(max_running[0], 3)
+            for running_tools in overlaps:
+                self.assertFalse("Tool3" in running_tools and
+                                 "Tool4" in running_tools)
+        finally:
+            Bcfg2.Options.setup.inventory_concurrency = old_concurrency
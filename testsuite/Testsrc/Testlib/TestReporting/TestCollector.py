@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import threading
+from mock import Mock, patch
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+try:
+    from Bcfg2.Reporting.Collector import ReportingCollector
+    HAS_COLLECTOR = True
+except ImportError:
+    HAS_COLLECTOR = False
+
+
+class TestReportingCollector(Bcfg2TestCase):
+    def setUp(self):
+        Bcfg2TestCase.setUp(self)
+        set_setup_default("reporting_transport", Mock)
+        set_setup_default("reporting_storage", Mock)
+        set_setup_default("daemon", None)
+        set_setup_default("debug", False)
+        set_setup_default("verbose", False)
+        set_setup_default("children", 3)
+        set_setup_default("reporting_queue_size", 5)
+        set_setup_default("reporting_batch_size", 4)
+
+    @patch("Bcfg2.Logger.setup_logging", Mock())
+    def get_obj(self):
+        return ReportingCollector()
+
+    @skipUnless(HAS_COLLECTOR, "python-daemon or lockfile not found")
+    @patch("atexit.register", Mock())
+    def test_run(self):
+        collector = self.get_obj()
+        interactions = [dict(hostname="client%d" % i) for i in range(40)]
+        pending = list(interactions)
+        queue_depths = []
+
+        def fetch():
+            queue_depths.append(collector.queue.qsize())
+            if pending:
+                return pending.pop(0)
+            # wait for the workers to catch up, then shut down
+            while collector.queue.qsize():
+                time.sleep(0.01)
+            collector.shutdown()
+
+        collector.transport.fetch.side_effect = fetch
+
+        batches = []
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def import_interactions(batch):
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            batches.append(batch)
+            lock.release()
+            time.sleep(0.05)
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+
+        collector.storage.import_interactions.side_effect = \
+            import_interactions
+        collector.run()
+
+        # every interaction is imported exactly once, in batches of
+        # at most four, by at most three workers at a time
+        self.assertItemsEqual([i for b in batches for i in b], interactions)
+        self.assertLessEqual(max(len(b) for b in batches), 4)
+        self.assertGreater(max(len(b) for b in batches), 1)
+        self.assertLessEqual(running[1], 3)
+        self.assertEqual(collector.children, [])
+
+        # interactions are not fetched while the queue is full
+        self.assertLessEqual(max(queue_depths), 5)
+        self.assertIn(5, queue_depths)
+
+        stats = collector.get_statistics()
+        self.assertEqual(stats['latency'][3], 40)
+        self.assertEqual(stats['import_time'][3], 40)
+        self.assertEqual(stats['batch_size'][3], len(batches))
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertGreater(stats['throughput'], 0)
+        self.assertGreaterEqual(stats['latency'][0], stats['import_time'][0])
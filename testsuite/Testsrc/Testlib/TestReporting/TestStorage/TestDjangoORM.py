@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import lxml.etree
+import Bcfg2.Options
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+# the reporting models are only installed if South is available
+HAS_REPORTING = False
+if has_django:
+    import django.conf
+    if 'Bcfg2.Reporting' in django.conf.settings.INSTALLED_APPS:
+        import django.core.management
+        from django import db
+        from django.core.cache import cache
+        from Bcfg2.DBSettings import get_db_label
+        from Bcfg2.Reporting.Storage.DjangoORM import DjangoORM
+        from Bcfg2.Reporting.models import *
+        HAS_REPORTING = True
+
+
+def get_interaction(hostname, timestamp, count):
+    """ Get an interaction for the given host at the given time (in
+    seconds since the epoch) with ``count`` each of bad Path entries,
+    modified Package entries, extra Service entries and bad Path
+    entries that failed to bind on the server. """
+    stats = lxml.etree.Element("Statistics", revision="1", good="10",
+                               total=str(10 + 4 * count), state="dirty",
+                               time=time.asctime(time.localtime(timestamp)))
+    flags = lxml.etree.SubElement(stats, "Flags")
+    lxml.etree.SubElement(flags, "Flag", name="dry_run", value="True")
+    bad = lxml.etree.SubElement(stats, "Bad")
+    modified = lxml.etree.SubElement(stats, "Modified")
+    extra = lxml.etree.SubElement(stats, "Extra")
+    for i in range(count):
+        lxml.etree.SubElement(bad, "Path", name="/test/file%d" % i,
+                              type="file", mode="0644",
+                              current_mode="0600", owner="root",
+                              group="root")
+        lxml.etree.SubElement(bad, "Path", name="/test/failed%d" % i,
+                              failure="Failed to bind entry")
+        lxml.etree.SubElement(modified, "Package", name="pkg%d" % i,
+                              version="1.%d" % i,
+                              current_version="1.%d" % i)
+        lxml.etree.SubElement(extra, "Service", name="svc%d" % i,
+                              current_status="on")
+    lxml.etree.SubElement(stats, "OpStamps", start="1.0", finished="2.5",
+                          config_download="0.5")
+    return dict(hostname=hostname,
+                stats=lxml.etree.tostring(stats),
+                metadata=dict(server="bcfg2.example.com",
+                              profile="profile1",
+                              groups=["profile1", "group1", "group2"],
+                              bundles=["bundle1", "bundle2"]))
+
+
+class TestDjangoORM(Bcfg2TestCase):
+    test_obj = DjangoORM if HAS_REPORTING else None
+
+    def setUp(self):
+        Bcfg2TestCase.setUp(self)
+        set_setup_default("file_limit", 1024 * 1024)
+        if HAS_REPORTING:
+            django.core.management.call_command("syncdb", interactive=False,
+                                                verbosity=0, migrate_all=True)
+            for model in [Interaction, Client, Group, Bundle, FilePerms,
+                          PathEntry, PackageEntry, ServiceEntry,
+                          FailureEntry]:
+                model.objects.all().delete()
+            cache.clear()
+
+    def get_obj(self):
+        return self.test_obj()
+
+    @skipUnless(HAS_REPORTING, "Reporting models not available")
+    def test__import_interaction(self):
+        storage = self.get_obj()
+        storage._import_interaction(
+            get_interaction("foo.example.com", 1000000000, 5))
+
+        inter = Interaction.objects.get(client__name="foo.example.com")
+        self.assertEqual(inter.server, "bcfg2.example.com")
+        self.assertTrue(inter.dry_run)
+        self.assertEqual(inter.bad_count, 10)
+        self.assertEqual(inter.modified_count, 5)
+        self.assertEqual(inter.extra_count, 5)
+        self.assertEqual(inter.profile.name, "profile1")
+        self.assertItemsEqual([g.name for g in inter.groups.all()],
+                              ["profile1", "group1", "group2"])
+        self.assertItemsEqual([b.name for b in inter.bundles.all()],
+                              ["bundle1", "bundle2"])
+        self.assertItemsEqual([p.name for p in inter.paths.all()],
+                              ["/test/file%d" % i for i in range(5)])
+        path = inter.paths.get(name="/test/file0")
+        self.assertEqual(path.state, TYPE_BAD)
+        self.assertEqual(path.target_perms.mode, "0644")
+        self.assertEqual(path.current_perms.mode, "0600")
+        self.assertItemsEqual([f.name for f in inter.failures.all()],
+                              ["/test/failed%d" % i for i in range(5)])
+        self.assertEqual(inter.packages.count(), 5)
+        self.assertItemsEqual([s.state for s in inter.services.all()],
+                              [TYPE_EXTRA] * 5)
+        self.assertItemsEqual(
+            [(p.metric, float(p.value))
+             for p in inter.performance_items.all()],
+            [("start", 1.0), ("finished", 2.5), ("config_download", 0.5)])
+
+        # a later interaction with the same entries reuses them, even
+        # after the cache is cleared
+        cache.clear()
+        storage._import_interaction(
+            get_interaction("foo.example.com", 1000000100, 6))
+        self.assertEqual(Interaction.objects.count(), 2)
+        self.assertEqual(PathEntry.objects.count(), 6)
+        self.assertEqual(FailureEntry.objects.count(), 6)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(FilePerms.objects.count(), 2)
+        inter = Client.objects.get(name="foo.example.com").current_interaction
+        self.assertEqual(inter.paths.count(), 6)
+        self.assertEqual(inter.packages.count(), 6)
+
+        # an interaction that has already been imported is skipped
+        storage._import_interaction(
+            get_interaction("foo.example.com", 1000000100, 6))
+        self.assertEqual(Interaction.objects.count(), 2)
+
+    @skipUnless(HAS_REPORTING, "Reporting models not available")
+    def test_import_interactions(self):
+        storage = self.get_obj()
+        bad = get_interaction("bar.example.com", 1000000000, 2)
+        del bad['metadata']['groups']
+        storage.import_interactions(
+            [get_interaction("foo.example.com", 1000000000, 2), bad,
+             get_interaction("baz.example.com", 1000000000, 2)])
+
+        # an interaction that fails to import doesn't stop the rest
+        # of the batch from being imported
+        self.assertItemsEqual([i.client.name
+                               for i in Interaction.objects.all()],
+                              ["foo.example.com", "baz.example.com"])
+        self.assertEqual(PathEntry.objects.count(), 2)
+        for inter in Interaction.objects.all():
+            self.assertEqual(inter.paths.count(), 2)
+
+    @skipUnless(HAS_REPORTING, "Reporting models not available")
+    def test_import_queries(self):
+        """ Importing an interaction with thousands of entries takes
+        a bounded number of queries """
+        storage = self.get_obj()
+        connection = db.connections[get_db_label('Reporting')]
+        count = 750
+        queries = []
+        old_debug = django.conf.settings.DEBUG
+        try:
+            # queries are only recorded in debug mode
+            django.conf.settings.DEBUG = True
+            for i in range(3):
+                db.reset_queries()
+                storage._import_interaction(
+                    get_interaction("client%d.example.com" % i,
+                                    1000000000 + i, count))
+                queries.append(len(connection.queries))
+        finally:
+            django.conf.settings.DEBUG = old_debug
+        self.assertEqual(Interaction.objects.count(), 3)
+        # the first interaction creates the entries, and the others
+        # reuse them
+        for num in queries:
+            self.assertLess(num, count / 5)
@@ -52,3 +52,33 @@ class TestCache(Bcfg2TestCase):
         probe_cache2 = Cache("Probes", "data")
         self.assertItemsEqual(list(iter(probe_cache)),
                               list(iter(probe_cache2)))
+
+
+class TestLRUCache(Bcfg2TestCase):
+    def test_lru(self):
+        cache = LRUCache(3)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['c'] = 3
+        self.assertEqual(len(cache), 3)
+
+        # using "a" makes "b" the least recently used item
+        self.assertEqual(cache['a'], 1)
+        cache['d'] = 4
+        self.assertItemsEqual(list(cache), ['a', 'c', 'd'])
+        self.assertNotIn('b', cache)
+
+        # replacing an item does not evict anything
+        cache['c'] = 5
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache['c'], 5)
+
+        cache['e'] = 6
+        self.assertItemsEqual(list(cache), ['c', 'd', 'e'])
+
+        del cache['d']
+        self.assertItemsEqual(list(cache), ['c', 'e'])
+        cache['f'] = 7
+        cache['g'] = 8
+        self.assertItemsEqual(list(cache), ['e', 'f', 'g'])
+        self.assertRaises(KeyError, cache.__getitem__, 'a')
@@ -0,0 +1,124 @@
+import os
+import sys
+import lxml.etree
+from mock import Mock
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+import Bcfg2.Server.Cache
+from Bcfg2.Server.Core import Core, config_digest
+from Bcfg2.Server.Plugin import ClientRunHooks
+
+
+class HookPlugin(ClientRunHooks):
+    """ A client run hooks plugin that refreshes the data the client
+    metadata is built from at the start of each client run, like the
+    Ldap and AWSTags plugins do """
+    name = "Hooks"
+    sort_order = 500
+
+    def __init__(self):
+        ClientRunHooks.__init__(self)
+        self.data = "old"
+        self.source = "old"
+        self.start_client_run = Mock(side_effect=self._refresh)
+        self.end_client_run = Mock()
+
+    def _refresh(self, metadata):
+        self.data = self.source
+
+
+class TestCore(Bcfg2TestCase):
+    def setUp(self):
+        Bcfg2TestCase.setUp(self)
+        Bcfg2.Server.Cache.expire("Core", "configs")
+
+    def get_obj(self):
+        core = Core.__new__(Core)
+        core.logger = Mock()
+        core.revision = "-1"
+        core.fam = Mock(events_handled=0, events_by_handle=dict(),
+                        paths=dict())
+        core.metadata = Mock()
+        core.config_digests = Bcfg2.Server.Cache.Cache("Core", "configs")
+        core._plugin_changes = (None, ())
+        core._monitor_owners = dict()
+        core._database_available = False
+        core.hooks = HookPlugin()
+        core.plugins = dict(Hooks=core.hooks)
+
+        def build_metadata(client):
+            return Mock(hostname=client, profile="profile", groups=[],
+                        bundles=[], categories=dict(), aliases=[],
+                        addresses=[], uuid=None, password=None,
+                        version=None, connectors=["Hooks"],
+                        Hooks=core.hooks.data)
+
+        core.build_metadata = Mock(side_effect=build_metadata)
+        core.resolve_client = Mock(side_effect=lambda address:
+                                   ("foo.example.com",
+                                    build_metadata("foo.example.com")))
+        core._build_configuration = Mock(
+            side_effect=lambda metadata: lxml.etree.Element(
+                "Configuration", data=metadata.Hooks))
+        return core
+
+    def test_GetConfig(self):
+        core = self.get_obj()
+        address = ("1.2.3.4", 1234)
+
+        config = core.GetConfig(address)
+        self.assertXMLEqual(lxml.etree.XML(config),
+                            lxml.etree.Element("Configuration", data="old"))
+        self.assertEqual(core.hooks.start_client_run.call_count, 1)
+        self.assertEqual(core.hooks.end_client_run.call_count, 1)
+
+        # the client has the current configuration, but the client
+        # run hooks are still run
+        rv = core.GetConfig(address, config_digest(config))
+        self.assertXMLEqual(lxml.etree.XML(rv),
+                            lxml.etree.Element("NotModified"))
+        self.assertEqual(core._build_configuration.call_count, 1)
+        self.assertEqual(core.hooks.start_client_run.call_count, 2)
+        self.assertEqual(core.hooks.end_client_run.call_count, 2)
+
+        # a start_client_run hook changes the client metadata, so the
+        # configuration is built again
+        core.hooks.source = "new"
+        rv = core.GetConfig(address, config_digest(config))
+        self.assertXMLEqual(lxml.etree.XML(rv),
+                            lxml.etree.Element("Configuration", data="new"))
+        self.assertEqual(core._build_configuration.call_count, 2)
+        self.assertEqual(core.hooks.end_client_run.call_count, 3)
+
+        # the end_client_run hooks run even if the build fails
+        core._build_configuration.side_effect = Exception
+        self.assertRaises(Exception, core.GetConfig, address)
+        self.assertEqual(core.hooks.end_client_run.call_count, 4)
+
+    def test_GetConfig_metadata_changes(self):
+        core = self.get_obj()
+        address = ("1.2.3.4", 1234)
+        digest = config_digest(core.GetConfig(address))
+
+        # an exact expiration of a client's metadata only means that
+        # the metadata object must be rebuilt
+        core.metadata_cache = Bcfg2.Server.Cache.Cache("Metadata")
+        core.metadata_cache.expire("foo.example.com")
+        core.GetConfig(address, digest)
+        self.assertEqual(core._build_configuration.call_count, 1)
+
+        # the metadata of another client changed, which the
+        # configuration of this one can depend on
+        Bcfg2.Server.Cache.expire("Metadata", "bar.example.com")
+        core.GetConfig(address, digest)
+        self.assertEqual(core._build_configuration.call_count, 2)
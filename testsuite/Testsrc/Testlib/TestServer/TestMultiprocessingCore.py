@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+import lxml.etree
+from mock import Mock
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+from Bcfg2.Server.MultiprocessingCore import ChildScheduler, ChildCore
+
+
+class TestChildScheduler(Bcfg2TestCase):
+    def test_acquire(self):
+        sched = ChildScheduler(["Child-0", "Child-1", "Child-2"])
+
+        # with no history, builds are spread evenly
+        children = [sched.acquire() for _ in range(3)]
+        self.assertItemsEqual(children, ["Child-0", "Child-1", "Child-2"])
+        self.assertEqual(sched.in_flight,
+                         {"Child-0": 1, "Child-1": 1, "Child-2": 1})
+
+        # slow children get fewer builds
+        sched.release("Child-0", 10.0)
+        sched.release("Child-1", 1.0)
+        sched.release("Child-2", 1.0)
+        self.assertEqual(sched.latency("Child-0"), 10.0)
+        children = [sched.acquire() for _ in range(4)]
+        self.assertNotIn("Child-0", children)
+        self.assertEqual(sched.in_flight,
+                         {"Child-0": 0, "Child-1": 2, "Child-2": 2})
+
+        # an idle child that is slow is still preferred to a heavily
+        # loaded one
+        for _ in range(16):
+            sched.acquire()
+        self.assertGreater(sched.in_flight["Child-0"], 0)
+
+    def test_release(self):
+        sched = ChildScheduler(["Child-0"])
+        for i in range(sched.history + 5):
+            sched.acquire()
+            sched.release("Child-0", float(i))
+        self.assertEqual(len(sched.build_times["Child-0"]), sched.history)
+        self.assertEqual(sched.latency("Child-0"),
+                         sum(range(5, sched.history + 5)) /
+                         float(sched.history))
+        self.assertEqual(sched.in_flight["Child-0"], 0)
+
+    def test_concurrency(self):
+        sched = ChildScheduler(["Child-0", "Child-1"], concurrency=1)
+        sched.poll_wait = 0.1
+        self.assertItemsEqual([sched.acquire(), sched.acquire()],
+                              ["Child-0", "Child-1"])
+
+        # both children are busy, so the next request must wait until
+        # one of them is released
+        rv = []
+        waiter = threading.Thread(target=lambda: rv.append(sched.acquire()))
+        waiter.start()
+        waiter.join(0.3)
+        self.assertTrue(waiter.is_alive())
+        self.assertEqual(sched.waiting, 1)
+        sched.release("Child-1", 1.0)
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(rv, ["Child-1"])
+        self.assertEqual(sched.waiting, 0)
+
+        # setting the terminate event stops the wait
+        waiter = threading.Thread(target=lambda: rv.append(sched.acquire()))
+        waiter.start()
+        sched.terminate.set()
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(rv, ["Child-1", None])
+
+
+class TestChildCore(Bcfg2TestCase):
+    def get_obj(self):
+        core = ChildCore.__new__(ChildCore)
+        core.name = "Child-0"
+        core.logger = Mock()
+        core.metadata = Mock()
+        core.terminate = threading.Event()
+        core.poll_wait = 0.1
+        core.snapshot_timeout = 0.3
+        core.metadata_generation = 1
+        core._metadata_loaded = threading.Condition()
+        core.BuildConfiguration = Mock(
+            return_value=lxml.etree.Element("Configuration"))
+        return core
+
+    def test_GetConfig(self):
+        core = self.get_obj()
+        self.assertEqual(core.GetConfig("foo.example.com"),
+                         lxml.etree.tostring(core.BuildConfiguration()))
+        self.assertEqual(core.GetConfig("foo.example.com",
+                                        metadata_generation=1),
+                         lxml.etree.tostring(core.BuildConfiguration()))
+
+        # the snapshot is loaded while the build waits for it
+        rv = []
+        waiter = threading.Thread(target=lambda: rv.append(
+            core.GetConfig("foo.example.com", metadata_generation=2)))
+        core.snapshot_timeout = 5
+        waiter.start()
+        core._metadata_loaded.acquire()
+        core.metadata_generation = 2
+        core._metadata_loaded.notify_all()
+        core._metadata_loaded.release()
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(rv, [lxml.etree.tostring(core.BuildConfiguration())])
+
+        # a snapshot that is never loaded (e.g., because loading it
+        # failed) does not block the build forever
+        core.snapshot_timeout = 0.3
+        core.BuildConfiguration.reset_mock()
+        self.assertIsNone(core.GetConfig("foo.example.com",
+                                         metadata_generation=3))
+        self.assertFalse(core.BuildConfiguration.called)
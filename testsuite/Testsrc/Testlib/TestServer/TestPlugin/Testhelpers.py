@@ -717,6 +717,11 @@ class TestStructFile(TestXMLFileBacked):
         mock_TemplateLoader.reset_mock()
         sf.Index()
         self.assertFalse(mock_TemplateLoader.called)
+        self.assertTrue(sf.client_specific)
+
+        sf.data = lxml.etree.tostring(groups[1])
+        sf.Index()
+        self.assertFalse(sf.client_specific)
 
         mock_TemplateLoader.reset_mock()
         template_xdata = \
@@ -732,6 +737,7 @@ class TestStructFile(TestXMLFileBacked):
                                        encoding=Bcfg2.Options.setup.encoding)
         self.assertEqual(sf.template,
                          loader.load.return_value)
+        self.assertTrue(sf.client_specific)
 
     @skipUnless(HAS_CRYPTO, "No crypto libraries found, skipping")
     def test_Index_crypto(self):
@@ -1001,6 +1007,110 @@ class TestStructFile(TestXMLFileBacked):
         # TODO: add tests to ensure that XMLMatch() returns elements
         # in document order
 
+    def _get_large_bundle(self, size=5000):
+        """ build a bundle with ``size`` entries, spread over nested
+        Group and Client tags """
+        xdata = lxml.etree.Element("Bundle", name="large")
+        parent = xdata
+        for i in range(size):
+            if i % 50 == 0:
+                parent = xdata
+            if i % 10 == 0:
+                tag = "Client" if i % 30 == 0 else "Group"
+                parent = lxml.etree.SubElement(parent, tag,
+                                               name="group%d" % (i % 7))
+                if i % 40 == 0:
+                    parent.set("negate", "true")
+                parent.text = "text%d" % i
+            entry = lxml.etree.SubElement(parent, "Package", name="pkg%d" % i,
+                                          type="yum")
+            if i % 3 == 0:
+                lxml.etree.SubElement(entry, "Instance", version="%d" % i)
+        return xdata
+
+    def test_compiled_match(self):
+        """ Match() and XMLMatch() with compiled predicates """
+        Bcfg2.Options.setup.lax_decryption = True
+        sf = self.get_obj()
+        sf.data = lxml.etree.tostring(self._get_large_bundle())
+        sf.Index()
+        metadata = Mock()
+        metadata.hostname = "group0"
+        metadata.groups = ["group1", "group2", "group4"]
+
+        def include(item):
+            """ the original predicate test """
+            if item.tag not in sf._include_tests:
+                return True
+            negate = item.get('negate', 'false').lower() == 'true'
+            return negate != sf._include_tests[item.tag](item, metadata)
+
+        def old_match(item):
+            """ the original implementation of Match(), which deep
+            copies every matching element """
+            if isinstance(item, lxml.etree._Comment):
+                return []
+            elif item.tag in sf._include_tests:
+                rv = []
+                if include(item):
+                    for child in item.iterchildren():
+                        rv.extend(old_match(child))
+                return rv
+            rv = copy.deepcopy(item)
+            for child in rv.iterchildren():
+                rv.remove(child)
+            for child in item.iterchildren():
+                rv.extend(old_match(child))
+            return [rv]
+
+        def old_xml_match(item):
+            """ the original implementation of XMLMatch(), which deep
+            copies the entire document """
+            if include(item):
+                if item.tag in sf._include_tests:
+                    for child in item.iterchildren():
+                        item.remove(child)
+                        item.getparent().append(child)
+                        old_xml_match(child)
+                    if item.text:
+                        item.getparent().text = \
+                            (item.getparent().text or '') + item.text
+                    item.getparent().remove(item)
+                else:
+                    for child in item.iterchildren():
+                        old_xml_match(child)
+            else:
+                item.getparent().remove(item)
+
+        def run_old_match():
+            """ run the original Match() over the whole file """
+            rv = []
+            for child in sf.entries:
+                rv.extend(old_match(child))
+            return rv
+
+        def run_old_xml_match():
+            """ run the original XMLMatch() over the whole file """
+            rv = copy.deepcopy(sf.xdata)
+            for child in rv.iterchildren():
+                old_xml_match(child)
+            return rv
+
+        expected = run_old_match()
+        actual = sf._do_match(metadata)
+        self.assertEqual(len(actual), len(expected))
+        for new, old in zip(actual, expected):
+            self.assertXMLEqual(new, old)
+
+        expected = run_old_xml_match()
+        actual = sf._do_xmlmatch(metadata)
+        # XMLMatch() does not guarantee the order of the document it
+        # returns, so compare the entries regardless of order
+        self.assertItemsEqual([lxml.etree.tostring(e) for e in actual],
+                              [lxml.etree.tostring(e) for e in expected])
+        self.assertItemsEqual(actual.text, expected.text)
+        self.assertEqual(actual.xpath("//Package[@name='pkg3']"), [])
+
 
 class TestInfoXML(TestStructFile):
     test_obj = InfoXML
@@ -1295,6 +1405,72 @@ class TestPrioDir(TestPlugin, TestGenerator, TestXMLDirectoryBacked):
         self.assertRaises(PluginExecutionError,
                           pd.BindEntry, entry, metadata)
 
+    @patch("Bcfg2.Server.Plugin.helpers.XMLDirectoryBacked.HandleEvent",
+           Mock())
+    def test_BindEntry_client_run(self):
+        pd = self.get_obj()
+        metadata = Mock()
+        test1 = lxml.etree.Element("Rules", priority="10")
+        lxml.etree.SubElement(test1, "Path", name="/etc/foo.conf",
+                              attr="attr1")
+        lxml.etree.SubElement(test1, "Package", name="quux", attr="attr2")
+        test2 = lxml.etree.Element("Rules", priority="20")
+        lxml.etree.SubElement(test2, "Path", name="/etc/bar.conf",
+                              attr="attr3")
+        pd.entries = {"/test1.xml": Mock(priority="10"),
+                      "/test2.xml": Mock(priority="20")}
+        pd.entries["/test1.xml"].XMLMatch.return_value = test1
+        pd.entries["/test2.xml"].XMLMatch.return_value = test2
+
+        def bind_all():
+            for tag, name, attr in [("Path", "/etc/foo.conf", "attr1"),
+                                    ("Package", "quux", "attr2"),
+                                    ("Path", "/etc/bar.conf", "attr3")]:
+                entry = lxml.etree.Element(tag, name=name)
+                pd.BindEntry(entry, metadata)
+                self.assertEqual(entry.get("attr"), attr)
+
+        # during a client run, each file is only matched once
+        pd.start_client_run(metadata)
+        bind_all()
+        bind_all()
+        for src in pd.entries.values():
+            src.XMLMatch.assert_called_once_with(metadata)
+
+        # a different metadata object for the same client is not
+        # served from the index
+        other = Mock(hostname=metadata.hostname)
+        self.assertRaises(PluginExecutionError,
+                          pd.BindEntry, lxml.etree.Element("Path",
+                                                           name="/etc/baz"),
+                          other)
+        for src in pd.entries.values():
+            self.assertEqual(src.XMLMatch.call_count, 2)
+            src.XMLMatch.reset_mock()
+
+        # changes to the data are picked up in the middle of a run
+        pd.entries["/test1.xml"].xdata = test1
+        pd.entries["/test2.xml"].xdata = test2
+        pd.HandleEvent(Mock())
+        bind_all()
+        for src in pd.entries.values():
+            src.XMLMatch.assert_called_once_with(metadata)
+
+        # once the run is over, the indexes are dropped
+        pd.end_client_run(metadata)
+        self.assertEqual(pd._match_indexes, dict())
+        bind_all()
+        for src in pd.entries.values():
+            self.assertEqual(src.XMLMatch.call_count, 4)
+
+    def test_is_client_specific(self):
+        pd = self.get_obj()
+        pd.entries = {"/test1.xml": Mock(client_specific=False),
+                      "/test2.xml": Mock(client_specific=False)}
+        self.assertFalse(pd.is_client_specific(Mock(), Mock()))
+        pd.entries["/test2.xml"].client_specific = True
+        self.assertTrue(pd.is_client_specific(Mock(), Mock()))
+
 
 class TestSpecificity(Bcfg2TestCase):
     test_obj = Specificity
@@ -1357,6 +1533,91 @@ class TestSpecificity(Bcfg2TestCase):
                     self.assertGreaterEqual(specs[j], specs[i])
 
 
+class TestSpecificityIndex(Bcfg2TestCase):
+    test_obj = SpecificityIndex
+
+    def get_obj(self, *args, **kwargs):
+        return self.test_obj(*args, **kwargs)
+
+    def _get_entries(self):
+        return {"test": Mock(specific=Specificity(all=True)),
+                "test.G10_foo": Mock(specific=Specificity(group="foo",
+                                                          prio=10)),
+                "test.G20_foo": Mock(specific=Specificity(group="foo",
+                                                          prio=20)),
+                "test.G30_bar": Mock(specific=Specificity(group="bar",
+                                                          prio=30)),
+                "test.H_foo.example.com":
+                    Mock(specific=Specificity(hostname="foo.example.com")),
+                "test.H_bar.example.com":
+                    Mock(specific=Specificity(hostname="bar.example.com"))}
+
+    def test_index(self):
+        entries = self._get_entries()
+        idx = self.get_obj(entries)
+        self.assertItemsEqual(idx, entries)
+        self.assertItemsEqual(idx.all, [entries["test"]])
+        self.assertItemsEqual(idx.hosts.keys(),
+                              ["foo.example.com", "bar.example.com"])
+        self.assertEqual(idx.groups["foo"], [entries["test.G20_foo"],
+                                             entries["test.G10_foo"]])
+        self.assertEqual(idx.other, [])
+
+        del idx["test.G20_foo"]
+        self.assertEqual(idx.groups["foo"], [entries["test.G10_foo"]])
+        idx.pop("test.G30_bar")
+        self.assertNotIn("bar", idx.groups)
+        idx["test"] = entries["test.G10_foo"]
+        self.assertEqual(idx.all, [])
+        self.assertEqual(idx.groups["foo"], [entries["test.G10_foo"],
+                                             entries["test.G10_foo"]])
+        idx.clear()
+        self.assertEqual(idx.groups, dict())
+
+    def test_get_matching(self):
+        entries = self._get_entries()
+        entries["other"] = Mock()
+        entries["other"].specific.matches.return_value = True
+        idx = self.get_obj(entries)
+        for hostname, groups in [("foo.example.com", []),
+                                 ("baz.example.com", ["foo", "baz"]),
+                                 ("bar.example.com", ["bar", "foo"])]:
+            metadata = Mock(hostname=hostname, groups=groups)
+            self.assertItemsEqual(
+                idx.get_matching(metadata),
+                [e for e in entries.values()
+                 if e.specific.matches(metadata)])
+
+        metadata = Mock(hostname="baz.example.com", groups=["foo"])
+        self.assertItemsEqual(idx.get_matching(metadata, entry_type=Mock),
+                              [entries["test"], entries["other"],
+                               entries["test.G10_foo"],
+                               entries["test.G20_foo"]])
+        self.assertEqual(idx.get_matching(metadata, entry_type=str), [])
+
+    def test_best_matching(self):
+        entries = self._get_entries()
+        idx = self.get_obj(entries)
+        self.assertEqual(
+            idx.best_matching(Mock(hostname="foo.example.com",
+                                   groups=["bar"])),
+            entries["test.H_foo.example.com"])
+        self.assertEqual(
+            idx.best_matching(Mock(hostname="baz.example.com",
+                                   groups=["foo", "bar"])),
+            entries["test.G30_bar"])
+        self.assertEqual(
+            idx.best_matching(Mock(hostname="baz.example.com",
+                                   groups=["foo"])),
+            entries["test.G20_foo"])
+        self.assertEqual(
+            idx.best_matching(Mock(hostname="baz.example.com", groups=[])),
+            entries["test"])
+        del idx["test"]
+        self.assertIsNone(
+            idx.best_matching(Mock(hostname="baz.example.com", groups=[])))
+
+
 class TestSpecificData(TestDebuggable):
     test_obj = SpecificData
     path = os.path.join(datastore, "test.txt")
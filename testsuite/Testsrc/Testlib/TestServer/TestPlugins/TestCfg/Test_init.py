@@ -3,10 +3,13 @@ import sys
 import errno
 import lxml.etree
 import Bcfg2.Options
-from Bcfg2.Compat import walk_packages, ConfigParser
+import Bcfg2.Server.Cache
+import Bcfg2.Server.Plugins.Cfg
+from Bcfg2.Compat import walk_packages, ConfigParser, cPickle
 from mock import Mock, MagicMock, patch
 from Bcfg2.Server.Plugins.Cfg import *
 from Bcfg2.Server.Plugin import PluginExecutionError, Specificity
+from Bcfg2.Server.Plugins.Metadata import ClientMetadata
 
 # add all parent testsuite directories to sys.path to allow (most)
 # relative imports in python 2.4
@@ -348,6 +351,7 @@ class TestCfgEntrySet(TestEntrySet):
         TestEntrySet.setUp(self)
         set_setup_default("cfg_validation", False)
         set_setup_default("cfg_handlers", [])
+        set_setup_default("cfg_cache", False)
 
     def test__init(self):
         pass
@@ -595,6 +599,106 @@ class TestCfgEntrySet(TestEntrySet):
         eset._generate_data.assert_called_with(entry, metadata)
         eset._validate_data.assert_called_with(entry, metadata, "data")
 
+    @patch("Bcfg2.Server.Plugins.Cfg.get_cfg")
+    def test_bind_entry_cache(self, mock_get_cfg):
+        Bcfg2.Options.setup.cfg_cache = True
+        Bcfg2.Server.Cache.expire("Cfg")
+        mock_get_cfg.return_value.core.revision = "1"
+        eset = self.get_obj()
+
+        def bind(entry, metadata):
+            entry.set("mode", "0644")
+            entry.text = "data for %s" % metadata.hostname
+            return entry
+
+        eset._bind_entry = Mock(side_effect=bind)
+
+        metadata = Mock()
+        metadata.hostname = "foo.example.com"
+        metadata.profile = "profile"
+        metadata.groups = set(["profile", "group1"])
+        metadata.bundles = set()
+        metadata.categories = dict()
+        metadata.aliases = []
+        metadata.addresses = []
+        metadata.version = "1.4.0"
+        metadata.Probes = dict(probe="value")
+
+        def reset():
+            eset._bind_entry.reset_mock()
+            return lxml.etree.Element("Path", name="/test.txt")
+
+        expected = lxml.etree.Element("Path", name="/test.txt", mode="0644")
+        expected.text = "data for foo.example.com"
+
+        # first bind renders the entry
+        entry = reset()
+        self.assertXMLEqual(eset.bind_entry(entry, metadata), expected)
+        eset._bind_entry.assert_called_with(entry, metadata)
+
+        # second bind is served from the cache
+        entry = reset()
+        self.assertXMLEqual(eset.bind_entry(entry, metadata), expected)
+        self.assertFalse(eset._bind_entry.called)
+
+        # a FAM event on the entry set invalidates the cache
+        eset.revision += 1
+        entry = reset()
+        self.assertXMLEqual(eset.bind_entry(entry, metadata), expected)
+        self.assertTrue(eset._bind_entry.called)
+
+        # a change to the client metadata invalidates the cache
+        metadata.Probes = dict(probe="new value")
+        entry = reset()
+        eset.bind_entry(entry, metadata)
+        self.assertTrue(eset._bind_entry.called)
+        entry = reset()
+        eset.bind_entry(entry, metadata)
+        self.assertFalse(eset._bind_entry.called)
+
+        # a new repository revision invalidates the cache
+        mock_get_cfg.return_value.core.revision = "2"
+        entry = reset()
+        eset.bind_entry(entry, metadata)
+        self.assertTrue(eset._bind_entry.called)
+
+        # expiring the client's metadata invalidates the cache
+        Bcfg2.Server.Cache.expire("Metadata", metadata.hostname)
+        entry = reset()
+        eset.bind_entry(entry, metadata)
+        self.assertTrue(eset._bind_entry.called)
+
+        # different attributes on the abstract entry are cached
+        # separately
+        entry = reset()
+        entry.set("encoding", "base64")
+        eset.bind_entry(entry, metadata)
+        self.assertTrue(eset._bind_entry.called)
+
+        Bcfg2.Options.setup.cfg_cache = False
+        Bcfg2.Server.Cache.expire("Cfg")
+
+    def test_is_client_specific(self):
+        eset = self.get_obj()
+        metadata = Mock()
+        generator = Mock()
+        generator.is_client_specific.return_value = False
+        info = Mock()
+        info.is_client_specific.return_value = False
+        eset.get_handlers = Mock()
+
+        # no generator; data may be created for this client
+        eset.get_handlers.return_value = []
+        self.assertTrue(eset.is_client_specific(metadata))
+
+        eset.get_handlers.side_effect = \
+            lambda m, t: dict(CfgGenerator=[generator]).get(t.__name__,
+                                                            [generator, info])
+        self.assertFalse(eset.is_client_specific(metadata))
+
+        info.is_client_specific.return_value = True
+        self.assertTrue(eset.is_client_specific(metadata))
+
     def test_get_handlers(self):
         eset = self.get_obj()
         eset.entries['test1.txt'] = CfgInfo("test1.txt")
@@ -802,6 +906,113 @@ class TestCfgEntrySet(TestEntrySet):
         pass
 
 
+class TestCfgRenderPool(Bcfg2TestCase):
+    def get_obj(self, core=None, processes=2):
+        if core is None:
+            core = Mock()
+            core.database_available = False
+        return CfgRenderPool(core, processes)
+
+    def test__render_in_pool(self):
+        Bcfg2.Server.Plugins.Cfg._RENDER_GENERATION = None
+        Bcfg2.Server.Plugins.Cfg._RENDER_GENERATORS.clear()
+        cls = Mock()
+        generator = cls.return_value
+        generator.__class__ = cls
+        generator.render_template.return_value = "data"
+        entry = lxml.etree.Element("Path", name="/test.txt")
+        specific = Specificity(all=True)
+        template_vars = dict(foo=cPickle.dumps("foo", 2),
+                             bar=cPickle.dumps(["bar"], 2))
+
+        def render(generation):
+            return Bcfg2.Server.Plugins.Cfg._render_in_pool(
+                cls, "/test/test.txt/test.txt.genshi", specific, generation,
+                lxml.etree.tostring(entry), template_vars)
+
+        self.assertEqual(render(1), (True, "data"))
+        cls.assert_called_with("/test/test.txt/test.txt.genshi", specific)
+        self.assertEqual(generator.handle_event.call_count, 1)
+        evt = generator.handle_event.call_args[0][0]
+        self.assertEqual(evt.filename, "/test/test.txt/test.txt.genshi")
+        self.assertEqual(evt.code2str(), "changed")
+        self.assertXMLEqual(generator.render_template.call_args[0][0], entry)
+        self.assertEqual(generator.render_template.call_args[0][1],
+                         dict(foo="foo", bar=["bar"]))
+
+        # the template is loaded once per generation
+        cls.reset_mock()
+        self.assertEqual(render(1), (True, "data"))
+        self.assertFalse(cls.called)
+        self.assertEqual(render(2), (True, "data"))
+        cls.assert_called_with("/test/test.txt/test.txt.genshi", specific)
+
+        # render failure
+        generator.render_template.side_effect = ValueError("bogus")
+        self.assertEqual(render(2), (False, "ValueError: bogus"))
+
+    def test_UnpicklableValue(self):
+        val = cPickle.loads(cPickle.dumps(UnpicklableValue("foo"), 2))
+        self.assertEqual(val.name, "foo")
+        self.assertRaises(PluginExecutionError, getattr, val, "bar")
+        self.assertRaises(PluginExecutionError, str, val)
+        self.assertRaises(PluginExecutionError, bool, val)
+        self.assertRaises(PluginExecutionError, list, val)
+        self.assertRaises(PluginExecutionError, val)
+        self.assertRaises(PluginExecutionError, lambda: val["bar"])
+
+    @patch("multiprocessing.Pool")
+    def test_render(self, mock_Pool):
+        pool = self.get_obj()
+        mock_Pool.assert_called_with(
+            processes=2,
+            initializer=Bcfg2.Server.Plugins.Cfg._init_render_worker)
+        workers = mock_Pool.return_value
+        workers.apply.return_value = (True, "data")
+
+        entry = lxml.etree.Element("Path", name="/test.txt")
+        metadata = ClientMetadata("foo.example.com", "profile",
+                                  set(["group1", "profile"]), set(), [], [],
+                                  dict(), None, None, None, Mock())
+        metadata.Probes = dict(probe1="data")
+        generator = Mock()
+        generator.name = "/test/test.txt/test.txt.genshi"
+        generator.get_template_vars.return_value = dict(
+            name="/test.txt", metadata=metadata, helper=Mock())
+
+        self.assertEqual(pool.render(generator, entry, metadata), "data")
+        generator.get_template_vars.assert_called_with(entry, metadata)
+        args = workers.apply.call_args[0][1]
+        self.assertEqual(args[:4], (generator.__class__, generator.name,
+                                    generator.specific, 0))
+        self.assertXMLEqual(lxml.etree.XML(args[4]), entry)
+        template_vars = dict((k, cPickle.loads(v))
+                             for k, v in args[5].items())
+        self.assertEqual(template_vars['name'], "/test.txt")
+        self.assertIsInstance(template_vars['helper'], UnpicklableValue)
+        rendered = template_vars['metadata']
+        self.assertIsInstance(rendered, ClientMetadata)
+        self.assertEqual(rendered.hostname, "foo.example.com")
+        self.assertItemsEqual(rendered.groups, ["group1", "profile"])
+        self.assertEqual(rendered.Probes, dict(probe1="data"))
+        self.assertTrue(rendered.inGroup("group1"))
+        self.assertIsInstance(rendered.query, UnpicklableValue)
+        self.assertRaises(PluginExecutionError,
+                          rendered.group_in_category, "category")
+
+        # metadata is only pickled once per metadata object, and
+        # workers are told to reload templates after Cfg events
+        pool.expire()
+        self.assertEqual(pool.render(generator, entry, metadata), "data")
+        args2 = workers.apply.call_args[0][1]
+        self.assertEqual(args2[3], 1)
+        self.assertIs(args2[5]['metadata'], args[5]['metadata'])
+
+        # failures in the workers are rendered locally
+        workers.apply.return_value = (False, "ValueError: bogus")
+        self.assertIsNone(pool.render(generator, entry, metadata))
+
+
 class TestCfg(TestGroupSpool, TestPullTarget):
     test_obj = Cfg
 
@@ -809,12 +1020,22 @@ class TestCfg(TestGroupSpool, TestPullTarget):
         TestGroupSpool.setUp(self)
         TestPullTarget.setUp(self)
         set_setup_default("cfg_handlers", [])
+        set_setup_default("cfg_render_processes", 0)
 
     def get_obj(self, core=None):
         if core is None:
             core = Mock()
         return TestGroupSpool.get_obj(self, core=core)
 
+    @patch("Bcfg2.Server.Plugin.GroupSpool.HandleEvent")
+    def test_HandleEvent_render_pool(self, mock_HandleEvent):
+        cfg = self.get_obj()
+        cfg.render_pool = Mock()
+        evt = Mock()
+        cfg.HandleEvent(evt)
+        cfg.render_pool.expire.assert_called_with()
+        mock_HandleEvent.assert_called_with(cfg, evt)
+
     def test_has_generator(self):
         cfg = self.get_obj()
         cfg.entries = dict()
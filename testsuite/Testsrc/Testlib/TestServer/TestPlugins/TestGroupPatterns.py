@@ -80,6 +80,66 @@ class TestPatternMap(Bcfg2TestCase):
                     self.assertItemsEqual(pmap.process(name), ret)
 
 
+class TestPatternMatcher(Bcfg2TestCase):
+    def test_literal_prefix(self):
+        tests = [("^foo", "foo"),
+                 ("^foo\\d+", "foo"),
+                 ("^foo-(\\d+)\\.example\\.com$", "foo-"),
+                 ("^fooo?bar", "foo"),
+                 ("^foo*", "fo"),
+                 ("^foo{2}", "fo"),
+                 ("^foo|bar", ""),
+                 ("foo", ""),
+                 ("^.*foo", ""),
+                 ("(?i)^foo", "")]
+        for regex, prefix in tests:
+            self.assertEqual(literal_prefix(regex), prefix)
+
+    def test_noncapturing(self):
+        tests = [("foo(.*)", "foo(?:.*)"),
+                 ("^([a-z])foo(?:bar)(?P<baz>.+)",
+                  "^(?:[a-z])foo(?:bar)(?:.+)"),
+                 ("foo\\(bar\\)", "foo\\(bar\\)"),
+                 ("[(]foo[]()]", "[(]foo[]()]"),
+                 ("[^]()]", "[^]()]"),
+                 ("(.)\\1", None),
+                 ("(?P<foo>.)(?P=foo)", None),
+                 ("(?i)foo", None),
+                 ("(a)?(?(1)b|c)", None)]
+        for regex, rv in tests:
+            self.assertEqual(noncapturing(regex), rv)
+
+    def get_patterns(self):
+        rv = [PatternMap("^web\\d+\\.", None, ["web"]),
+              PatternMap("^db(\\d+)\\.", None, ["db", "db$1"]),
+              PatternMap(None, "web[[1-5]].example.com", ["web-low"]),
+              PatternMap("\\.example\\.com$", None, ["example"]),
+              PatternMap("(?i)^WEB", None, ["web-ci"]),
+              PatternMap("^(.)\\1", None, ["double"]),
+              PatternMap("(?P<site>[a-z]+)\\.com$", None, ["com-$1"]),
+              PatternMap("[]|]", None, ["odd"]),
+              PatternMap("^w|^d", None, ["w-or-d"]),
+              PatternMap(".*", None, ["all"])]
+        for i in range(200):
+            rv.append(PatternMap("site%d" % i, None, ["site%d" % i]))
+        return rv
+
+    def test_process(self):
+        patterns = self.get_patterns()
+        matcher = PatternMatcher(patterns)
+        hostnames = ["web1.example.com", "web10.example.com",
+                     "WEB3.example.org", "db12.example.com",
+                     "ddb1.example.com", "w", "", "foo]bar.com",
+                     "web1.site17.example.com", "site199", "site2000"]
+        for hostname in hostnames:
+            expected = []
+            for pmap in patterns:
+                grps = pmap.process(hostname)
+                if grps is not None:
+                    expected.extend(grps)
+            self.assertEqual(matcher.process(hostname), expected)
+
+
 class TestPatternFile(TestXMLFileBacked):
     test_obj = PatternFile
     should_monitor = True
@@ -99,11 +159,13 @@ class TestPatternFile(TestXMLFileBacked):
             return self.test_obj(path, core=core)
         return inner()
 
+    @patch("Bcfg2.Server.Plugins.GroupPatterns.PatternMatcher")
     @patch("Bcfg2.Server.Plugins.GroupPatterns.PatternMap")
-    def test_Index(self, mock_PatternMap):
+    def test_Index(self, mock_PatternMap, mock_PatternMatcher):
         TestXMLFileBacked.test_Index(self)
         core = Mock()
         pf = self.get_obj(core=core)
+        pf.cache["foo.example.com"] = ["test1"]
 
         pf.data = """
 <GroupPatterns>
@@ -124,17 +186,23 @@ class TestPatternFile(TestXMLFileBacked):
         self.assertItemsEqual(mock_PatternMap.call_args_list,
                               [call("foo.*", None, ["test1", "test2"]),
                                call(None, "foo[[1-5]]", ["test3"])])
+        mock_PatternMatcher.assert_called_with(pf.patterns)
+        self.assertEqual(pf.matcher, mock_PatternMatcher.return_value)
+        self.assertEqual(pf.cache, dict())
 
     def test_process_patterns(self):
         pf = self.get_obj()
-        pf.patterns = [Mock(), Mock(), Mock()]
-        pf.patterns[0].process.return_value = ["a", "b"]
-        pf.patterns[1].process.return_value = None
-        pf.patterns[2].process.return_value = ["b", "c"]
+        pf.matcher = Mock()
+        pf.matcher.process.return_value = ["a", "b", "b", "c"]
+        self.assertItemsEqual(pf.process_patterns("foo.example.com"),
+                              ["a", "b", "b", "c"])
+        pf.matcher.process.assert_called_with("foo.example.com")
+
+        # results are cached until config.xml changes
+        pf.matcher.reset_mock()
         self.assertItemsEqual(pf.process_patterns("foo.example.com"),
                               ["a", "b", "b", "c"])
-        for pat in pf.patterns:
-            pat.process.assert_called_with("foo.example.com")
+        self.assertFalse(pf.matcher.process.called)
 
 
 class TestGroupPatterns(TestPlugin, TestConnector):
@@ -2,9 +2,11 @@ import os
 import sys
 import copy
 import time
+import random
 import socket
 import lxml.etree
 import Bcfg2.Server
+import Bcfg2.Server.Cache
 import Bcfg2.Server.Plugin
 from mock import Mock, MagicMock, patch
 
@@ -18,6 +20,7 @@ while path != "/":
         break
     path = os.path.dirname(path)
 from common import *
+from Bcfg2.Compat import cPickle
 from Bcfg2.Server.Plugins.Metadata import load_django_models
 from TestPlugin import TestXMLFileBacked, TestMetadata as _TestMetadata, \
     TestClientRunHooks, TestDatabaseBacked
@@ -97,6 +100,7 @@ def get_metadata_object(core=None):
         core.metadata_cache = MagicMock()
 
     set_setup_default("password")
+    set_setup_default("metadata_registration_interval")
     @patchIf(not isinstance(os.makedirs, Mock), "os.makedirs", Mock())
     @patchIf(not isinstance(lxml.etree.Element, Mock),
              "lxml.etree.Element", Mock())
@@ -106,6 +110,64 @@ def get_metadata_object(core=None):
     return inner()
 
 
+def get_random_groups_tree(seed, count=60):
+    """ Get a groups.xml tree with randomly nested, negated, and
+    categorized group memberships """
+    rand = random.Random(seed)
+    root = lxml.etree.Element("Groups")
+    names = ["group%d" % i for i in range(count)]
+    for name in names:
+        group = lxml.etree.SubElement(root, "Group", name=name)
+        if rand.random() < 0.3:
+            group.set("category", "category%d" % rand.randint(0, 4))
+    for _ in range(count * 3):
+        parent = root
+        for _ in range(rand.randint(1, 3)):
+            if rand.random() < 0.2:
+                parent = lxml.etree.SubElement(
+                    parent, "Client", name="client%d" % rand.randint(0, 4))
+            else:
+                parent = lxml.etree.SubElement(parent, "Group",
+                                               name=rand.choice(names))
+            if rand.random() < 0.2:
+                parent.set("negate", "true")
+        leaf = lxml.etree.SubElement(parent, "Group", name=rand.choice(names))
+        if rand.random() < 0.1:
+            leaf.set("negate", "true")
+    return root
+
+
+def reference_merge_groups(metadata, client, groups, categories):
+    """ The group membership algorithm that
+    :class:`Bcfg2.Server.Plugins.Metadata.GroupMembershipEvaluator`
+    must give identical results to """
+    numgroups = -1
+    while numgroups != len(groups):
+        numgroups = len(groups)
+        newgroups = set()
+        removegroups = set()
+        for grpname in metadata.ordered_groups:
+            if grpname in groups:
+                continue
+            if any(p(client, groups, categories)
+                   for p in metadata.group_membership[grpname]):
+                newgroups.add(grpname)
+                if (grpname in metadata.groups and
+                        metadata.groups[grpname].category):
+                    categories[metadata.groups[grpname].category] = grpname
+        groups.update(newgroups)
+        for grpname, predicates in metadata.negated_groups.items():
+            if grpname not in groups:
+                continue
+            if any(p(client, groups, categories) for p in predicates):
+                removegroups.add(grpname)
+                if (grpname in metadata.groups and
+                        metadata.groups[grpname].category):
+                    categories.pop(metadata.groups[grpname].category, None)
+        groups.difference_update(removegroups)
+    return (groups, categories)
+
+
 class TestMetadataDB(DBModelTestCase):
     if HAS_DJANGO:
         models = [MetadataClientModel]
@@ -770,10 +832,12 @@ class TestMetadata(_TestMetadata, TestClientRunHooks, TestDatabaseBacked):
             raliases[alias.getparent().get("name")].add(alias.get("name"))
         self.assertItemsEqual(metadata.raliases, raliases)
 
-        self.assertEqual(metadata.secure,
-                         [c.get("name")
-                          for c in get_clients_test_tree().findall("//Client[@secure='true']")])
-        self.assertEqual(metadata.floating, ["client1", "client10"])
+        self.assertItemsEqual(metadata.secure,
+                              [c.get("name")
+                               for c in get_clients_test_tree().findall("//Client[@secure='true']")])
+        self.assertItemsEqual(metadata.floating, ["client1", "client10"])
+        self.assertEqual(metadata.uuid, dict(uuid1="client3"))
+        self.assertEqual(metadata.ruuid, dict(client3="uuid1"))
 
         addresses = dict([(c.get("address"), [])
                            for c in get_clients_test_tree().findall("//*[@address]")])
@@ -795,6 +859,83 @@ class TestMetadata(_TestMetadata, TestClientRunHooks, TestDatabaseBacked):
         self.assertItemsEqual(metadata.raddresses, raddresses)
         self.assertTrue(metadata.states['clients.xml'])
 
+    @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
+    def test_reload_expires_changed_clients(self):
+        metadata = self.load_clients_data(metadata=self.load_groups_data())
+        metadata.core.metadata_cache_mode = "initial"
+
+        def build_all():
+            Bcfg2.Server.Cache.expire("Metadata")
+            for client in metadata.clients:
+                metadata.get_initial_metadata(client)
+            return dict(metadata.cache)
+
+        orig_get_group_membership = metadata._get_group_membership
+
+        def get_group_membership(*args):
+            # metadata can still be built while groups.xml is parsed
+            self.assertNotIn(False, metadata.states.values())
+            return orig_get_group_membership(*args)
+
+        metadata._get_group_membership = get_group_membership
+
+        # changing one client in clients.xml only expires that client
+        cached = build_all()
+        clients = copy.deepcopy(get_clients_test_tree())
+        clients.find("//Client[@name='client2']").set("profile", "group1")
+        lxml.etree.SubElement(clients.getroot(), "Client", name="client11",
+                              profile="group1")
+        self.load_clients_data(metadata=metadata, xdata=clients)
+        self.assertItemsEqual(metadata.cache.keys(),
+                              [c for c in cached if c != "client2"])
+        self.assertIn("client11", metadata.clients)
+        self.assertEqual(metadata.get_initial_metadata("client2").profile,
+                         "group1")
+
+        # changing a group no client is a member of expires nothing
+        cached = build_all()
+        groups = copy.deepcopy(get_groups_test_tree())
+        lxml.etree.SubElement(groups.find("//Group[@name='group7']"),
+                              "Bundle", name="bundle4")
+        self.load_groups_data(metadata=metadata, xdata=groups)
+        self.assertItemsEqual(metadata.cache.keys(), cached.keys())
+        self.assertItemsEqual(metadata.groups['group7'].bundles,
+                              ["bundle3", "bundle4"])
+
+        # changing a group expires its members
+        cached = build_all()
+        groups = copy.deepcopy(groups)
+        lxml.etree.SubElement(groups.getroot().find("Group[@name='group8']"),
+                              "Bundle", name="bundle4")
+        self.load_groups_data(metadata=metadata, xdata=groups)
+        members = [c for c, m in cached.items() if "group8" in m.groups]
+        self.assertTrue(members)
+        self.assertItemsEqual(metadata.cache.keys(),
+                              [c for c in cached if c not in members])
+        for client in members:
+            self.assertIn("bundle4",
+                          metadata.get_initial_metadata(client).bundles)
+
+        # adding a membership for one client expires only that client
+        cached = build_all()
+        groups = copy.deepcopy(groups)
+        client = lxml.etree.SubElement(groups.getroot(), "Client",
+                                       name="client5")
+        lxml.etree.SubElement(client, "Group", name="group5")
+        self.load_groups_data(metadata=metadata, xdata=groups)
+        self.assertItemsEqual(metadata.cache.keys(),
+                              [c for c in cached if c != "client5"])
+        self.assertIn("group5",
+                      metadata.get_initial_metadata("client5").groups)
+
+        # changing the default group expires everything
+        build_all()
+        groups = copy.deepcopy(groups)
+        groups.find("//Group[@name='group1']").set("default", "false")
+        groups.find("//Group[@name='group2']").set("default", "true")
+        self.load_groups_data(metadata=metadata, xdata=groups)
+        self.assertEqual(metadata.cache.keys(), [])
+
     def load_groups_data(self, metadata=None, xdata=None):
         if metadata is None:
             metadata = self.get_obj()
@@ -908,6 +1049,75 @@ class TestMetadata(_TestMetadata, TestClientRunHooks, TestDatabaseBacked):
             metadata.clients_xml.write.assert_any_call()
             self.assertEqual(metadata.clientgroups["uuid_new"], ["group1"])
 
+    def test_set_uuid(self):
+        metadata = self.get_obj()
+        metadata._set_uuid("uuid1", "client1")
+        metadata._set_uuid("uuid2", "client2")
+        self.assertEqual(metadata.uuid, dict(uuid1="client1",
+                                             uuid2="client2"))
+        self.assertEqual(metadata.ruuid, dict(client1="uuid1",
+                                              client2="uuid2"))
+
+        # moving a uuid to another client
+        metadata._set_uuid("uuid1", "client3")
+        self.assertEqual(metadata.uuid, dict(uuid1="client3",
+                                             uuid2="client2"))
+        self.assertEqual(metadata.ruuid, dict(client2="uuid2",
+                                              client3="uuid1"))
+
+        # giving a client a new uuid
+        metadata._set_uuid("uuid3", "client2")
+        self.assertEqual(metadata.uuid["uuid3"], "client2")
+        self.assertEqual(metadata.ruuid["client2"], "uuid3")
+
+    @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
+    def test_register_client(self):
+        metadata = self.load_clients_data(metadata=self.load_groups_data())
+        if metadata._use_db:
+            return
+        metadata.clients_xml.write_xml = Mock()
+        metadata.clients_xml.write = Mock()
+        old_interval = Bcfg2.Options.setup.metadata_registration_interval
+        Bcfg2.Options.setup.metadata_registration_interval = 600
+        try:
+            new1 = self.get_nonexistent_client(metadata)
+            metadata.set_profile(new1, "group1", None)
+            new2 = self.get_nonexistent_client(metadata)
+            metadata.session_cache[('1.2.3.6', None)] = (None, new2)
+            metadata.set_profile("uuid_new", "group2", ('1.2.3.6', None))
+
+            # new clients are available immediately, but not written
+            self.assertFalse(metadata.clients_xml.write_xml.called)
+            self.assertFalse(metadata.clients_xml.write.called)
+            self.assertIsNotNone(metadata._registration_timer)
+            self.assertIn(new1, metadata.clients)
+            self.assertIn(new2, metadata.clients)
+            self.assertEqual(metadata.uuid["uuid_new"], new2)
+            self.assertIn(new2, metadata.addresses["1.2.3.6"])
+            self.assertEqual(metadata.get_initial_metadata(new1).profile,
+                             "group1")
+            for client in new1, new2:
+                self.assertIsNotNone(
+                    metadata.search_client(client,
+                                           metadata.clients_xml.xdata))
+                self.assertIsNotNone(
+                    metadata.search_client(client,
+                                           metadata.clients_xml.base_xdata))
+
+            # all new clients are written at once
+            metadata.flush_registrations()
+            metadata.clients_xml.write_xml.assert_called_once_with(
+                os.path.join(metadata.data, "clients.xml"),
+                metadata.clients_xml.basedata, reread=False)
+            self.assertEqual(metadata.clients_xml.pending, [])
+            self.assertIsNone(metadata._registration_timer)
+            metadata.clients_xml.write_xml.reset_mock()
+            metadata.flush_registrations()
+            self.assertFalse(metadata.clients_xml.write_xml.called)
+        finally:
+            Bcfg2.Options.setup.metadata_registration_interval = old_interval
+            metadata.flush_registrations()
+
     @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
     @patch("socket.getnameinfo")
     def test_resolve_client(self, mock_getnameinfo):
@@ -1037,6 +1247,65 @@ class TestMetadata(_TestMetadata, TestClientRunHooks, TestDatabaseBacked):
                          (set(["group1", "group8", "group9", "group10"]),
                           dict(group1="category1")))
 
+    @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
+    def test_merge_groups_evaluator(self):
+        for seed in range(5):
+            metadata = self.get_obj()
+            self.load_groups_data(metadata=metadata,
+                                  xdata=get_random_groups_tree(seed))
+            rand = random.Random(seed)
+            for _ in range(30):
+                client = "client%d" % rand.randint(0, 6)
+                initial = set(rand.sample(list(metadata.groups.keys()),
+                                          rand.randint(0, 4)))
+                initial.add("probed-group")
+                categories = dict()
+                for group in initial:
+                    if group in metadata.groups:
+                        category = metadata.groups[group].category
+                        if category and category not in categories:
+                            categories[category] = group
+                expected = reference_merge_groups(metadata, client,
+                                                  set(initial),
+                                                  dict(categories))
+                # evaluate twice to check memoized results, too
+                for _ in range(2):
+                    groups = set(initial)
+                    cats = dict(categories)
+                    self.assertEqual(
+                        metadata._merge_groups(client, groups, cats),
+                        expected)
+                    # groups and categories are updated in place
+                    self.assertEqual((groups, cats), expected)
+
+    @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
+    def test_snapshot(self):
+        metadata = self.get_obj()
+        self.load_groups_data(metadata=metadata)
+        self.load_clients_data(metadata=metadata)
+        snapshot = cPickle.loads(cPickle.dumps(metadata.get_snapshot(), 2))
+
+        child = self.get_obj()
+        child.use_snapshots()
+        self.assertEqual(child.handlers, dict())
+        self.assertIn(False, child.states.values())
+
+        child.load_snapshot(snapshot)
+        self.assertNotIn(False, child.states.values())
+        self.assertItemsEqual(child.groups.keys(), metadata.groups.keys())
+        self.assertItemsEqual(child.clients, metadata.clients)
+        for name, group in metadata.groups.items():
+            self.assertEqual(child.groups[name].category, group.category)
+            self.assertEqual(child.groups[name].is_profile, group.is_profile)
+            self.assertItemsEqual(child.groups[name].bundles, group.bundles)
+        for client, groups in [("client1", ["group1"]),
+                               ("client8", ["group1", "group8", "group9"])]:
+            self.assertEqual(
+                child._merge_groups(client, set(groups),
+                                    categories=dict(group1="category1")),
+                metadata._merge_groups(client, set(groups),
+                                       categories=dict(group1="category1")))
+
     @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
     def test_get_all_group_names(self):
         metadata = self.load_groups_data()
@@ -1076,6 +1345,61 @@ class TestMetadata(_TestMetadata, TestClientRunHooks, TestDatabaseBacked):
                               [c.get("name")
                                for c in get_clients_test_tree().findall("//Client[@profile='group2']")])
 
+    @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
+    def test_client_index(self):
+        metadata = self.load_clients_data(metadata=self.load_groups_data())
+        built = []
+
+        def build_metadata(client):
+            built.append(client)
+            return metadata.get_initial_metadata(client)
+
+        metadata.core.build_metadata = Mock()
+        metadata.core.build_metadata.side_effect = build_metadata
+        metadata.core.metadata_cache_mode = "off"
+        queries = [(metadata.get_client_names_by_profiles, ["group2"]),
+                   (metadata.get_client_names_by_profiles,
+                    ["group1", "group2"]),
+                   (metadata.get_client_names_by_groups, ["group2"]),
+                   (metadata.get_client_names_by_groups,
+                    ["group1", "group4"]),
+                   (metadata.get_client_names_by_groups, []),
+                   (metadata.get_client_names_by_bundles, ["bundle1"]),
+                   (metadata.get_client_names_by_bundles,
+                    ["bundle1", "bundle2"])]
+        expected = [sorted(query(names)) for query, names in queries]
+        self.assertTrue(any(expected))
+        self.assertTrue(len(built) > len(metadata.clients))
+
+        metadata.core.metadata_cache_mode = "aggressive"
+        Bcfg2.Server.Cache.expire("Metadata")
+        del built[:]
+        self.assertEqual([sorted(query(names)) for query, names in queries],
+                         expected)
+        self.assertItemsEqual(built, metadata.clients)
+
+        # expiring one client only rebuilds that client
+        del built[:]
+        Bcfg2.Server.Cache.expire("Metadata", "client1")
+        self.assertEqual([sorted(query(names)) for query, names in queries],
+                         expected)
+        self.assertEqual(built, ["client1"])
+
+        # metadata built before an expiration is not indexed
+        epoch = metadata.client_index.epoch
+        Bcfg2.Server.Cache.expire("Metadata", "client2")
+        metadata.client_index.add("client2",
+                                  metadata.get_initial_metadata("client2"),
+                                  epoch)
+        self.assertNotIn("client2", metadata.client_index.clients)
+
+        # expiring all clients rebuilds everything
+        del built[:]
+        Bcfg2.Server.Cache.expire("Metadata")
+        self.assertEqual([sorted(query(names)) for query, names in queries],
+                         expected)
+        self.assertItemsEqual(built, metadata.clients)
+
     @patch("Bcfg2.Server.Plugins.Metadata.XMLMetadataConfig.load_xml", Mock())
     def test_merge_additional_groups(self):
         metadata = self.load_clients_data(metadata=self.load_groups_data())
@@ -1348,6 +1672,10 @@ class TestMetadataBase(TestMetadata):
     def test_process_statistics(self):
         pass
 
+    def test_reload_expires_changed_clients(self):
+        # the client list is read from the database, not clients.xml
+        pass
+
 
 class TestMetadata_NoClientsXML(TestMetadataBase):
     """ test Metadata without a clients.xml. we have to disable or
@@ -0,0 +1,188 @@
+import os
+import sys
+import random
+from mock import Mock, patch
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+from Bcfg2.Server.Cache import LRUCache
+from Bcfg2.Server.Plugins.Packages.Collection import *
+
+
+class DummyCollection(Collection):
+    """ Collection that resolves dependencies from an in-memory
+    graph """
+    def __init__(self, deps, vpkgs, recommends):
+        Collection.__init__(self, Mock(), [], datastore, datastore)
+        self.deps = deps
+        self.vpkgs = vpkgs
+        self.recommends = recommends
+
+    def get_relevant_groups(self):
+        return []
+
+    def is_package(self, package):
+        return package in self.deps
+
+    def get_vpkgs(self):
+        return self.vpkgs
+
+    def get_deps(self, package, recs=None):
+        rv = list(self.deps.get(package, []))
+        if recs and recs.get(package) == "true":
+            rv.extend(self.recommends.get(package, []))
+        return rv
+
+    def filter_unknown(self, unknown):
+        pass
+
+
+def reference_complete(collection, packagelist, recommended):
+    """ The dependency resolution algorithm that
+    :func:`Bcfg2.Server.Plugins.Packages.Collection.Collection.complete`
+    must give identical results to. """
+    vpkg_cache = collection.get_vpkgs()
+    unclassified = set(packagelist)
+    vpkgs = set()
+    both = set()
+    pkgs = set(packagelist)
+    packages = set()
+    examined = set()
+    unknown = set()
+    final_pass = False
+    really_done = False
+    while unclassified or pkgs or both or final_pass:
+        if really_done:
+            break
+        if len(unclassified) + len(pkgs) + len(both) == 0:
+            really_done = True
+        while unclassified:
+            current = unclassified.pop()
+            examined.add(current)
+            is_pkg = collection.is_package(current)
+            is_vpkg = current in vpkg_cache
+            if is_pkg and is_vpkg:
+                both.add(current)
+            elif is_pkg and not is_vpkg:
+                pkgs.add(current)
+            elif is_vpkg and not is_pkg:
+                vpkgs.add(current)
+            elif not is_vpkg and not is_pkg:
+                unknown.add(current)
+        while pkgs:
+            current = pkgs.pop()
+            packages.add(current)
+            deps = collection.get_deps(current, recommended)
+            unclassified.update(set(deps).difference(examined))
+        satisfied_vpkgs = set()
+        for current in vpkgs:
+            if len(vpkg_cache[current]) == 1:
+                unclassified.update(vpkg_cache[current].difference(examined))
+            satisfied_vpkgs.add(current)
+        vpkgs.difference_update(satisfied_vpkgs)
+        satisfied_both = set()
+        for current in both:
+            satisfiers = [item for item in vpkg_cache[current]
+                          if item in packages]
+            if satisfiers:
+                satisfied_both.add(current)
+            elif current in packagelist or final_pass:
+                pkgs.add(current)
+                satisfied_both.add(current)
+        both.difference_update(satisfied_both)
+        if len(unclassified) + len(pkgs) == 0:
+            final_pass = True
+        else:
+            final_pass = False
+    return packages, unknown
+
+
+class TestCollection(Bcfg2TestCase):
+    def setUp(self):
+        Bcfg2TestCase.setUp(self)
+        set_setup_default("debug", False)
+
+    def get_collection(self, seed):
+        rand = random.Random(seed)
+        pkgs = ["pkg%d" % i for i in range(300)]
+        virtual = ["virt%d" % i for i in range(30)]
+        unknown = ["unknown%d" % i for i in range(10)]
+        vpkgs = dict()
+        for name in virtual + rand.sample(pkgs, 20):
+            vpkgs[name] = set(rand.sample(pkgs, rand.randint(1, 3)))
+        symbols = pkgs + virtual + unknown
+        deps = dict()
+        recommends = dict()
+        for name in pkgs:
+            deps[name] = rand.sample(symbols, rand.randint(0, 4))
+            if rand.random() < 0.2:
+                recommends[name] = rand.sample(symbols, 2)
+        patcher = patch.object(sys.modules[Collection.__module__], "get_fam")
+        patcher.start()
+        try:
+            return DummyCollection(deps, vpkgs, recommends), symbols
+        finally:
+            patcher.stop()
+
+    def test_complete(self):
+        for seed in range(3):
+            collection, symbols = self.get_collection(seed)
+            rand = random.Random(seed)
+            closures = LRUCache(100)
+            for _ in range(20):
+                base = set(rand.sample(symbols, rand.randint(1, 25)))
+                recommended = dict()
+                for name in rand.sample(symbols, 5):
+                    recommended[name] = rand.choice(["true", "false"])
+                for recs in [None, recommended]:
+                    expected = reference_complete(collection, base, recs)
+                    self.assertEqual(collection.complete(base, recs), expected)
+                    self.assertEqual(
+                        collection.complete(base, recs, closures=closures),
+                        expected)
+            self.assertLessEqual(len(closures), 100)
+
+    def test_complete_reuses_closures(self):
+        collection, symbols = self.get_collection(0)
+        get_deps = collection.get_deps
+        calls = []
+
+        def record_get_deps(package, recs=None):
+            calls.append(package)
+            return get_deps(package, recs)
+
+        collection.get_deps = record_get_deps
+        closures = dict()
+        base = set(symbols[:50])
+        collection.complete(base, closures=closures)
+        self.assertTrue(calls)
+
+        # resolving the same set again only gets the dependencies of
+        # packages that are also virtual packages, since whether or
+        # not they are included depends on the whole set
+        del calls[:]
+        collection.complete(base, closures=closures)
+        self.assertTrue(calls)
+        self.assertItemsEqual([p for p in calls
+                               if p not in collection.vpkgs], [])
+
+        # resolving a set with one more package does not resolve the
+        # dependencies of any package that has already been resolved
+        del calls[:]
+        collection.get_deps = get_deps
+        expected = reference_complete(collection, base | set(["pkg299"]),
+                                      None)
+        collection.get_deps = record_get_deps
+        self.assertEqual(collection.complete(base | set(["pkg299"]),
+                                             closures=closures),
+                         expected)
+        self.assertLessEqual(len(calls), 5)
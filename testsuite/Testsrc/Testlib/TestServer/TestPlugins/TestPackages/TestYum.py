@@ -0,0 +1,153 @@
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import lxml.etree
+from mock import Mock, patch
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+from Bcfg2.Server.Plugins.Packages.Yum import *
+
+COMMON_NS = 'http://linux.duke.edu/metadata/common'
+RPM_NS = 'http://linux.duke.edu/metadata/rpm'
+FILELISTS_NS = 'http://linux.duke.edu/metadata/filelists'
+
+
+def write_repodata(path, count=2000, files=30):
+    """ Write a synthetic primary.xml.gz and filelists.xml.gz with
+    ``count`` packages, each of which owns ``files`` files. """
+    primary = os.path.join(path, "primary.xml.gz")
+    fdata = gzip.open(primary, 'wb')
+    fdata.write(('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<metadata xmlns="%s" xmlns:rpm="%s" packages="%d">\n' %
+                 (COMMON_NS, RPM_NS, count)).encode('UTF-8'))
+    for i in range(count):
+        requires = "".join('<rpm:entry name="pkg%d"/>' % ((i + j) % count)
+                           for j in range(1, 4))
+        requires += '<rpm:entry name="/usr/bin/tool%d"/>' % ((i + 1) % count)
+        fdata.write((
+            '<package type="rpm"><name>pkg%d</name><arch>x86_64</arch>'
+            '<version epoch="0" ver="1.%d" rel="1"/>'
+            '<summary>Package %d</summary>'
+            '<description>Synthetic package %d</description>'
+            '<format><rpm:license>GPL</rpm:license>'
+            '<rpm:provides><rpm:entry name="pkg%d"/>'
+            '<rpm:entry name="libpkg%d.so"/><rpm:entry name="common"/>'
+            '</rpm:provides><rpm:requires>%s</rpm:requires>'
+            '</format></package>\n' %
+            (i, i, i, i, i, i, requires)).encode('UTF-8'))
+    fdata.write('</metadata>\n'.encode('UTF-8'))
+    fdata.close()
+
+    filelists = os.path.join(path, "filelists.xml.gz")
+    fdata = gzip.open(filelists, 'wb')
+    fdata.write(('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<filelists xmlns="%s" packages="%d">\n' %
+                 (FILELISTS_NS, count)).encode('UTF-8'))
+    for i in range(count):
+        pfiles = "".join("<file>/usr/share/pkg%d/file%d</file>" % (i, j)
+                         for j in range(files))
+        fdata.write((
+            '<package pkgid="%032x" name="pkg%d" arch="x86_64">'
+            '<version epoch="0" ver="1.%d" rel="1"/>'
+            '<file>/usr/bin/tool%d</file>%s</package>\n' %
+            (i, i, i, i, pfiles)).encode('UTF-8'))
+    fdata.write('</filelists>\n'.encode('UTF-8'))
+    fdata.close()
+    return primary, filelists
+
+
+def get_source(basepath):
+    xsource = lxml.etree.Element("Source", type="yum",
+                                 rawurl="http://example.com/repo/")
+    lxml.etree.SubElement(xsource, "Arch").text = "x86_64"
+    return YumSource(basepath, xsource)
+
+
+def dom_parse(source, primary, filelists):
+    """ Parse repodata the way YumSource did before it used
+    iterparse """
+    source.parse_primary(lxml.etree.parse(primary).getroot(), "x86_64")
+    root = lxml.etree.parse(filelists).getroot()
+    source.parse_filelist(root.findall(FL + 'package'), "x86_64")
+
+
+class TestYumSource(Bcfg2TestCase):
+    def setUp(self):
+        Bcfg2TestCase.setUp(self)
+        set_setup_default("debug", False)
+        set_setup_default("use_yum_libraries", False)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_obj(self):
+        return get_source(self.tmpdir)
+
+    def test_iterparse_packages(self):
+        primary, filelists = write_repodata(self.tmpdir, count=20, files=2)
+        self.assertEqual(
+            [p.findtext(XP + "name")
+             for p in iterparse_packages(primary, XP + "package")],
+            ["pkg%d" % i for i in range(20)])
+
+        # uncompressed files are also supported
+        plain = os.path.join(self.tmpdir, "filelists.xml")
+        open(plain, 'wb').write(gzip.open(filelists).read())
+        for pkg in iterparse_packages(plain, FL + "package"):
+            self.assertEqual(len(pkg.findall(FL + "file")), 3)
+            # previously returned elements have been cleared and
+            # removed from the tree
+            prev = pkg.getprevious()
+            if prev is not None:
+                self.assertEqual(len(prev), 0)
+                self.assertIsNone(prev.getprevious())
+
+    def test_read_files(self):
+        primary, filelists = write_repodata(self.tmpdir, count=50, files=2)
+        source = self.get_obj()
+        source.file_to_arch = {primary: "x86_64", filelists: "x86_64"}
+        source.save_state = Mock()
+        with_files = patch.object(YumSource, "files",
+                                  new=property(lambda s: [primary,
+                                                          filelists]))
+        with_files.start()
+        try:
+            source.read_files()
+        finally:
+            with_files.stop()
+        self.assertTrue(source.save_state.called)
+
+        expected = self.get_obj()
+        dom_parse(expected, primary, filelists)
+        self.assertItemsEqual(source.packages['global'],
+                              ["pkg%d" % i for i in range(50)])
+        self.assertItemsEqual(source.deps['x86_64'].keys(),
+                              expected.deps['x86_64'].keys())
+        for pkg, deps in source.deps['x86_64'].items():
+            self.assertIsInstance(deps, tuple)
+            self.assertItemsEqual(deps, expected.deps['x86_64'][pkg])
+        self.assertEqual(source.provides['x86_64'],
+                         expected.provides['x86_64'])
+        self.assertEqual(len(source.provides['x86_64']['common']), 50)
+        self.assertEqual(source.filemap['x86_64'],
+                         expected.filemap['x86_64'])
+        self.assertEqual(source.filemap['x86_64']['/usr/bin/tool7'],
+                         set(["pkg7"]))
+
+        # names are shared between the dependency and provides data
+        dep = source.deps['x86_64']['pkg3'][0]
+        self.assertIs(dep, [p for p in source.provides['x86_64']
+                            if p == dep][0])
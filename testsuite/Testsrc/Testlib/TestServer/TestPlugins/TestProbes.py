@@ -165,7 +165,9 @@ group-specific"""
         p3 = Mock()
         p3.specific = Bcfg2.Server.Plugin.Specificity(all=True)
         p3.name = "barprobe"
-        p3.data = "#! /usr/bin/env python"
+        p3.data = """#! /usr/bin/env python
+# timeout: 30
+"""
         matching.append(p3)
 
         p4 = Mock()
@@ -189,14 +191,17 @@ group-specific"""
         self.assertEqual(len(pdata), 3,
                          "Found: %s" % [p.get("name") for p in pdata])
         for probe in pdata:
+            self.assertEqual(probe.get("conditional"), "true")
             if probe.get("name") == "fooprobe":
                 self.assertIn("group-specific", probe.text)
                 self.assertEqual(probe.get("interpreter"), "/bin/bash")
             elif probe.get("name") == "barprobe":
                 self.assertEqual(probe.get("interpreter"),
                                  "/usr/bin/env python")
+                self.assertEqual(probe.get("timeout"), "30")
             elif probe.get("name") == "bazprobe":
                 self.assertIsNotNone(probe.get("interpreter"))
+                self.assertIsNone(probe.get("timeout"))
             else:
                 assert False, "Strange probe found in get_probe_data() return"
 
@@ -281,6 +286,55 @@ group:      group:with:colons
         syncdb(TestProbesDB)
         self._perform_tests()
 
+    def test_ReceiveData_unchanged(self):
+        Bcfg2.Options.setup.probes_db = False
+        p = self.get_obj()
+        md = Mock(hostname="foo.example.com")
+
+        def get_datalist(**unchanged):
+            datalist = []
+            for key in ['xml', 'text']:
+                pdata = lxml.etree.Element("Probe", name=key)
+                if key in unchanged:
+                    pdata.set("unchanged", unchanged[key])
+                else:
+                    pdata.text = self.data[key]
+                datalist.append(pdata)
+            return datalist
+
+        p.ReceiveData(md, get_datalist())
+        expected = dict(xml=self.test_xdoc, text="freeform text")
+        self.assertItemsEqual(p.get_additional_groups(md), ["group"])
+        self.additionalDataEqual(p.get_additional_data(md), expected)
+
+        # unchanged probes keep their data and groups, and probed.xml
+        # is not rewritten if nothing has changed
+        p.probestore.commit = Mock()
+        p.ReceiveData(md, get_datalist(xml=probe_hash(self.data['xml']),
+                                       text=probe_hash(self.data['text'])))
+        self.assertItemsEqual(p.get_additional_groups(md), ["group"])
+        self.additionalDataEqual(p.get_additional_data(md), expected)
+        self.assertFalse(p.probestore.commit.called)
+
+        p.ReceiveData(md, get_datalist(xml=probe_hash(self.data['xml'])))
+        self.assertFalse(p.probestore.commit.called)
+
+        # a hash that does not match the stored data is rejected,
+        # and the client is asked to send the full output
+        self.assertEqual(
+            p.ReceiveData(md, get_datalist(text=probe_hash("other text"))),
+            ["text"])
+        self.assertFalse(p.probestore.commit.called)
+
+        # so is an unchanged marker after a server restart
+        p = self.get_obj()
+        Bcfg2.Server.Cache.expire("Probes")
+        self.assertEqual(
+            p.ReceiveData(md,
+                          get_datalist(text=probe_hash(self.data['text']))),
+            ["text"])
+        self.additionalDataEqual(p.get_additional_data(md), expected)
+
     def test_allowed_cgroups(self):
         """ Test option to only allow probes to set certain groups """
         probes = self.get_obj()
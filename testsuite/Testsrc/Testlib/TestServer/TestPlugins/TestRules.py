@@ -191,3 +191,30 @@ class TestRules(TestPrioDir):
         """ Test that Rules handles trailing slashes on Path entries """
         self._do_test('slash')
         self._do_test('no_slash')
+
+    def test_regex_exact(self):
+        """ Test that an exact name and a regular expression in the
+        same file conflict """
+        Bcfg2.Options.setup.rules_regex = True
+        r = self.get_obj()
+        rules4 = lxml.etree.Element("Rules", priority="30")
+        lxml.etree.SubElement(rules4, "Package", name="exact.*", type="apt")
+        lxml.etree.SubElement(rules4, "Package", name="exact-pkg",
+                              type="yum", version="1.0")
+        child = self.test_obj.__child__(
+            os.path.join(datastore, self.test_obj.name, "rules4.xml"))
+        child.data = lxml.etree.tostring(rules4)
+        child.Index()
+        r.entries["rules4.xml"] = child
+        metadata = Mock(groups=[])
+
+        entry = lxml.etree.Element("Package", name="exact-pkg")
+        self.assertRaises(PluginExecutionError,
+                          r.BindEntry, entry, metadata)
+
+        entry = lxml.etree.Element("Package", name="exact-other")
+        r.BindEntry(entry, metadata)
+        self.assertXMLEqual(entry,
+                            lxml.etree.Element("Package", name="exact-other",
+                                               type="apt"))
+        Bcfg2.Options.setup.rules_regex = False
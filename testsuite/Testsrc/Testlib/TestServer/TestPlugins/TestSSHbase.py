@@ -0,0 +1,287 @@
+import os
+import sys
+import socket
+import lxml.etree
+import Bcfg2.Server.Cache
+from mock import Mock, MagicMock, patch
+from Bcfg2.Server.Plugin import PluginExecutionError, Specificity
+from Bcfg2.Server.Plugins.SSHbase import *
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+from TestPlugin import TestPlugin
+
+
+def getaddrinfo(hostname, port):
+    """ fake socket.getaddrinfo() that gives each host in
+    example.com one address """
+    if not hostname.endswith(".example.com"):
+        raise socket.gaierror
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, '',
+             ("10.0.0.%d" % (len(hostname) % 256), 0))]
+
+
+def gethostbyaddr(address):
+    """ fake socket.gethostbyaddr() """
+    if not address.startswith("10."):
+        raise socket.herror
+    return ("host-%s.example.com" % address.replace(".", "-"), [], [address])
+
+
+class TestHostResolver(Bcfg2TestCase):
+    def get_obj(self, ttl=60, negative_ttl=10):
+        return HostResolver(ttl, negative_ttl)
+
+    @patch("time.time")
+    @patch("socket.gethostbyaddr")
+    @patch("socket.getaddrinfo")
+    def test_get_addresses(self, mock_getaddrinfo, mock_gethostbyaddr,
+                           mock_time):
+        mock_getaddrinfo.side_effect = getaddrinfo
+        mock_gethostbyaddr.side_effect = gethostbyaddr
+        mock_time.return_value = 1000
+        resolver = self.get_obj()
+        resolver.cmd = Mock()
+        resolver.cmd.run.return_value.success = False
+
+        self.assertItemsEqual(resolver.get_addresses("foo.example.com"),
+                              ["10.0.0.15"])
+        self.assertItemsEqual(resolver.get_names("10.0.0.15"),
+                              ["host-10-0-0-15.example.com"])
+        self.assertRaises(PluginExecutionError,
+                          resolver.get_addresses, "foo.example.org")
+        self.assertRaises(socket.herror,
+                          resolver.get_names, "192.168.0.1")
+        self.assertEqual(mock_getaddrinfo.call_count, 2)
+        self.assertEqual(mock_gethostbyaddr.call_count, 2)
+
+        # results are cached, including failures
+        mock_time.return_value = 1005
+        resolver.get_addresses("foo.example.com")
+        resolver.get_names("10.0.0.15")
+        self.assertRaises(PluginExecutionError,
+                          resolver.get_addresses, "foo.example.org")
+        self.assertRaises(socket.herror,
+                          resolver.get_names, "192.168.0.1")
+        self.assertEqual(mock_getaddrinfo.call_count, 2)
+        self.assertEqual(mock_gethostbyaddr.call_count, 2)
+
+        # failures expire after the negative ttl
+        mock_time.return_value = 1020
+        resolver.get_addresses("foo.example.com")
+        self.assertRaises(PluginExecutionError,
+                          resolver.get_addresses, "foo.example.org")
+        self.assertEqual(mock_getaddrinfo.call_count, 3)
+
+        # and successful lookups expire after the ttl
+        mock_time.return_value = 1070
+        resolver.get_addresses("foo.example.com")
+        self.assertEqual(mock_getaddrinfo.call_count, 4)
+
+    @patch("socket.getaddrinfo")
+    def test_get_addresses_getent(self, mock_getaddrinfo):
+        mock_getaddrinfo.side_effect = socket.gaierror
+        resolver = self.get_obj()
+        resolver.cmd = Mock()
+        resolver.cmd.run.return_value.success = True
+        resolver.cmd.run.return_value.stdout = \
+            "10.1.0.1      foo.example.com foo\n10.1.0.2 foo.example.com\n"
+        self.assertItemsEqual(resolver.get_addresses("foo.example.com"),
+                              ["10.1.0.1", "10.1.0.2"])
+        resolver.cmd.run.assert_called_with(["getent", "hosts",
+                                             "foo.example.com"])
+
+    @patch("socket.gethostbyaddr")
+    @patch("socket.getaddrinfo")
+    def test_prefetch(self, mock_getaddrinfo, mock_gethostbyaddr):
+        mock_getaddrinfo.side_effect = getaddrinfo
+        mock_gethostbyaddr.side_effect = gethostbyaddr
+        resolver = self.get_obj()
+        resolver.cmd = Mock()
+        resolver.cmd.run.return_value.success = False
+        hostnames = ["host%d.example.com" % i for i in range(20)] + \
+            ["unknown.example.org"]
+        resolver.prefetch(hostnames, 5)
+        self.assertEqual(mock_getaddrinfo.call_count, len(hostnames))
+        # host0..host9 and host10..host19 have two distinct addresses
+        self.assertEqual(mock_gethostbyaddr.call_count, 2)
+
+        mock_getaddrinfo.reset_mock()
+        mock_gethostbyaddr.reset_mock()
+        resolver.prefetch(hostnames, 5)
+        for hostname in hostnames[:-1]:
+            resolver.get_addresses(hostname)
+        self.assertFalse(mock_getaddrinfo.called)
+        self.assertFalse(mock_gethostbyaddr.called)
+
+
+class TestSSHbase(TestPlugin):
+    test_obj = SSHbase
+
+    def setUp(self):
+        TestPlugin.setUp(self)
+        set_setup_default("default_owner")
+        set_setup_default("default_group")
+        set_setup_default("default_mode")
+        set_setup_default("default_secontext")
+        set_setup_default("default_important", False)
+        set_setup_default("default_paranoid", False)
+        set_setup_default("default_sensitive", False)
+        set_setup_default("sshbase_passphrase", None)
+        set_setup_default("sshbase_dns_concurrency", 4)
+        set_setup_default("sshbase_dns_ttl", 3600)
+        set_setup_default("sshbase_dns_negative_ttl", 300)
+
+    def get_obj(self, core=None):
+        @patch("Bcfg2.Server.FileMonitor.get_fam", Mock())
+        def inner():
+            return TestPlugin.get_obj(self, core=core)
+        return inner()
+
+    def get_clients(self, sshbase, clients, groups):
+        """ Set up the metadata query interface of an SSHbase object
+        with the given clients and group memberships """
+        query = sshbase.core.metadata.query
+        query.all_clients.side_effect = lambda: list(clients)
+        query.by_name.side_effect = \
+            lambda h: Mock(hostname=h, aliases=[], addresses=[])
+        query.names_by_groups.side_effect = \
+            lambda g: [c for c in clients if g[0] in groups.get(c, [])]
+
+    def add_key(self, sshbase, pubkey, data, hostname=None, group=None):
+        """ Add a public key to an SSHbase object """
+        if hostname:
+            specific = Specificity(hostname=hostname)
+            name = "%s.H_%s" % (pubkey, hostname)
+        else:
+            specific = Specificity(group=group, prio=50)
+            name = "%s.G50_%s" % (pubkey, group)
+        entry = Mock(specific=specific, data=data)
+        entry.name = os.path.join(sshbase.data, name)
+        sshbase.entries["/etc/ssh/" + pubkey].entries[entry.name] = entry
+        return name
+
+    @patch("socket.gethostbyaddr")
+    @patch("socket.getaddrinfo")
+    def test_get_skn(self, mock_getaddrinfo, mock_gethostbyaddr):
+        mock_getaddrinfo.side_effect = getaddrinfo
+        mock_gethostbyaddr.side_effect = socket.herror
+        sshbase = self.get_obj()
+        sshbase.resolver.cmd = Mock()
+        sshbase.resolver.cmd.run.return_value.success = False
+        query = sshbase.core.metadata.query
+
+        # no clients yet
+        query.all_clients.return_value = []
+        self.assertFalse(sshbase.skn)
+
+        clients = ["foo.example.com", "bar.example.com", "baz.example.org"]
+        self.get_clients(sshbase, clients,
+                         {"foo.example.com": ["cluster"],
+                          "bar.example.com": ["cluster"]})
+        for client in clients:
+            self.add_key(sshbase, "ssh_host_rsa_key.pub",
+                         "ssh-rsa %s\n" % client, hostname=client)
+        self.add_key(sshbase, "ssh_host_rsa_key.pub",
+                     "ssh-rsa unknown\n", hostname="unknown.example.com")
+        self.add_key(sshbase, "ssh_host_dsa_key.pub", "ssh-dss cluster\n",
+                     group="cluster")
+        self.assertEqual(
+            sshbase.skn,
+            "10.0.0.15,foo,foo.example.com,10.0.0.15,bar,bar.example.com "
+            "ssh-dss cluster\n"
+            "10.0.0.15,bar,bar.example.com ssh-rsa bar.example.com\n"
+            "baz,baz.example.org ssh-rsa baz.example.org\n"
+            "10.0.0.15,foo,foo.example.com ssh-rsa foo.example.com\n")
+        self.assertItemsEqual([c[0][0] for c in query.by_name.call_args_list],
+                              clients)
+        self.assertEqual(mock_getaddrinfo.call_count, len(clients))
+
+        # the known hosts data is cached
+        query.by_name.reset_mock()
+        mock_getaddrinfo.reset_mock()
+        orig = sshbase.skn
+        self.assertEqual(sshbase.skn, orig)
+        self.assertFalse(query.by_name.called)
+        self.assertFalse(mock_getaddrinfo.called)
+
+        # a changed key only rebuilds that key's line
+        self.add_key(sshbase, "ssh_host_rsa_key.pub", "ssh-rsa new-foo\n",
+                     hostname="foo.example.com")
+        sshbase._get_line = Mock(wraps=sshbase._get_line)
+        sshbase.expire_key(sshbase.entries["/etc/ssh/ssh_host_rsa_key.pub"],
+                           "ssh_host_rsa_key.pub.H_foo.example.com")
+        self.assertEqual(sshbase.skn,
+                         orig.replace("ssh-rsa foo.example.com",
+                                      "ssh-rsa new-foo"))
+        # the key for the host that isn't a client is always checked
+        self.assertItemsEqual(
+            [c[0][0].specific.hostname
+             for c in sshbase._get_line.call_args_list],
+            ["foo.example.com", "unknown.example.com"])
+        del sshbase._get_line
+        self.assertFalse(query.by_name.called)
+        self.assertFalse(mock_getaddrinfo.called)
+
+        # exact expiration of a client's metadata doesn't change
+        # anything, but other expirations rebuild only the lines
+        # that use that client's names
+        Bcfg2.Server.Cache.expire("Metadata", "bar.example.com", exact=True)
+        Bcfg2.Server.Cache.expire("Metadata", "baz.example.org")
+        sshbase.skn
+        self.assertItemsEqual([c[0][0] for c in query.by_name.call_args_list],
+                              ["baz.example.org"])
+
+        # a client is added
+        clients.append("unknown.example.com")
+        query.by_name.reset_mock()
+        Bcfg2.Server.Cache.expire("Metadata", "unknown.example.com")
+        self.assertIn("unknown,unknown.example.com ssh-rsa unknown\n",
+                      sshbase.skn)
+        self.assertItemsEqual([c[0][0] for c in query.by_name.call_args_list],
+                              ["unknown.example.com"])
+
+        # expiring all metadata rebuilds everything, but DNS lookups
+        # are still cached
+        query.by_name.reset_mock()
+        mock_getaddrinfo.reset_mock()
+        Bcfg2.Server.Cache.expire("Metadata")
+        sshbase.skn
+        self.assertEqual(query.by_name.call_count, len(clients))
+        self.assertFalse(mock_getaddrinfo.called)
+
+    @patch("time.time")
+    @patch("socket.gethostbyaddr")
+    @patch("socket.getaddrinfo")
+    def test_get_skn_dns_expiry(self, mock_getaddrinfo, mock_gethostbyaddr,
+                                mock_time):
+        mock_getaddrinfo.side_effect = getaddrinfo
+        mock_gethostbyaddr.side_effect = socket.herror
+        mock_time.return_value = 1000
+        sshbase = self.get_obj()
+        sshbase.resolver.cmd = Mock()
+        sshbase.resolver.cmd.run.return_value.success = False
+        clients = ["foo.example.com", "bar.example.com"]
+        self.get_clients(sshbase, clients, dict())
+        for client in clients:
+            self.add_key(sshbase, "ssh_host_rsa_key.pub",
+                         "ssh-rsa %s\n" % client, hostname=client)
+        sshbase.skn
+        self.assertEqual(mock_getaddrinfo.call_count, 2)
+
+        mock_time.return_value = 2000
+        sshbase.skn
+        self.assertEqual(mock_getaddrinfo.call_count, 2)
+
+        # once the DNS lookups expire, they're redone
+        mock_time.return_value = 5000
+        sshbase.skn
+        self.assertEqual(mock_getaddrinfo.call_count, 4)
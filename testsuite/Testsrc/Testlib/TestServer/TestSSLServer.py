@@ -0,0 +1,89 @@
+import os
+import sys
+from mock import Mock
+
+# add all parent testsuite directories to sys.path to allow (most)
+# relative imports in python 2.4
+path = os.path.dirname(__file__)
+while path != "/":
+    if os.path.basename(path).lower().startswith("test"):
+        sys.path.append(path)
+    if os.path.basename(path) == "testsuite":
+        break
+    path = os.path.dirname(path)
+from common import *
+
+from Bcfg2.Compat import BytesIO, xmlrpclib
+from Bcfg2.Utils import gzip_compress, gzip_decompress
+from Bcfg2.Server.SSLServer import XMLRPCRequestHandler
+
+
+class TestXMLRPCRequestHandler(Bcfg2TestCase):
+    def get_obj(self, body, headers, threshold=None):
+        class Handler(XMLRPCRequestHandler):
+            # skip the constructor, which handles a request right away
+            def __init__(self):
+                pass
+
+        handler = Handler()
+        handler.logger = Mock()
+        handler.headers = dict(headers)
+        handler.headers["content-length"] = str(len(body))
+        handler.rfile = BytesIO(body)
+        handler.wfile = BytesIO()
+        handler.request = Mock()
+        handler.client_address = ("127.0.0.1", 12345)
+        handler.server = Mock()
+        handler.server.compression_threshold = threshold
+        handler.server._marshaled_dispatch.side_effect = \
+            lambda addr, data: xmlrpclib.dumps((data * 10,),
+                                               methodresponse=True)
+        handler.sent_headers = dict()
+        handler.send_response = Mock()
+        handler.send_header = Mock(
+            side_effect=lambda k, v: handler.sent_headers.__setitem__(k, v))
+        handler.end_headers = Mock()
+        return handler
+
+    def get_response(self, handler):
+        handler.do_POST()
+        handler.send_response.assert_called_with(200)
+        body = handler.wfile.getvalue()
+        self.assertEqual(handler.sent_headers["Content-length"],
+                         str(len(body)))
+        if handler.sent_headers.get("Content-Encoding") == "gzip":
+            body = gzip_decompress(body)
+        return xmlrpclib.loads(body)[0][0]
+
+    def test_do_POST(self):
+        request = "<methodCall>test</methodCall>"
+        expected = request * 10
+
+        # uncompressed request and response
+        handler = self.get_obj(request.encode('utf-8'), dict())
+        self.assertEqual(self.get_response(handler), expected)
+        self.assertNotIn("Content-Encoding", handler.sent_headers)
+        self.assertEqual(handler.sent_headers["Accept-Encoding"], "gzip")
+
+        # compressed request
+        handler = self.get_obj(gzip_compress(request.encode('utf-8')),
+                               {"Content-Encoding": "gzip"})
+        self.assertEqual(self.get_response(handler), expected)
+        self.assertNotIn("Content-Encoding", handler.sent_headers)
+
+        # responses above the threshold are compressed only if the
+        # client accepts gzip
+        handler = self.get_obj(request.encode('utf-8'), dict(), threshold=10)
+        self.assertEqual(self.get_response(handler), expected)
+        self.assertNotIn("Content-Encoding", handler.sent_headers)
+
+        handler = self.get_obj(request.encode('utf-8'),
+                               {"Accept-Encoding": "gzip"}, threshold=10)
+        self.assertEqual(self.get_response(handler), expected)
+        self.assertEqual(handler.sent_headers["Content-Encoding"], "gzip")
+
+        handler = self.get_obj(request.encode('utf-8'),
+                               {"Accept-Encoding": "identity, gzip;q=1.0"},
+                               threshold=10000)
+        self.assertEqual(self.get_response(handler), expected)
+        self.assertNotIn("Content-Encoding", handler.sent_headers)
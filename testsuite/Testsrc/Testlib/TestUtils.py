@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import traceback
 from Bcfg2.Utils import *
 
 # add all parent testsuite directories to sys.path to allow (most)
@@ -57,3 +58,45 @@ class TestIsString(Bcfg2TestCase):
         if not inPy3k:
             self.assertFalse(is_string("foo" + chr(128) + "bar", 'ascii'))
             self.assertFalse(is_string(ustr, 'ascii'))
+
+
+class TestGzip(Bcfg2TestCase):
+    def test_gzip(self):
+        data = "<value><string>test</string></value>\n".encode('utf-8') * 100
+        compressed = gzip_compress(data)
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(gzip_decompress(compressed), data)
+        self.assertEqual(gzip_decompress(gzip_compress("".encode('utf-8'))),
+                         "".encode('utf-8'))
+
+
+class TestProbeHash(Bcfg2TestCase):
+    def test_probe_hash(self):
+        self.assertEqual(probe_hash(None), probe_hash(""))
+        self.assertNotEqual(probe_hash("foo"), probe_hash("foo "))
+        # line endings are normalized as the XML parser does
+        self.assertEqual(probe_hash("foo\r\nbar\r"), probe_hash("foo\nbar\n"))
+        # byte strings are hashed as the text they encode
+        text = u"caf\xe9 \n"
+        self.assertEqual(probe_hash(text.encode('utf-8')), probe_hash(text))
+
+
+class TestParallelMap(Bcfg2TestCase):
+    def test_parallel_map(self):
+        self.assertEqual(parallel_map(lambda i: i * 2, range(10), 4),
+                         [i * 2 for i in range(10)])
+
+    def test_failure(self):
+        def fail_on_three(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+
+        try:
+            parallel_map(fail_on_three, range(10), 4)
+        except ValueError:
+            # the traceback reaches into the worker thread
+            stack = traceback.extract_tb(sys.exc_info()[2])
+            self.assertEqual(stack[-1][2], "fail_on_three")
+        else:
+            self.fail("parallel_map did not raise the worker's exception")